@@ -0,0 +1,115 @@
+"""Micro-benchmark of the poller decode plan against BinaryPayloadDecoder.
+
+Decodes a 123-register holding register block with 60 references, using the
+precompiled decode plan of `Poller` and the previous decoder path, which
+walked a `BinaryPayloadDecoder` register by register. The vectorized NumPy
+decode plan is included when NumPy is installed.
+
+Usage: python benchmarks/decode_benchmark.py [--number N]
+"""
+
+import argparse
+import random
+import timeit
+
+from pymodbus.constants import Endian
+from pymodbus.payload import BinaryPayloadDecoder
+
+from modpoll.modbus_task import Device, Poller, Reference
+
+BLOCK_SIZE = 123
+DTYPES = ["uint16", "int16", "uint32", "int32", "float32", "float64"]
+WIDTHS = {"uint16": 1, "int16": 1, "uint32": 2, "int32": 2, "float32": 2, "float64": 4}
+
+
+def build_poller(endian: str = "BE_LE") -> Poller:
+    device = Device("bench", 1)
+    poller = Poller(device, 3, 0, BLOCK_SIZE, endian)
+    address = 0
+    for i in range(60):
+        dtype = DTYPES[i % len(DTYPES)]
+        if address + WIDTHS[dtype] > BLOCK_SIZE:
+            dtype = "uint16"
+        scale = 0.1 if i % 3 == 0 else None
+        ref = Reference(device, f"ref{i:02d}", address, dtype, "r", None, scale)
+        poller.add_readable_reference(ref)
+        device.add_reference_mapping(ref)
+        address += WIDTHS[dtype]
+    poller.compile_decode_plan()
+    return poller
+
+
+def legacy_decode(poller: Poller, registers):
+    """The decoder path used before the decode plan was introduced."""
+    decoder = BinaryPayloadDecoder.fromRegisters(
+        registers, byteorder=Endian.BIG, wordorder=Endian.LITTLE
+    )
+    cur_ref = poller.start_address
+    for ref in poller.readableReferences:
+        while cur_ref < ref.address:
+            decoder.skip_bytes(2)
+            cur_ref += 1
+        decode_methods = {
+            "uint16": decoder.decode_16bit_uint,
+            "int16": decoder.decode_16bit_int,
+            "uint32": decoder.decode_32bit_uint,
+            "int32": decoder.decode_32bit_int,
+            "uint64": decoder.decode_64bit_uint,
+            "int64": decoder.decode_64bit_int,
+            "float16": decoder.decode_16bit_float,
+            "float32": decoder.decode_32bit_float,
+            "float64": decoder.decode_64bit_float,
+        }
+        ref.update_value(decode_methods[ref.dtype]())
+        poller.device.update_reference(ref)
+        cur_ref += ref.ref_width
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    registers = [random.randrange(0x10000) for _ in range(BLOCK_SIZE)]
+    poller = build_poller()
+
+    legacy_decode(poller, registers)
+    expected = [ref.val for ref in poller.readableReferences]
+    poller.decode(registers)
+    actual = [ref.val for ref in poller.readableReferences]
+    assert actual == expected or all(
+        a == e or (a != a and e != e) for a, e in zip(actual, expected)
+    ), "decode plan and BinaryPayloadDecoder disagree"
+
+    results = {
+        "BinaryPayloadDecoder": timeit.timeit(
+            lambda: legacy_decode(poller, registers), number=args.number
+        ),
+        "decode plan": timeit.timeit(
+            lambda: poller.decode(registers), number=args.number
+        ),
+    }
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        vector_poller = build_poller()
+        vector_poller.compile_decode_plan(numpy)
+        vector_poller.decode(registers)
+        assert repr([ref.val for ref in vector_poller.readableReferences]) == repr(
+            actual
+        ), "numpy and struct decode plans disagree"
+        results["numpy decode plan"] = timeit.timeit(
+            lambda: vector_poller.decode(registers), number=args.number
+        )
+    baseline = results["BinaryPayloadDecoder"]
+    print(f"{BLOCK_SIZE} registers, 60 references, {args.number} responses")
+    for name, total in results.items():
+        per_call = total / args.number * 1e6
+        print(f"{name:>22}: {per_call:8.1f} us/response  ({baseline / total:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
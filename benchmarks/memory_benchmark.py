@@ -0,0 +1,62 @@
+"""Memory benchmark of the parsed config objects.
+
+Parses a generated config with 10k references (100 devices with two pollers
+of 50 references each) and reports the memory held by the device list,
+measured with tracemalloc.
+
+Usage: python benchmarks/memory_benchmark.py [--references N]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from modpoll.modbus_task import ModbusHandler
+
+DTYPES = ["uint16", "int16", "float32", "uint32"]
+UNITS = ["V", "A", "kW", "kWh", "Hz"]
+REFS_PER_DEVICE = 100
+REFS_PER_POLLER = 50
+
+
+def generate_config(references: int):
+    rows = []
+    for d in range((references + REFS_PER_DEVICE - 1) // REFS_PER_DEVICE):
+        rows.append(["device", f"meter{d:04d}", str(d % 247 + 1)])
+        address = 0
+        for i in range(min(REFS_PER_DEVICE, references - d * REFS_PER_DEVICE)):
+            if i % REFS_PER_POLLER == 0:
+                rows.append(["poll", "holding_register", str(address), "100", "BE_BE"])
+            dtype = DTYPES[i % len(DTYPES)]
+            rows.append(
+                ["ref", f"value{i:03d}", str(address), dtype, "r", UNITS[i % 5], "0.1"]
+            )
+            address += 2 if dtype in ("float32", "uint32") else 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--references", type=int, default=10000)
+    args = parser.parse_args()
+
+    rows = generate_config(args.references)
+    modbus_handler = ModbusHandler(None, "benchmark.csv")
+    gc.collect()
+    tracemalloc.start()
+    device_list = modbus_handler._parse_config(rows)
+    for dev in device_list:
+        for p in dev.pollerList:
+            p.compile_decode_plan()
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    references = sum(len(dev.references) for dev in device_list)
+    print(f"{len(device_list)} devices, {references} references")
+    print(f"memory: {size / 1024:.0f} KiB ({size / references:.0f} bytes/reference)")
+    print(f"peak:   {peak / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
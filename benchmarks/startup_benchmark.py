@@ -0,0 +1,87 @@
+"""Startup benchmark of the modpoll CLI, measured with `python -X importtime`.
+
+Imports `modpoll.main` in fresh interpreters and reports the cumulative
+import time of it, as well as which of the optional heavy dependencies were
+imported. Those are only needed with MQTT, URL configs, the metrics server
+or the printed tables, so none of them should show up. Exits with 1 if one
+does, or if the median import time exceeds --max-ms.
+
+Usage: python benchmarks/startup_benchmark.py [--runs N] [--max-ms MS]
+"""
+
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+
+import modpoll
+
+MODULE = "modpoll.main"
+LAZY_MODULES = [
+    "requests",
+    "paho.mqtt.client",
+    "prettytable",
+    "http.server",
+    "sqlite3",
+    "modpoll.mqtt_task",
+    "modpoll.metrics",
+    "modpoll.export_task",
+]
+
+
+def measure_import() -> tuple:
+    """Return the cumulative import time in ms and the imported module names."""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    total = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        modules.add(name)
+        if name == MODULE:
+            total = int(cumulative) / 1000
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    # measure the imports only, not the compilation of stale bytecode
+    compileall.compile_dir(os.path.dirname(modpoll.__file__), quiet=1)
+    measure_import()
+    times = []
+    imported = set()
+    for _ in range(args.runs):
+        total, modules = measure_import()
+        times.append(total)
+        imported |= {name for name in LAZY_MODULES if name in modules}
+    median = statistics.median(times)
+    print(
+        f"import {MODULE}: median {median:.1f} ms, min {min(times):.1f} ms ({args.runs} runs)"
+    )
+    for name in LAZY_MODULES:
+        print(f"  {name:<22} {'imported' if name in imported else 'not imported'}")
+    failed = bool(imported)
+    if args.max_ms and median > args.max_ms:
+        print(f"Median import time exceeds {args.max_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import argparse
 
 from . import __version__
+from .config_loader import get_default_cache_dir
+from .utils import parse_deadband
 
 
 def get_parser():
@@ -20,6 +22,17 @@ def get_parser():
         help="A local path or URL of Modbus configuration file. Required!",
         nargs="+",
     )
+    parser.add_argument(
+        "--config-cache",
+        default=get_default_cache_dir(),
+        help="Directory to cache the configs loaded from URLs in, so they can be loaded while the config host is unreachable. Set to an empty string to disable. Defaults to %(default)s",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=0,
+        help="Check the configs for changes every given seconds and apply them without restarting. Configs are also reloaded on SIGHUP. Disabled by default",
+    )
     parser.add_argument(
         "-d",
         "--daemon",
@@ -31,17 +44,45 @@ def get_parser():
         "--rate",
         type=float,
         default=10.0,
-        help="The sampling rate (s) to poll modbus device, Defaults to 10.0",
+        help="The sampling rate (s) to poll modbus device unless a device/poller rate is set in the config, Defaults to 10.0",
     )
     parser.add_argument(
         "-1", "--once", action="store_true", help="Only run polling at one time"
     )
+    parser.add_argument(
+        "--overrun-policy",
+        choices=["skip", "catchup", "shift"],
+        default="skip",
+        help="What to do when polling takes longer than the rate: skip the missed cycles and stay aligned, catch up by polling again right away, or shift the schedule. Defaults to skip",
+    )
     parser.add_argument(
         "--interval",
         type=float,
         default=0.5,
         help="The time interval in seconds between two polling, Defaults to 0.5",
     )
+    parser.add_argument(
+        "--adaptive-interval",
+        action="store_true",
+        help="Adapt the interval between two requests to the response time and timeouts of each endpoint, using --interval as the upper bound",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Poll the serial buses and TCP/UDP endpoints in parallel with one connection each, naming the transport of each device in its config. Requests on one bus or endpoint are always sent in order",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=8,
+        help="Max. number of endpoints or serial buses polled at the same time, Defaults to 8",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Split the devices of the Modbus configs by endpoint across the given number of worker processes, publishing their results from this one. The devices of one serial port or TCP/UDP endpoint are never split. Crashed workers are restarted. Disabled by default",
+    )
     parser.add_argument(
         "--tcp", help="Act as a Modbus TCP master, connecting to host TCP"
     )
@@ -73,11 +114,87 @@ def get_parser():
         default=3.0,
         help="Response time-out seconds for MODBUS devices, Defaults to 3.0",
     )
+    parser.add_argument(
+        "--timeout-budget",
+        type=int,
+        default=0,
+        help="Number of time-outs of a device per poll cycle before its remaining pollers are skipped until the next cycle. Disabled by default",
+    )
+    parser.add_argument(
+        "--liveness-timeout",
+        type=float,
+        default=0,
+        help="Response time-out seconds of a single register probe sent to a device which failed its last poll, before polling it. A device failing the probe is skipped for the rest of the cycle. Disabled by default",
+    )
+    parser.add_argument(
+        "--decoder",
+        choices=["struct", "numpy"],
+        default="struct",
+        help="Decoder for Modbus responses. The numpy decoder vectorizes the decoding of large pollers and requires NumPy. Defaults to struct",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Merge adjacent pollers of the same device and object type into fewer Modbus requests",
+    )
+    parser.add_argument(
+        "--coalesce-gap",
+        type=int,
+        default=0,
+        help="Max. number of unused registers/coils between two pollers to still merge them, Defaults to 0",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="Keep Modbus connections open between polling cycles and writes, reconnecting with backoff only when a request fails",
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        default=30.0,
+        help="TCP keepalive idle time in seconds for persistent connections, 0 to disable. Defaults to 30.0",
+    )
+    parser.add_argument(
+        "--reconnect-delay",
+        type=float,
+        default=1.0,
+        help="Initial delay in seconds before reconnecting a persistent connection, doubled after each failed attempt. Defaults to 1.0",
+    )
+    parser.add_argument(
+        "--reconnect-delay-max",
+        type=float,
+        default=60.0,
+        help="Max. delay in seconds between reconnect attempts, Defaults to 60.0",
+    )
     parser.add_argument(
         "-o",
         "--export",
         default=None,
-        help="The file name to export references/registers",
+        help="The file name to append the polled references/registers to",
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=["jsonl", "csv", "parquet", "json"],
+        default=None,
+        help="Format of the export file: JSON lines, CSV, Parquet (requires pyarrow), or a JSON file rewritten with the last values. Defaults to the file extension, or jsonl",
+    )
+    parser.add_argument(
+        "--export-flush-interval",
+        type=float,
+        default=1.0,
+        help="Time in seconds between two flushes of the export file, Defaults to 1.0",
+    )
+    parser.add_argument(
+        "--export-rotate-size",
+        type=int,
+        default=0,
+        help="Rotate the export file once it is larger than this number of bytes, 0 to disable. Defaults to 0",
+    )
+    parser.add_argument(
+        "--export-rotate-interval",
+        type=float,
+        default=0,
+        help="Rotate the export file after this time in seconds, 0 to disable. Defaults to 0",
     )
     parser.add_argument(
         "--mqtt-version",
@@ -121,6 +238,17 @@ def get_parser():
         default="modpoll/{{device_name}}/diagnostics",
         help="Topic pattern for MQTT diagnostics. Use {{device_name}} as placeholder for the device names in Modbus config. Defaults to modpoll/{{device_name}}/diagnostics",
     )
+    parser.add_argument(
+        "--mqtt-ack-topic-pattern",
+        default="modpoll/{{device_name}}/ack",
+        help="Topic pattern for MQTT acknowledgements of write requests, with their result and latency. Use {{device_name}} as placeholder for the device names in Modbus config. Defaults to modpoll/{{device_name}}/ack",
+    )
+    parser.add_argument(
+        "--write-window",
+        type=float,
+        default=0,
+        help="Time in seconds to hold back write requests so that writes to the same or adjacent registers are merged into fewer Modbus requests, Defaults to 0",
+    )
     parser.add_argument(
         "--mqtt-qos",
         choices=[0, 1, 2],
@@ -152,16 +280,97 @@ def get_parser():
         action="store_true",
         help="Publish each value in a single topic. If not specified, groups all values in one topic.",
     )
+    parser.add_argument(
+        "--on-change",
+        action="store_true",
+        help="Only publish references whose value changed beyond their deadband since last published",
+    )
+    parser.add_argument(
+        "--deadband",
+        type=parse_deadband,
+        default=None,
+        help="Default deadband for --on-change, either absolute (e.g. 0.5) or a percentage of the last published value (e.g. 2%%). Can be set per reference in the config",
+    )
+    parser.add_argument(
+        "--heartbeat",
+        type=float,
+        default=0,
+        help="Max. time in seconds before an unchanged reference is published again with --on-change, Defaults to 0 (never)",
+    )
+    parser.add_argument(
+        "--mqtt-queue-size",
+        type=int,
+        default=1000,
+        help="Max. number of messages waiting to be published to MQTT, 0 to publish synchronously. Defaults to 1000",
+    )
+    parser.add_argument(
+        "--mqtt-queue-policy",
+        choices=["drop_oldest", "coalesce", "block"],
+        default="drop_oldest",
+        help="What to do when the MQTT publish queue is full: drop the oldest message, replace the latest queued message with the same topic (dropping the oldest one if there is none), or wait. Defaults to drop_oldest",
+    )
+    parser.add_argument(
+        "--mqtt-batch-size",
+        type=int,
+        default=100,
+        help="Max. number of queued messages published per flush, Defaults to 100",
+    )
+    parser.add_argument(
+        "--mqtt-buffer",
+        default=None,
+        help="SQLite file to store messages in while the MQTT broker cannot be reached, replayed once it is back. Requires the publish queue (--mqtt-queue-size > 0). Use with --timestamp to keep the time of each sample",
+    )
+    parser.add_argument(
+        "--mqtt-buffer-size",
+        type=int,
+        default=100000,
+        help="Max. number of messages in the MQTT buffer, the oldest are dropped beyond. Defaults to 100000",
+    )
+    parser.add_argument(
+        "--mqtt-replay-rate",
+        type=float,
+        default=10.0,
+        help="Max. number of buffered messages replayed per second after reconnecting, Defaults to 10.0",
+    )
     parser.add_argument(
         "--diagnostics-rate",
         type=float,
         default=0,
         help="Time in seconds as publishing period for each device diagnostics",
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="Serve Prometheus metrics of polling and publishing on this port at /metrics, 0 to disable. Defaults to 0",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default="0.0.0.0",
+        help="Address to serve the Prometheus metrics on, Defaults to 0.0.0.0",
+    )
     parser.add_argument(
         "--autoremove",
         action="store_true",
-        help="Automatically remove poller if modbus communication has failed 3 times.",
+        help="Quarantine pollers and devices which keep failing, backing off exponentially and probing them with a single request before resuming. Pollers refused by the device are removed",
+    )
+    parser.add_argument(
+        "--quarantine-threshold",
+        type=int,
+        default=3,
+        help="Number of consecutive failures before a poller or device is quarantined with --autoremove, Defaults to 3",
+    )
+    parser.add_argument(
+        "--quarantine-delay",
+        type=float,
+        default=10.0,
+        help="Initial time in seconds a poller or device is quarantined for, doubled after each failed probe. Defaults to 10.0",
+    )
+    parser.add_argument(
+        "--quarantine-delay-max",
+        type=float,
+        default=600.0,
+        help="Max. time in seconds a poller or device is quarantined for, Defaults to 600.0",
     )
     parser.add_argument(
         "--loglevel",
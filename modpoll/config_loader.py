@@ -0,0 +1,171 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+if TYPE_CHECKING:
+    import requests
+
+REMOTE_SCHEMES = ("http", "https")
+
+
+def get_default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "modpoll")
+
+
+class Config:
+    """The rows of a Modbus config, with the version they were loaded at."""
+
+    __slots__ = ("location", "rows", "version", "source")
+
+    def __init__(self, location: str, rows: List[List[str]], version, source: str):
+        self.location = location
+        self.rows = rows
+        self.version = version
+        # "file", "remote" or "cache" if a remote config was loaded from the disk cache
+        self.source = source
+
+
+class ConfigLoader:
+    """Load Modbus configs from local paths or http(s) URLs.
+
+    Local files are only read again once their modification time or size has
+    changed. Remote configs are fetched with `If-None-Match` and
+    `If-Modified-Since`, and stored in `cache_dir` so they can be loaded
+    while the config host is unreachable. Loading an unchanged config
+    returns the same `Config` object as before.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, timeout: float = 3.0):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+        self._configs: Dict[str, Config] = {}
+        self._session: Optional["requests.Session"] = None
+
+    def load(self, location: str) -> Optional[Config]:
+        """Return the config at `location`, None if it cannot be loaded."""
+        url = urlparse(location)
+        if url.scheme in REMOTE_SCHEMES:
+            return self._load_remote(location)
+        if url.scheme == "file":
+            return self._load_file(location, unquote(url.path))
+        # a single letter is the drive of a Windows path
+        if len(url.scheme) <= 1:
+            return self._load_file(location, location)
+        self.logger.error(f"Unsupported config location: {location}")
+        return None
+
+    def _load_file(self, location: str, path: str) -> Optional[Config]:
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            cached = self._configs.get(location)
+            if cached is not None and cached.version == version:
+                return cached
+            with open(path, "r") as f:
+                rows = list(csv.reader(f))
+        except OSError as e:
+            self.logger.error(f"Error opening file: {e}")
+            return None
+        config = Config(location, rows, version, "file")
+        self._configs[location] = config
+        return config
+
+    def _load_remote(self, location: str) -> Optional[Config]:
+        # requests is slow to import, local configs do without it
+        import requests
+
+        cached = self._configs.get(location)
+        if cached is None:
+            cached = self._read_cache(location)
+        headers = {}
+        if cached is not None:
+            etag, last_modified = cached.version
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        try:
+            if self._session is None:
+                self._session = requests.Session()
+            response = self._session.get(
+                location, headers=headers, timeout=self.timeout
+            )
+            if response.status_code == 304 and cached is not None:
+                self.logger.debug(f"Config {location} not modified")
+                config = cached
+            else:
+                response.raise_for_status()
+                content = response.content.decode("utf-8")
+                version = (
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+                config = Config(
+                    location, list(csv.reader(content.splitlines())), version, "remote"
+                )
+                self._write_cache(config, content)
+        except (requests.RequestException, UnicodeDecodeError) as e:
+            if cached is None:
+                self.logger.error(f"Error loading config from {location}: {e}")
+                return None
+            self.logger.warning(
+                f"Error loading config from {location}: {e}, using the cached copy."
+            )
+            config = cached
+        self._configs[location] = config
+        return config
+
+    def _get_cache_path(self, location: str) -> str:
+        name = hashlib.sha1(location.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    def _read_cache(self, location: str) -> Optional[Config]:
+        if not self.cache_dir:
+            return None
+        path = self._get_cache_path(location)
+        try:
+            with open(f"{path}.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(f"{path}.csv", "r", encoding="utf-8", newline="") as f:
+                rows = list(csv.reader(f))
+        except (OSError, ValueError):
+            return None
+        if meta.get("location") != location:
+            return None
+        version = (meta.get("etag"), meta.get("last_modified"))
+        return Config(location, rows, version, "cache")
+
+    def _write_cache(self, config: Config, content: str):
+        if not self.cache_dir:
+            return
+        path = self._get_cache_path(config.location)
+        etag, last_modified = config.version
+        meta = {
+            "location": config.location,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # write to temporary files first, so a crash never leaves a torn cache
+            with open(f"{path}.csv.tmp", "w", encoding="utf-8", newline="") as f:
+                f.write(content)
+            with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(f"{path}.csv.tmp", f"{path}.csv")
+            os.replace(f"{path}.json.tmp", f"{path}.json")
+        except OSError as e:
+            self.logger.warning(f"Failed to cache config {config.location}: {e}")
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
@@ -0,0 +1,273 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+from typing import Dict, List, Optional
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet", "json")
+WRITE_BUFFER_SIZE = 1024 * 1024
+CSV_FIELDS = ["timestamp", "device", "reference", "value"]
+
+
+def get_export_format(file: str, export_format: Optional[str] = None) -> str:
+    """Return the export format, guessed from the file extension if not given."""
+    if export_format:
+        return export_format
+    ext = os.path.splitext(file)[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    if ext == ".json":
+        return "json"
+    return "jsonl"
+
+
+class ExportSink:
+    """Append polled values to a file as they come, instead of rewriting it.
+
+    Rows are buffered and flushed every `flush_interval` seconds. The file
+    is rotated once it grows beyond `rotate_size` bytes or has been open for
+    `rotate_interval` seconds: it is renamed with the time it was rotated and
+    a new file is started. JSON lines hold one row per device and poll, CSV
+    and Parquet one row per reference with the columns of `CSV_FIELDS`.
+    A JSON file is not appended to but rewritten on every flush, with the
+    last values of every device.
+
+    Rows pending for longer than `flush_interval` are also flushed by a
+    background thread, so they are written while polling is idle.
+    """
+
+    def __init__(
+        self,
+        file: str,
+        export_format: Optional[str] = None,
+        flush_interval: float = 1.0,
+        rotate_size: int = 0,
+        rotate_interval: float = 0,
+    ):
+        self.file = file
+        self.format = get_export_format(file, export_format)
+        if self.format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {self.format}")
+        self.flush_interval = flush_interval
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.rowCount = 0
+        self.rotateCount = 0
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._stream = None
+        self._csv_writer = None
+        self._parquet = None
+        self._parquet_writer = None
+        self._batch: List[dict] = []
+        self._snapshot: Dict[str, dict] = {}
+        self._pending = False
+        self._is_open = False
+        self._opened = 0.0
+        self._last_flush = 0.0
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if self.format == "parquet":
+            self._parquet = _import_pyarrow()
+
+    def _open(self):
+        self._is_open = True
+        now = time.monotonic()
+        self._opened = now
+        self._last_flush = now
+        if self._flusher is None and self.flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name="ExportFlusher", daemon=True
+            )
+            self._flusher.start()
+        if self.format == "json":
+            return
+        if self.format == "parquet":
+            # Parquet files are only readable once closed, so a new file is started
+            if os.path.exists(self.file):
+                self._rotate_file()
+            return
+        new_file = not os.path.exists(self.file) or os.path.getsize(self.file) == 0
+        self._stream = open(
+            self.file, "a", buffering=WRITE_BUFFER_SIZE, encoding="utf-8", newline=""
+        )
+        if self.format == "csv":
+            self._csv_writer = csv.writer(self._stream)
+            if new_file:
+                self._csv_writer.writerow(CSV_FIELDS)
+
+    def write(self, device_name: str, values: dict, timestamp: float):
+        """Append the values of the references of a device, polled at `timestamp`."""
+        with self._lock:
+            try:
+                if not self._is_open:
+                    self._open()
+                if self.format == "jsonl":
+                    row = {"timestamp": timestamp, "device": device_name}
+                    row.update(values)
+                    self._stream.write(json.dumps(row) + "\n")
+                    self.rowCount += 1
+                elif self.format == "json":
+                    # references not polled this time keep their last value
+                    entry = self._snapshot.setdefault(device_name, {})
+                    entry.update(values)
+                    entry["timestamp"] = timestamp
+                    self.rowCount += 1
+                elif self.format == "csv":
+                    self._csv_writer.writerows(
+                        [timestamp, device_name, name, _format_value(value)]
+                        for name, value in values.items()
+                    )
+                    self.rowCount += len(values)
+                else:
+                    self._batch.extend(
+                        _parquet_row(timestamp, device_name, name, value)
+                        for name, value in values.items()
+                    )
+                    self.rowCount += len(values)
+                self._pending = True
+                now = time.monotonic()
+                if now - self._last_flush >= self.flush_interval:
+                    self._flush()
+                if self._needs_rotation(now):
+                    self._close()
+                    self._rotate_file()
+            except OSError as e:
+                self.logger.error(f"Error exporting data: {e}")
+
+    def _run_flusher(self):
+        while not self._stop.wait(self.flush_interval / 2):
+            with self._lock:
+                if not self._pending:
+                    continue
+                if time.monotonic() - self._last_flush < self.flush_interval:
+                    continue
+                try:
+                    self._flush()
+                except OSError as e:
+                    self.logger.error(f"Error exporting data: {e}")
+
+    def _needs_rotation(self, now: float) -> bool:
+        if self.format == "json":
+            # a snapshot does not grow
+            return False
+        if self.rotate_interval and now - self._opened >= self.rotate_interval:
+            return True
+        if self.rotate_size:
+            if self._stream is not None:
+                size = self._stream.tell()
+            else:
+                size = os.path.getsize(self.file) if os.path.exists(self.file) else 0
+            return size >= self.rotate_size
+        return False
+
+    def _rotate_file(self):
+        if not os.path.exists(self.file):
+            return
+        stamp = datetime.datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        stem, ext = os.path.splitext(self.file)
+        os.replace(self.file, f"{stem}.{stamp}{ext}")
+        self.rotateCount += 1
+        self.logger.info(f"Rotated export file {self.file}")
+
+    def _flush(self):
+        self._pending = False
+        self._last_flush = time.monotonic()
+        if self._stream is not None:
+            self._stream.flush()
+        elif self.format == "json":
+            if self._snapshot:
+                self._write_snapshot()
+        elif self._batch:
+            pa = self._parquet
+            table = pa.Table.from_pylist(self._batch, schema=_parquet_schema(pa))
+            if self._parquet_writer is None:
+                self._parquet_writer = pa.parquet.ParquetWriter(self.file, table.schema)
+            # every flush is written as one row group
+            self._parquet_writer.write_table(table)
+            self._batch = []
+
+    def _write_snapshot(self):
+        # replaced at once, so readers never see a partly written file
+        with open(f"{self.file}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self._snapshot, f, indent=2)
+        os.replace(f"{self.file}.tmp", self.file)
+
+    def _close(self):
+        self._flush()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+            self._csv_writer = None
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        self._is_open = False
+
+    def flush(self):
+        with self._lock:
+            try:
+                self._flush()
+            except OSError as e:
+                self.logger.error(f"Error exporting data: {e}")
+
+    def get_stats(self) -> dict:
+        return {"rows": self.rowCount, "rotations": self.rotateCount}
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            try:
+                self._close()
+            except OSError as e:
+                self.logger.error(f"Error closing export file: {e}")
+
+
+def _format_value(value):
+    # lists (bits) and strings are written as JSON, so they can be told apart
+    if isinstance(value, (list, str)):
+        return json.dumps(value)
+    return value
+
+
+def _parquet_row(timestamp: float, device_name: str, name: str, value) -> dict:
+    number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    return {
+        "timestamp": timestamp,
+        "device": device_name,
+        "reference": name,
+        "value": float(value) if number else None,
+        "text": None if number or value is None else json.dumps(value),
+    }
+
+
+def _parquet_schema(pa):
+    return pa.schema(
+        [
+            ("timestamp", pa.float64()),
+            ("device", pa.string()),
+            ("reference", pa.string()),
+            ("value", pa.float64()),
+            ("text", pa.string()),
+        ]
+    )
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise ValueError(
+            "Exporting to Parquet requires pyarrow. Install it with `pip install pyarrow`."
+        )
+    return pyarrow
@@ -1,19 +1,33 @@
 import json
 import logging
-import re
 import signal
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
 from .arg_parser import get_parser
-from .mqtt_task import MqttHandler
-from .modbus_task import setup_modbus_handlers
+from .modbus_task import (
+    DEFAULT_WRITE_PRIORITY,
+    ConfigReloader,
+    DeviceRegistry,
+    group_by_client,
+    setup_modbus_handlers,
+    poll_handlers,
+)
 
 from . import __version__
-from .utils import set_threading_event, delay_thread, on_threading_event, get_utc_time
+from .utils import (
+    set_threading_event,
+    delay_thread,
+    on_threading_event,
+    get_utc_time,
+    wait_thread,
+)
 
 
 LOG_SIMPLE = "%(asctime)s | %(levelname).1s | %(name)s | %(message)s"
-logger = None
+logger = logging.getLogger(__name__)
 
 
 def _signal_handler(signal, frame):
@@ -21,13 +35,164 @@ def _signal_handler(signal, frame):
     set_threading_event()
 
 
+def _get_wait_time(modbus_handlers, *next_times) -> Optional[float]:
+    """Return the time in seconds until the next poller, write or other task is due, None if never."""
+    deadlines = [h.next_poll_time() for h in modbus_handlers]
+    deadlines += [h.next_write_time() for h in modbus_handlers]
+    deadlines += next_times
+    deadlines = [t for t in deadlines if t is not None]
+    if not deadlines:
+        return None
+    return max(0.0, min(deadlines) - time.monotonic())
+
+
+def _process_writes(modbus_handlers, busy=()):
+    """Send the queued write requests, except on the clients in `busy` still being polled."""
+    for modbus_handler in modbus_handlers:
+        if id(modbus_handler.modbus_client) not in busy:
+            modbus_handler.process_writes()
+
+
+def _handle_write_request(topic, payload, registry):
+    """Queue a write request received from MQTT, called in the MQTT network thread."""
+    device_name = registry.match_topic(topic)
+    if device_name is None:
+        logger.error(f"Failed to extract device name from topic: {topic}")
+        return
+    logger.info(f"Received request to write data for device {device_name}")
+    entry = registry.get_device(device_name)
+    if entry is None:
+        logger.error(f"No device found with name: {device_name}")
+        return
+    modbus_handler = entry[0]
+    try:
+        reg = json.loads(payload)
+        if not isinstance(reg, dict):
+            logger.error(f"Write request must be a JSON object: {payload}")
+            return
+        priority = reg.get("priority", DEFAULT_WRITE_PRIORITY)
+        if "reference" in reg:
+            # shorthand to write a single reference by name
+            reg["values"] = {reg["reference"]: reg["value"]}
+        if "values" in reg:
+            modbus_handler.submit_reference_write(
+                device_name,
+                reg["values"],
+                priority=priority,
+                request_id=reg.get("id"),
+            )
+        else:
+            modbus_handler.submit_write(
+                device_name,
+                reg["object_type"],
+                reg["address"],
+                reg["value"],
+                priority=priority,
+                request_id=reg.get("id"),
+            )
+    except KeyError as e:
+        logger.error(f"Missing required key in payload: {e}")
+    except ValueError:
+        # invalid JSON or UTF-8
+        logger.error(f"Failed to parse JSON message: {payload}")
+
+
+def poll_loop(
+    args,
+    modbus_handlers,
+    exporter=None,
+    publish_queue=None,
+    executor=None,
+    registry=None,
+    on_reload=None,
+):
+    """Poll the handlers until the threading event is set, or once with --once.
+
+    `on_reload` is called after a reloaded config has been swapped in.
+    """
+    # configs are reloaded on SIGHUP or every --reload-interval, without restarting
+    reloader = ConfigReloader(modbus_handlers, args.reload_interval)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request())
+
+    # main loop: sleep until the next poller or diagnostics is due, or a write request arrives
+    next_diag = time.monotonic() if args.diagnostics_rate > 0 else None
+    while not on_threading_event():
+        # swap in reloaded configs between two poll cycles
+        if reloader.check():
+            if registry:
+                registry.update(modbus_handlers)
+            if on_reload:
+                on_reload()
+        now = get_utc_time()
+        # poll the handlers with pollers due
+        due_handlers = [h for h in modbus_handlers if h.is_poll_due()]
+        if due_handlers:
+            logger.debug(f"Polling {len(due_handlers)} config(s) with due pollers")
+            # handlers left to poll per client, other threads may be using those clients
+            polling: Dict[int, int] = {}
+            for modbus_handler in due_handlers:
+                client = id(modbus_handler.modbus_client)
+                polling[client] = polling.get(client, 0) + 1
+            for modbus_handler in poll_handlers(due_handlers, executor):
+                if on_threading_event():
+                    break
+                client = id(modbus_handler.modbus_client)
+                polling[client] -= 1
+                if not polling[client]:
+                    del polling[client]
+                _process_writes(modbus_handlers, polling)
+                # only the values read in this cycle, not those of pollers not due
+                if args.mqtt_host:
+                    if args.timestamp:
+                        modbus_handler.publish_data(timestamp=now, only_polled=True)
+                    else:
+                        modbus_handler.publish_data(only_polled=True)
+                if exporter:
+                    modbus_handler.export(timestamp=now, only_polled=True)
+        if next_diag is not None and time.monotonic() >= next_diag:
+            next_diag = time.monotonic() + args.diagnostics_rate
+            for modbus_handler in modbus_handlers:
+                modbus_handler.publish_diagnostics()
+            if publish_queue is not None:
+                stats = publish_queue.get_stats()
+                logger.info(
+                    f"MQTT publish queue: depth={stats['queue_depth']}, dropped={stats['dropped']}, in-flight={stats['inflight']}"
+                )
+                if publish_queue.buffer is not None:
+                    logger.info(
+                        f"MQTT buffer: buffered={stats['buffered']}, fill={stats['buffer_fill']:.1%}, dropped={stats['buffer_dropped']}, replayed={stats['replayed']}"
+                    )
+            for modbus_handler in modbus_handlers:
+                stats = modbus_handler.get_schedule_stats()
+                logger.info(
+                    f"Schedule of {modbus_handler.config_file}: overruns={stats['overrun_count']}, skipped polls={stats['overrun_skipped_polls']}, cycles={stats['cycle_duration']['count']}, total cycle time={stats['cycle_duration']['sum']}s"
+                )
+        if on_threading_event():
+            break
+        # send the write requests of the idle Modbus clients
+        _process_writes(modbus_handlers)
+        if args.once:
+            set_threading_event()
+            break
+
+        wait_thread(
+            _get_wait_time(modbus_handlers, next_diag, reloader.next_check_time())
+        )
+
+
 def setup_logging(level, format):
     logging.basicConfig(level=level, format=format)
 
 
 def app(name="modpoll"):
     mqtt_handler = None
+    publisher = None
+    publish_queue = None
+    exporter = None
+    metrics_server = None
     modbus_handlers = []
+    executor = None
 
     print(
         f"\nModpoll v{__version__} - A New Command-line Tool for Modbus and MQTT\n",
@@ -58,6 +223,9 @@ def app(name="modpoll"):
     if not args.mqtt_host:
         logger.info("No MQTT host specified, skip MQTT setup.")
     else:
+        # the MQTT stack is only imported when it is used
+        from .mqtt_task import MqttHandler, OfflineBuffer, PublishQueue
+
         logger.info(f"Setup MQTT connection to {args.mqtt_host}:{args.mqtt_port}")
         try:
             mqtt_handler = MqttHandler(
@@ -82,115 +250,129 @@ def app(name="modpoll"):
             mqtt_handler.close()
             exit(1)
 
+        # decouple publishing from polling unless disabled
+        publisher = mqtt_handler
+        if args.mqtt_queue_size > 0:
+            buffer = None
+            if args.mqtt_buffer:
+                import sqlite3
+
+                try:
+                    buffer = OfflineBuffer(args.mqtt_buffer, args.mqtt_buffer_size)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to open MQTT buffer {args.mqtt_buffer}: {e}")
+            publish_queue = PublishQueue(
+                mqtt_handler,
+                maxsize=args.mqtt_queue_size,
+                policy=args.mqtt_queue_policy,
+                batch_size=args.mqtt_batch_size,
+                buffer=buffer,
+                replay_rate=args.mqtt_replay_rate,
+            )
+            publish_queue.start()
+            publisher = publish_queue
+        elif args.mqtt_buffer:
+            logger.warning("The MQTT buffer requires the publish queue, ignoring it.")
+
+    # setup export
+    if args.export:
+        from .export_task import ExportSink
+
+        try:
+            exporter = ExportSink(
+                args.export,
+                args.export_format,
+                flush_interval=args.export_flush_interval,
+                rotate_size=args.export_rotate_size,
+                rotate_interval=args.export_rotate_interval,
+            )
+            logger.info(f"Exporting data to {args.export} as {exporter.format}")
+        except ValueError as e:
+            logger.error(f"{e} Exiting...")
+            if publish_queue is not None:
+                publish_queue.close()
+            if mqtt_handler:
+                mqtt_handler.close()
+            exit(1)
+
+    # poll the configs in worker processes, publishing their results here
+    if args.workers > 0:
+        from .supervisor import Supervisor, shard_configs
+
+        shards = shard_configs(args, args.workers)
+        if len(shards) > 1:
+            if args.metrics_port:
+                logger.warning("Metrics are not served with --workers, ignoring them.")
+            supervisor = Supervisor(args, shards, publisher, exporter)
+            supervisor.start()
+            if mqtt_handler:
+                mqtt_handler.set_message_handler(supervisor.route_write)
+            if hasattr(signal, "SIGHUP"):
+                signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.reload())
+            supervisor.run()
+            supervisor.close()
+            if exporter:
+                exporter.close()
+            if publish_queue is not None:
+                publish_queue.close()
+            if mqtt_handler:
+                mqtt_handler.close()
+            return
+        if args.workers > 1:
+            logger.info("All devices share one endpoint, polling them in this process.")
+
     # setup modbus tasks
-    modbus_handlers = setup_modbus_handlers(args, mqtt_handler)
+    modbus_handlers = setup_modbus_handlers(args, publisher, exporter)
     if modbus_handlers:
-        logger.info(f"Loaded {len(modbus_handlers)} Modbus config(s).")
+        # a config with devices on several buses has a handler per bus
+        config_count = len({h.config_file for h in modbus_handlers})
+        logger.info(f"Loaded {config_count} Modbus config(s).")
         delay_thread(args.delay)
     else:
         logger.error("No Modbus config(s) defined. Exiting...")
+        if exporter:
+            exporter.close()
+        if publish_queue is not None:
+            publish_queue.close()
         if mqtt_handler:
             mqtt_handler.close()
         exit(1)
 
-    # main loop
-    last_check = 0
-    last_diag = 0
-    while not on_threading_event():
-        now = get_utc_time()
-        # routine check
-        if now > last_check + args.rate:
-            if last_check == 0:
-                elapsed = args.rate
-            else:
-                elapsed = round(now - last_check, 6)
-            last_check = now
-            logger.info(
-                f" === Modpoll is polling at rate:{args.rate}s, actual:{elapsed}s ==="
-            )
-            for modbus_handler in modbus_handlers:
-                modbus_handler.poll()
-                if on_threading_event():
-                    break
-                if args.mqtt_host:
-                    if args.timestamp:
-                        modbus_handler.publish_data(timestamp=now)
-                    else:
-                        modbus_handler.publish_data()
-                if args.export:
-                    if args.timestamp:
-                        modbus_handler.export(args.export, timestamp=now)
-                    else:
-                        modbus_handler.export(args.export)
-        if args.diagnostics_rate > 0 and now > last_diag + args.diagnostics_rate:
-            last_diag = now
-            for modbus_handler in modbus_handlers:
-                modbus_handler.publish_diagnostics()
-        if on_threading_event():
-            break
-        # Check if receive mqtt request
-        if mqtt_handler:
-            topic, payload = mqtt_handler.receive()
-            if topic and payload:
-                # extract device_name
-                topic_regex = args.mqtt_subscribe_topic_pattern.replace(
-                    "+", "([^/\n]*)"
-                )
-                match = re.search(topic_regex, topic)
-                if match:
-                    device_name = match.group(1)
-                    logger.info(
-                        f"Received request to write data for device {device_name}"
-                    )
-                    try:
-                        reg = json.loads(payload)
-                        object_type = reg["object_type"]
-                        address = reg["address"]
-                        value = reg["value"]
-
-                        device_found = False
-                        for modbus_handler in modbus_handlers:
-                            if device_name in [
-                                dev.name for dev in modbus_handler.get_device_list()
-                            ]:
-                                device_found = True
-                                write_success = False
-                                if object_type == "coil":
-                                    write_success = modbus_handler.write_coil(
-                                        device_name, address, value
-                                    )
-                                elif object_type == "holding_register":
-                                    write_success = modbus_handler.write_register(
-                                        device_name, address, value
-                                    )
-
-                                if write_success:
-                                    logger.info(
-                                        f"Successfully wrote {object_type}: device={device_name}, address={address}, value={value}"
-                                    )
-                                else:
-                                    logger.warning(
-                                        f"Failed to write {object_type}: device={device_name}, address={address}, value={value}"
-                                    )
-                                break
-
-                        if not device_found:
-                            logger.error(f"No device found with name: {device_name}")
-
-                    except KeyError as e:
-                        logger.error(f"Missing required key in payload: {e}")
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse JSON message: {payload}")
-                else:
-                    logger.error(f"Failed to extract device name from topic: {topic}")
-        if args.once:
-            set_threading_event()
-            break
+    if args.metrics_port:
+        from .metrics import MetricsServer
+
+        metrics_server = MetricsServer(
+            modbus_handlers, publisher, args.metrics_port, args.metrics_host
+        )
+        if not metrics_server.start():
+            metrics_server = None
+
+    # the buses of the devices with a transport of their own are polled in parallel too
+    if args.concurrent or len(group_by_client(modbus_handlers)) > 1:
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, args.max_workers), thread_name_prefix="modpoll"
+        )
+
+    # write requests are queued as they arrive and sent between two poll requests
+    registry = None
+    if mqtt_handler:
+        registry = DeviceRegistry(modbus_handlers, args.mqtt_subscribe_topic_pattern)
+        mqtt_handler.set_message_handler(
+            lambda topic, payload: _handle_write_request(topic, payload, registry)
+        )
 
-        delay_thread(0.01)
+    poll_loop(args, modbus_handlers, exporter, publish_queue, executor, registry)
 
+    if metrics_server:
+        metrics_server.close()
+    if executor:
+        executor.shutdown(wait=True)
     for modbus_handler in modbus_handlers:
         modbus_handler.close()
+    if exporter:
+        exporter.close()
+    if publish_queue is not None:
+        publish_queue.close()
     if mqtt_handler:
         mqtt_handler.close()
 
@@ -0,0 +1,310 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OBJECT_TYPES = {
+    1: "coil",
+    2: "discrete_input",
+    3: "holding_register",
+    4: "input_register",
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    # exact integers, as %g would round large counters to 6 significant digits
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _MetricWriter:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(
+        self, name: str, kind: str, help: str, samples: Iterable[Tuple[dict, float]]
+    ):
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, help: str, samples: Iterable[Tuple[dict, dict]]):
+        """Add histograms given as `Histogram.get_stats()`."""
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, stats in samples:
+            for bound, count in stats["buckets"].items():
+                bucket_labels = dict(labels, le=bound)
+                self.lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {count}"
+                )
+            self.lines.append(
+                f"{name}_sum{_format_labels(labels)} {_format_value(stats['sum'])}"
+            )
+            self.lines.append(f"{name}_count{_format_labels(labels)} {stats['count']}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class MetricsServer:
+    """Serve the polling and publishing statistics in the Prometheus text format.
+
+    The metrics are collected from the handlers when they are scraped, so
+    polling does not pay for them beyond updating its own counters.
+    """
+
+    def __init__(
+        self,
+        modbus_handlers: list,
+        publisher=None,
+        port: int = 9100,
+        host: str = "0.0.0.0",
+    ):
+        self.modbus_handlers = modbus_handlers
+        self.publisher = publisher
+        self.port = port
+        self.host = host
+        self.logger = logging.getLogger(__name__)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metrics.logger.debug(f"{self.address_string()} - {format % args}")
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.logger.error(
+                f"Failed to start metrics server on port {self.port}: {e}"
+            )
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="MetricsServer", daemon=True
+        )
+        self._thread.start()
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return True
+
+    def render(self) -> str:
+        writer = _MetricWriter()
+        self._render_pollers(writer)
+        self._render_handlers(writer)
+        self._render_publisher(writer)
+        return writer.render()
+
+    def _render_pollers(self, writer: _MetricWriter):
+        pollers = []
+        devices = []
+        for modbus_handler in self.modbus_handlers:
+            for dev in modbus_handler.get_device_list():
+                devices.append(({"device": dev.name}, dev))
+                for p in dev.pollerList:
+                    labels = {
+                        "device": dev.name,
+                        "object_type": OBJECT_TYPES.get(p.fc, p.fc),
+                        "address": p.start_address,
+                    }
+                    pollers.append((labels, p))
+        writer.histogram(
+            "modpoll_request_duration_seconds",
+            "Response time of the Modbus requests of a poller.",
+            [(labels, p.latency.get_stats()) for labels, p in pollers],
+        )
+        errors = []
+        for labels, p in pollers:
+            errors.append((dict(labels, error="timeout"), p.timeoutCount))
+            errors.append((dict(labels, error="exception"), p.exceptionCount))
+            errors.append((dict(labels, error="connection"), p.connectionErrorCount))
+        writer.metric(
+            "modpoll_request_errors_total",
+            "counter",
+            "Failed Modbus requests of a poller: timeouts, exception responses and connection errors.",
+            errors,
+        )
+        writer.metric(
+            "modpoll_decode_errors_total",
+            "counter",
+            "References of a poller that failed to decode.",
+            [(labels, p.decodeErrorCount) for labels, p in pollers],
+        )
+        writer.metric(
+            "modpoll_received_bytes_total",
+            "counter",
+            "Data bytes received by a poller.",
+            [(labels, p.bytesCount) for labels, p in pollers],
+        )
+        writer.metric(
+            "modpoll_poller_disabled",
+            "gauge",
+            "Whether a poller has been disabled.",
+            [(labels, p.disabled) for labels, p in pollers],
+        )
+        writer.metric(
+            "modpoll_poller_quarantined",
+            "gauge",
+            "Whether a poller is quarantined after consecutive failures.",
+            [(labels, p.quarantine.active) for labels, p in pollers],
+        )
+        writer.metric(
+            "modpoll_device_quarantined",
+            "gauge",
+            "Whether a device is quarantined after consecutive failures.",
+            [(labels, dev.quarantine.active) for labels, dev in devices],
+        )
+        writer.metric(
+            "modpoll_device_polls_total",
+            "counter",
+            "Polls of a device.",
+            [(labels, dev.pollCount) for labels, dev in devices],
+        )
+        writer.metric(
+            "modpoll_device_errors_total",
+            "counter",
+            "Failed polls of a device.",
+            [(labels, dev.errorCount) for labels, dev in devices],
+        )
+        writer.metric(
+            "modpoll_device_budget_skipped_polls_total",
+            "counter",
+            "Polls of a device skipped after it used up its timeout budget or failed a probe.",
+            [(labels, dev.budgetSkipCount) for labels, dev in devices],
+        )
+        writer.metric(
+            "modpoll_device_up",
+            "gauge",
+            "Whether the last poll of a device succeeded.",
+            [(labels, dev.pollSuccess) for labels, dev in devices],
+        )
+
+    def _render_handlers(self, writer: _MetricWriter):
+        handlers = []
+        for h in self.modbus_handlers:
+            labels = {"config": h.config_file}
+            if h.bus:
+                # a config polled on several buses has a handler per bus
+                labels["bus"] = h.bus
+            handlers.append((labels, h))
+        writer.histogram(
+            "modpoll_cycle_duration_seconds",
+            "Time to poll the pollers due at once.",
+            [(labels, h.cycleDuration.get_stats()) for labels, h in handlers],
+        )
+        writer.metric(
+            "modpoll_overruns_total",
+            "counter",
+            "Pollers which took longer than their rate.",
+            [(labels, h.overrunCount) for labels, h in handlers],
+        )
+        writer.metric(
+            "modpoll_skipped_polls_total",
+            "counter",
+            "Poll deadlines skipped after a poller overran its rate.",
+            [(labels, h.overrunSkipCount) for labels, h in handlers],
+        )
+        writer.histogram(
+            "modpoll_write_duration_seconds",
+            "Time from receiving a write request until it was written.",
+            [(labels, h.writeLatency.get_stats()) for labels, h in handlers],
+        )
+        writer.metric(
+            "modpoll_connected",
+            "gauge",
+            "Whether the Modbus client is connected.",
+            [(labels, h.connected) for labels, h in handlers],
+        )
+        writer.metric(
+            "modpoll_reconnects_total",
+            "counter",
+            "Reconnects of a persistent Modbus connection.",
+            [(labels, h.reconnectCount) for labels, h in handlers],
+        )
+        paced = [(labels, h.pacer) for labels, h in handlers if h.pacer]
+        if paced:
+            writer.metric(
+                "modpoll_request_interval_seconds",
+                "gauge",
+                "Current gap between two requests of the adaptive pacer.",
+                [(labels, pacer.interval) for labels, pacer in paced],
+            )
+            writer.metric(
+                "modpoll_pacer_error_rate",
+                "gauge",
+                "Moving average of the share of requests timing out.",
+                [(labels, pacer.error_rate) for labels, pacer in paced],
+            )
+
+    def _render_publisher(self, writer: _MetricWriter):
+        if self.publisher is None or not hasattr(self.publisher, "get_stats"):
+            return
+        stats = self.publisher.get_stats()
+        gauges = {
+            "queue_depth": (
+                "modpoll_mqtt_queue_depth",
+                "Messages waiting to be published.",
+            ),
+            "inflight": (
+                "modpoll_mqtt_inflight",
+                "QoS>0 messages not acknowledged yet.",
+            ),
+            "buffered": ("modpoll_mqtt_buffered", "Messages in the offline buffer."),
+            "buffer_fill": (
+                "modpoll_mqtt_buffer_fill_ratio",
+                "Fill level of the offline buffer, from 0 to 1.",
+            ),
+        }
+        counters = {
+            "published": ("modpoll_mqtt_published_total", "Messages published."),
+            "dropped": (
+                "modpoll_mqtt_dropped_total",
+                "Messages dropped from the full queue.",
+            ),
+            "buffer_dropped": (
+                "modpoll_mqtt_buffer_dropped_total",
+                "Messages dropped from the full offline buffer.",
+            ),
+            "replayed": ("modpoll_mqtt_replayed_total", "Buffered messages replayed."),
+        }
+        for key, (name, help) in gauges.items():
+            if key in stats:
+                writer.metric(name, "gauge", help, [({}, stats[key])])
+        for key, (name, help) in counters.items():
+            if key in stats:
+                writer.metric(name, "counter", help, [({}, stats[key])])
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
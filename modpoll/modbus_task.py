@@ -1,35 +1,331 @@
-import csv
+import copy
+import heapq
 import json
 import logging
 import math
-from typing import List, Optional
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import as_completed
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
-import requests
-from prettytable import PrettyTable
-from pymodbus.client import ModbusSerialClient, ModbusTcpClient, ModbusUdpClient
-from pymodbus.constants import Endian
 from pymodbus.exceptions import ModbusException
-from pymodbus.payload import BinaryPayloadDecoder
+from pymodbus.pdu import ExceptionResponse
 
-from .utils import on_threading_event, delay_thread
-from .mqtt_task import MqttHandler
+from .utils import (
+    on_threading_event,
+    delay_thread,
+    parse_deadband,
+    wake_thread,
+    get_utc_time,
+    Histogram,
+)
+from .config_loader import Config, ConfigLoader
+
+if TYPE_CHECKING:
+    # imported when used, so MQTT and exports cost nothing at startup without them
+    from .export_task import ExportSink
+    from .mqtt_task import MqttHandler
 
 
 FLOAT_TYPE_PRECISION = 3
 CONFIG_DEVICE_COL_MIN = 3
+CONFIG_DEVICE_TRANSPORT_COL = 4
 CONFIG_POLL_COL_MIN = 5
 CONFIG_REF_COL_MIN = 5
+MAX_READ_BITS = 2000
+MAX_READ_REGISTERS = 123
+MAX_WRITE_BITS = 1968
+MAX_WRITE_REGISTERS = 123
+OVERRUN_POLICIES = ("skip", "catchup", "shift")
+# gateway path unavailable and gateway target failed to respond: the gateway
+# answers for a device behind it which is offline, so these count as timeouts
+GATEWAY_EXCEPTION_CODES = (0x0A, 0x0B)
+# upper bounds in seconds of the request latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WRITE_OBJECT_TYPES = ("coil", "holding_register")
+DEFAULT_WRITE_PRIORITY = 0
+TRANSPORT_KINDS = ("rtu", "tcp", "udp")
+RTU_PARITIES = ("none", "odd", "even")
+DEFAULT_MODBUS_PORT = 502
+
+STRUCT_FORMATS = {
+    "uint16": "H",
+    "int16": "h",
+    "uint32": "I",
+    "int32": "i",
+    "uint64": "Q",
+    "int64": "q",
+    "float16": "e",
+    "float32": "f",
+    "float64": "d",
+}
+DECODE_NUMBER = 0
+DECODE_BITS = 1
+DECODE_STRING = 2
+# bits of each byte value, least significant bit first
+BYTE_BITS = [[bool(value >> i & 1) for i in range(8)] for value in range(256)]
+
+_print_lock = threading.Lock()
+_structs: Dict[str, struct.Struct] = {}
+
+
+def _get_struct(fmt: str) -> struct.Struct:
+    if fmt not in _structs:
+        _structs[fmt] = struct.Struct(fmt)
+    return _structs[fmt]
+
+
+def _pack_coils(bits) -> bytes:
+    """Pack coils into bytes, in the same layout as pymodbus' BinaryPayloadDecoder."""
+    if padding := len(bits) % 8:
+        bits = [False] * padding + list(bits)
+    packed = bytearray()
+    for i in range(0, len(bits), 8):
+        chunk = bits[i : i + 8]
+        last = len(chunk) - 1
+        packed.append(sum(1 << (last - j) for j, bit in enumerate(chunk) if bit))
+    return bytes(packed)
+
+
+def _set_read_timeout(port, timeout: float) -> Callable[[], None]:
+    """Set the read timeout of a client socket or serial port, return a function restoring it."""
+    if isinstance(port, socket.socket):
+        previous = port.gettimeout()
+        port.settimeout(timeout)
+        return lambda: port.settimeout(previous)
+    if getattr(port, "timeout", None) is not None:
+        previous = port.timeout
+        port.timeout = timeout
+        return lambda: setattr(port, "timeout", previous)
+    return lambda: None
+
+
+def _swap_word_bytes(data: bytes) -> bytes:
+    swapped = bytearray(data)
+    swapped[0::2] = data[1::2]
+    swapped[1::2] = data[0::2]
+    return bytes(swapped)
+
+
+def _swapped_unpacker(fmt: struct.Struct) -> Callable:
+    """Return an `unpack_from` which swaps the bytes of every word from `position` on."""
+
+    def unpack_from(buffer: bytes, position: int) -> tuple:
+        data = buffer[position : position + fmt.size]
+        if len(data) < fmt.size:
+            raise struct.error(f"unpack requires {fmt.size} bytes at offset {position}")
+        return fmt.unpack(_swap_word_bytes(data))
+
+    return unpack_from
+
+
+class Quarantine:
+    """Consecutive failures of a poller or device and how long it is held back for.
+
+    After `threshold` consecutive failures, polling is held back for a backoff
+    which doubles, up to a cap, with every further failure. Any success
+    lifts the quarantine.
+    """
+
+    __slots__ = ("failures", "backoff", "until", "count")
+
+    def __init__(self):
+        self.failures = 0
+        self.backoff = 0.0
+        self.until = 0.0
+        self.count = 0
+
+    @property
+    def active(self) -> bool:
+        return self.backoff > 0
+
+    def is_waiting(self, now: float) -> bool:
+        return self.until > now
+
+    def record(
+        self, success: bool, now: float, threshold: int, delay: float, delay_max: float
+    ) -> bool:
+        """Record the result of a request, return True if the backoff was (re)started."""
+        if success:
+            self.failures = 0
+            self.backoff = 0.0
+            self.until = 0.0
+            return False
+        self.failures += 1
+        if self.failures < threshold:
+            return False
+        if not self.backoff:
+            self.count += 1
+        self.backoff = min(max(self.backoff * 2, delay), delay_max)
+        self.until = now + self.backoff
+        return True
+
+    def get_stats(self) -> dict:
+        return {
+            "quarantined": self.active,
+            "quarantine_backoff": self.backoff,
+            "consecutive_failures": self.failures,
+        }
+
+
+class Transport:
+    """The serial port or TCP/UDP endpoint a device is polled on."""
+
+    __slots__ = ("kind", "address", "port", "baudrate", "parity")
+
+    def __init__(
+        self,
+        kind: str,
+        address: str,
+        port: int = DEFAULT_MODBUS_PORT,
+        baudrate: Optional[int] = None,
+        parity: Optional[str] = None,
+    ):
+        self.kind = kind
+        self.address = address
+        self.port = port
+        # serial settings left out fall back to --rtu-baud and --rtu-parity
+        self.baudrate = baudrate
+        self.parity = parity
+
+    @property
+    def key(self) -> str:
+        """Identify the physical bus, all settings of a serial port drive the same bus."""
+        if self.kind == "rtu":
+            return f"rtu://{self.address}"
+        return f"{self.kind}://{self.address}:{self.port}"
+
+    def __str__(self) -> str:
+        if self.kind != "rtu":
+            return self.key
+        options = []
+        if self.baudrate:
+            options.append(f"baudrate={self.baudrate}")
+        if self.parity:
+            options.append(f"parity={self.parity}")
+        return f"{self.key}?{'&'.join(options)}" if options else self.key
+
+
+def parse_transport(spec: str) -> Transport:
+    """Parse the transport column of a device row.
+
+    `tcp://host[:port]`, `udp://host[:port]`, or `rtu://<serial port>` with
+    optional `baudrate` and `parity` query options, e.g.
+    `rtu:///dev/ttyUSB1?baudrate=19200&parity=even` or `rtu://COM3`.
+    Raises ValueError if the spec is invalid.
+    """
+    url = urlparse(spec)
+    kind = url.scheme.lower()
+    if kind not in TRANSPORT_KINDS:
+        raise ValueError(f"unsupported transport {spec}")
+    options = parse_qs(url.query)
+    if kind != "rtu":
+        if options or not url.hostname:
+            raise ValueError(f"invalid {kind} transport {spec}")
+        return Transport(kind, url.hostname, url.port or DEFAULT_MODBUS_PORT)
+    # the serial port is the path of rtu:///dev/ttyUSB0 and the host of rtu://COM3
+    address = url.netloc + url.path
+    unknown = set(options) - {"baudrate", "parity"}
+    if not address or unknown:
+        raise ValueError(f"invalid rtu transport {spec}")
+    baudrate = int(options["baudrate"][-1]) if "baudrate" in options else None
+    parity = options["parity"][-1].lower() if "parity" in options else None
+    if parity is not None and parity not in RTU_PARITIES:
+        raise ValueError(f"invalid parity {parity}")
+    return Transport(kind, address, baudrate=baudrate, parity=parity)
+
+
+def get_device_transports(rows) -> List[Optional[Transport]]:
+    """Return the transport of each device of a config, in order.
+
+    None stands for the devices without one, which use the transport given
+    on the command line. Devices with an invalid transport are left out,
+    they are reported when the config is parsed.
+    """
+    transports = []
+    for row in rows:
+        if not row or "device" not in row[0].lower():
+            continue
+        if len(row) < CONFIG_DEVICE_COL_MIN:
+            continue
+        transport = None
+        col = CONFIG_DEVICE_TRANSPORT_COL
+        if len(row) > col and row[col].strip():
+            try:
+                transport = parse_transport(row[col].strip())
+            except ValueError:
+                continue
+        transports.append(transport)
+    return transports
+
+
+def get_config_transports(rows) -> List[Optional[Transport]]:
+    """Return the distinct transports named by the devices of a config.
+
+    None stands for the devices without one, see `get_device_transports()`.
+    """
+    transports: Dict[Optional[str], Optional[Transport]] = {}
+    for transport in get_device_transports(rows):
+        transports.setdefault(str(transport) if transport else None, transport)
+    return list(transports.values()) or [None]
+
+
+def get_default_transport(args) -> Optional[Transport]:
+    """Return the transport given on the command line, if any."""
+    if args.rtu:
+        return Transport(
+            "rtu", args.rtu, baudrate=args.rtu_baud, parity=args.rtu_parity
+        )
+    if args.tcp:
+        return Transport("tcp", args.tcp, args.tcp_port)
+    if args.udp:
+        return Transport("udp", args.udp, args.udp_port)
+    return None
+
+
+def _get_bus_key(transport: Optional[Transport]) -> Optional[str]:
+    return transport.key if transport is not None else None
 
 
 class Device:
-    def __init__(self, device_name: str, device_id: int):
+    __slots__ = (
+        "name",
+        "devid",
+        "rate",
+        "transport",
+        "pollerList",
+        "references",
+        "errorCount",
+        "pollCount",
+        "pollSuccess",
+        "budgetSkipCount",
+        "quarantine",
+    )
+
+    def __init__(
+        self,
+        device_name: str,
+        device_id: int,
+        rate: Optional[float] = None,
+        transport: Optional[Transport] = None,
+    ):
         self.name = device_name
         self.devid = device_id
+        self.rate = rate
+        self.transport = transport
         self.pollerList: List[Poller] = []
         self.references: dict = {}
         self.errorCount = 0
         self.pollCount = 0
         self.pollSuccess = False
+        # polls skipped after the device used up its timeout budget or failed a probe
+        self.budgetSkipCount = 0
+        self.quarantine = Quarantine()
 
     def add_reference_mapping(self, ref):
         self.references[ref.name] = ref
@@ -37,11 +333,41 @@ class Device:
     def update_reference(self, ref):
         if ref.name in self.references:
             existing_ref = self.references[ref.name]
-            existing_ref.last_val = existing_ref.val
-            existing_ref.val = ref.val
+            if existing_ref is not ref:
+                existing_ref.last_val = existing_ref.val
+                existing_ref.val = ref.val
 
 
 class Poller:
+    __slots__ = (
+        "device",
+        "fc",
+        "start_address",
+        "size",
+        "endian",
+        "rate",
+        "readableReferences",
+        "referenceOffsets",
+        "decodePlan",
+        "vectorPlan",
+        "disabled",
+        "failcounter",
+        "exceptionFailures",
+        "last_error",
+        "logger",
+        "latency",
+        "timeoutCount",
+        "exceptionCount",
+        "connectionErrorCount",
+        "decodeErrorCount",
+        "bytesCount",
+        "quarantine",
+        "_scalarPlan",
+        "_swap_bytes",
+        "_needs_raw",
+        "_numpy",
+    )
+
     def __init__(
         self,
         device: Device,
@@ -49,20 +375,41 @@ class Poller:
         start_address: int,
         size: int,
         endian: str,
+        rate: Optional[float] = None,
     ):
         self.device = device
         self.fc = function_code
         self.start_address = start_address
         self.size = size
         self.endian = endian.lower()
+        self.rate = rate
         self.readableReferences: List[Reference] = []
+        self.referenceOffsets: Dict[str, int] = {}
+        self.decodePlan: Optional[list] = None
+        self.vectorPlan: Optional[tuple] = None
         self.disabled = False
         self.failcounter = 0
+        # consecutive exception responses, apart from timeouts
+        self.exceptionFailures = 0
+        self.last_error: Optional[str] = None
         self.logger = logging.getLogger(__name__)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.timeoutCount = 0
+        self.exceptionCount = 0
+        self.connectionErrorCount = 0
+        self.decodeErrorCount = 0
+        self.bytesCount = 0
+        self.quarantine = Quarantine()
+        self._scalarPlan: list = []
+        self._swap_bytes = False
+        self._needs_raw = False
+        self._numpy = None
 
     def poll(self, master) -> bool:
         if self.disabled or not master:
             return False
+        self.last_error = None
+        start = time.monotonic()
         try:
             result = None
             data = None
@@ -82,114 +429,243 @@ class Poller:
                 result = master.read_input_registers(
                     self.start_address, self.size, slave=self.device.devid
                 )
+            self.latency.observe(time.monotonic() - start)
 
             if result is None or result.isError():
+                # an exception response means the device is alive but refused the request
+                if _is_refused(result):
+                    self.last_error = "exception"
+                    self.exceptionCount += 1
+                    self.exceptionFailures += 1
+                else:
+                    self.last_error = "timeout"
+                    self.timeoutCount += 1
                 self.update_statistics(False)
                 return False
 
-            data = result.bits if self.fc in (1, 2) else result.registers
+            if self.fc in (1, 2):
+                data = result.bits
+                self.bytesCount += math.ceil(self.size / 8)
+            else:
+                data = result.registers
+                self.bytesCount += len(data) * 2
 
-            decoder = self._get_decoder(data)
-            cur_ref = self.start_address
-            for ref in self.readableReferences:
-                if self.fc in (1, 2):
-                    ref_count = math.ceil(self.size / 8)
-                else:
-                    ref_count = self.size
-                # skip all registers before current reference address
-                while cur_ref < ref.address:
-                    if self.fc in (1, 2):
-                        decoder.skip_bytes(1)
-                    else:
-                        decoder.skip_bytes(2)
-                    cur_ref += 1
-                if cur_ref >= self.start_address + ref_count:
-                    break
-                try:
-                    self._decode_and_update_reference(ref, decoder)
-                    self.device.update_reference(ref)
-                except UnicodeDecodeError:
-                    self.logger.error(
-                        f"Failed to decode unicode string for reference: {ref.name}, check the reference address or length of string in configuration file"
-                    )
-                except:
-                    self.logger.error(
-                        f"Failed to decode value for reference: {ref.name}"
-                    )
-                cur_ref += ref.ref_width
+            self.decode(data)
             self.update_statistics(True)
             return True
         except ModbusException:
+            self.latency.observe(time.monotonic() - start)
+            self.last_error = "connection"
+            self.connectionErrorCount += 1
             self.update_statistics(False)
             return False
 
-    def _get_decoder(self, data):
-        if "BE_BE" == self.endian.upper():
-            return (
-                BinaryPayloadDecoder.fromRegisters(
-                    data, byteorder=Endian.BIG, wordorder=Endian.BIG
-                )
-                if self.fc not in (1, 2)
-                else BinaryPayloadDecoder.fromCoils(data, byteorder=Endian.BIG)
-            )
-        elif "LE_BE" == self.endian.upper():
-            return (
-                BinaryPayloadDecoder.fromRegisters(
-                    data, byteorder=Endian.LITTLE, wordorder=Endian.BIG
-                )
-                if self.fc not in (1, 2)
-                else BinaryPayloadDecoder.fromCoils(data, byteorder=Endian.LITTLE)
-            )
-        elif "LE_LE" == self.endian.upper():
-            return (
-                BinaryPayloadDecoder.fromRegisters(
-                    data, byteorder=Endian.LITTLE, wordorder=Endian.LITTLE
-                )
-                if self.fc not in (1, 2)
-                else BinaryPayloadDecoder.fromCoils(data, byteorder=Endian.LITTLE)
-            )
-        else:
-            return (
-                BinaryPayloadDecoder.fromRegisters(
-                    data, byteorder=Endian.BIG, wordorder=Endian.LITTLE
-                )
-                if self.fc not in (1, 2)
-                else BinaryPayloadDecoder.fromCoils(data, byteorder=Endian.BIG)
-            )
-
-    def _decode_and_update_reference(
-        self, ref: "Reference", decoder: BinaryPayloadDecoder
-    ):
-        decode_methods = {
-            "uint16": decoder.decode_16bit_uint,
-            "int16": decoder.decode_16bit_int,
-            "uint32": decoder.decode_32bit_uint,
-            "int32": decoder.decode_32bit_int,
-            "uint64": decoder.decode_64bit_uint,
-            "int64": decoder.decode_64bit_int,
-            "float16": decoder.decode_16bit_float,
-            "float32": decoder.decode_32bit_float,
-            "float64": decoder.decode_64bit_float,
-            "bool8": decoder.decode_bits,
-            "bool": decoder.decode_bits,
-            "bool16": lambda: decoder.decode_bits() + decoder.decode_bits(),
+    def probe(self, master) -> bool:
+        """Check with a request for a single register (or coil) whether the device responds."""
+        reads = {
+            1: master.read_coils,
+            2: master.read_discrete_inputs,
+            3: master.read_holding_registers,
+            4: master.read_input_registers,
         }
+        try:
+            result = reads[self.fc](self.start_address, 1, slave=self.device.devid)
+        except ModbusException:
+            return False
+        # an exception response still proves the device is alive
+        return result is not None and (not result.isError() or _is_refused(result))
+
+    def compile_decode_plan(self, numpy=None):
+        """Precompute the byte offset, struct format and scale of each reference.
+
+        Registers are packed into one buffer per response. References are then
+        decoded straight from their offset in that buffer. The word and byte
+        order is applied by swapping the bytes of every word when they differ
+        and by unpacking multi-word values in the word order.
+
+        If the numpy module is given, numeric references are decoded with one
+        structured NumPy dtype instead, unpacking all of them in a single call.
+        """
+        coils = self.fc in (1, 2)
+        prefix, swap_bytes = self._get_byte_order()
+        unit = 1 if coils else 2
+        length = math.ceil(self.size / 8) if coils else self.size
+        plan = []
+        for ref in sorted(self.readableReferences, key=self.get_reference_offset):
+            offset = self.get_reference_offset(ref)
+            if offset >= length:
+                break
+            position = offset * unit
+            if ref.dtype in STRUCT_FORMATS:
+                scale = float(ref.scale) if ref.scale else None
+                fmt = _get_struct(prefix + STRUCT_FORMATS[ref.dtype])
+                unpack = fmt.unpack_from
+                if coils and swap_bytes:
+                    # coil words start at the reference, not at the first coil
+                    unpack = _swapped_unpacker(fmt)
+                plan.append((ref, DECODE_NUMBER, position, unpack, scale))
+            elif ref.dtype in ("bool", "bool8", "bool16"):
+                plan.append((ref, DECODE_BITS, position, ref.dtype == "bool16", None))
+            elif ref.dtype.startswith("string"):
+                plan.append((ref, DECODE_STRING, position, ref.ref_width * 2, None))
+        self.decodePlan = plan
+        self._swap_bytes = swap_bytes
+        self._needs_raw = any(step[1] != DECODE_NUMBER for step in plan)
+        self.vectorPlan = None
+        if numpy is not None:
+            self._compile_vector_plan(numpy, prefix)
+
+    def _get_byte_order(self) -> Tuple[str, bool]:
+        """Return the struct prefix of the word order and whether the bytes of each word are swapped."""
+        endian = self.endian.upper()
+        byte_little = endian in ("LE_BE", "LE_LE")
+        word_little = self.fc not in (1, 2) and endian not in ("BE_BE", "LE_BE")
+        return "<" if word_little else ">", byte_little != word_little
+
+    def encode(self, ref: "Reference", value) -> Tuple[int, list]:
+        """Encode a value of a reference the way `decode()` reads it back.
 
-        if ref.dtype in decode_methods:
-            ref.update_value(decode_methods[ref.dtype]())
+        Returns the address of the first register (or coil) to write and the
+        register values (or coil states).
+        """
+        offset = ref.address - self.start_address
+        if self.fc == 1:
+            address = self.start_address + offset * 8
+            if not isinstance(value, (list, tuple)):
+                return address, [bool(value)]
+            if len(value) != ref.ref_width * 8:
+                raise ValueError(f"{ref.ref_width * 8} coil states expected")
+            # decoded bits are listed from the last coil of each byte
+            coils = [False] * len(value)
+            for i, bit in enumerate(value):
+                coils[i - i % 8 + 7 - i % 8] = bool(bit)
+            return address, coils
+        if self.fc != 3:
+            raise ValueError("only coils and holding registers can be written")
+        if ref.dtype in STRUCT_FORMATS:
+            if ref.scale:
+                value = value / ref.scale
+            if ref.dtype.startswith(("int", "uint")):
+                value = int(round(value))
+            prefix, swap_bytes = self._get_byte_order()
+            data = _get_struct(prefix + STRUCT_FORMATS[ref.dtype]).pack(value)
+            if swap_bytes:
+                data = _swap_word_bytes(data)
         elif ref.dtype.startswith("string"):
-            ref.update_value(
-                decoder.decode_string(ref.ref_width * 2).decode("utf-8").rstrip("\x00")
+            data = str(value).encode("utf-8")
+            if len(data) > ref.ref_width * 2:
+                raise ValueError(f"string longer than {ref.ref_width * 2} bytes")
+            data = data.ljust(ref.ref_width * 2, b"\x00")
+        else:
+            raise ValueError(f"writing {ref.dtype} registers is not supported")
+        return self.start_address + offset, list(
+            struct.unpack(f">{len(data) // 2}H", data)
+        )
+
+    def _compile_vector_plan(self, numpy, prefix: str):
+        # one field per numeric reference, at its offset in the response
+        fields: Dict[str, list] = {"names": [], "formats": [], "offsets": []}
+        refs, scales = [], []
+        self._scalarPlan = []
+        for step in self.decodePlan:
+            ref, kind, position, _, scale = step
+            # the words of little-endian coil references are swapped on their own
+            if kind != DECODE_NUMBER or self.fc in (1, 2) and self._swap_bytes:
+                self._scalarPlan.append(step)
+                continue
+            fields["names"].append(f"ref{len(refs)}")
+            fields["formats"].append(numpy.dtype(prefix + STRUCT_FORMATS[ref.dtype]))
+            fields["offsets"].append(position)
+            refs.append(ref)
+            scales.append(scale)
+        self.vectorPlan = None
+        if refs:
+            itemsize = max(
+                offset + fmt.itemsize
+                for offset, fmt in zip(fields["offsets"], fields["formats"])
             )
+            np_dtype = numpy.dtype(dict(fields, itemsize=itemsize))
+            self.vectorPlan = (refs, np_dtype, scales)
+        self._numpy = numpy
+
+    def decode(self, data):
+        """Decode a response and update the readable references."""
+        if self.decodePlan is None:
+            self.compile_decode_plan()
+        if self.fc in (1, 2):
+            raw = buf = _pack_coils(data)
+        elif self._swap_bytes:
+            buf = struct.pack(f"<{len(data)}H", *data)
+            raw = struct.pack(f">{len(data)}H", *data) if self._needs_raw else buf
+        else:
+            raw = buf = struct.pack(f">{len(data)}H", *data)
+        if self.vectorPlan is None:
+            self._decode_steps(self.decodePlan, raw, buf)
+            return
+        refs, np_dtype, scales = self.vectorPlan
+        try:
+            # all numeric references are unpacked at once as one structured record
+            values = self._numpy.frombuffer(buf, dtype=np_dtype, count=1).item()
+        except ValueError:
+            # short response, fall back to decoding reference by reference
+            self._decode_steps(self.decodePlan, raw, buf)
+            return
+        for ref, value, scale in zip(refs, values, scales):
+            if scale is not None:
+                value = value * scale
+            ref.last_val = ref.val
+            ref.val = value
+            self.device.update_reference(ref)
+        self._decode_steps(self._scalarPlan, raw, buf)
 
-    def add_readable_reference(self, ref: "Reference"):
-        if ref not in self.readableReferences:
+    def _decode_steps(self, steps: list, raw: bytes, buf: bytes):
+        for ref, kind, position, arg, scale in steps:
+            try:
+                if kind == DECODE_NUMBER:
+                    value = arg(buf, position)[0]
+                    if scale is not None:
+                        value = value * scale
+                elif kind == DECODE_BITS:
+                    value = BYTE_BITS[raw[position]][:]
+                    if arg:
+                        value += BYTE_BITS[raw[position + 1]]
+                else:
+                    value = (
+                        raw[position : position + arg].decode("utf-8").rstrip("\x00")
+                    )
+            except UnicodeDecodeError:
+                self.decodeErrorCount += 1
+                self.logger.error(
+                    f"Failed to decode unicode string for reference: {ref.name}, check the reference address or length of string in configuration file"
+                )
+                continue
+            except (struct.error, IndexError):
+                self.decodeErrorCount += 1
+                self.logger.error(f"Failed to decode value for reference: {ref.name}")
+                continue
+            ref.last_val = ref.val
+            ref.val = value
+            self.device.update_reference(ref)
+
+    def add_readable_reference(self, ref: "Reference", offset: Optional[int] = None):
+        # references are equal by address, but pollers merged from overlapping
+        # pollers may read several references at the same address
+        key = (ref.name, ref.address, ref.dtype)
+        if all((r.name, r.address, r.dtype) != key for r in self.readableReferences):
             self.readableReferences.append(ref)
+            if offset is not None:
+                self.referenceOffsets[ref.name] = offset
+            self.decodePlan = None
+
+    def get_reference_offset(self, ref: "Reference") -> int:
+        """Return the offset of reference in the response, in registers or bytes of coils."""
+        return self.referenceOffsets.get(ref.name, ref.address - self.start_address)
 
     def update_statistics(self, success: bool):
         self.device.pollCount += 1
         if success:
             self.failcounter = 0
+            self.exceptionFailures = 0
             self.device.pollSuccess = True
         else:
             self.failcounter += 1
@@ -198,6 +674,23 @@ class Poller:
 
 
 class Reference:
+    __slots__ = (
+        "device",
+        "name",
+        "address",
+        "dtype",
+        "ref_width",
+        "rw",
+        "unit",
+        "scale",
+        "val",
+        "last_val",
+        "deadband",
+        "published_val",
+        "published_time",
+        "poller",
+    )
+
     def __init__(
         self,
         device: Device,
@@ -207,17 +700,24 @@ class Reference:
         rw: str,
         unit: str,
         scale: float,
+        deadband: Optional[tuple] = None,
     ):
         self.device = device
         self.name = ref_name
         self.address = address
-        self.dtype = dtype.lower()
+        # dtype, rw and unit repeat across references, share one string each
+        self.dtype = sys.intern(dtype.lower())
         self.ref_width = self._get_ref_width()
-        self.rw = rw.lower()
-        self.unit = unit
+        self.rw = sys.intern(rw.lower())
+        self.unit = sys.intern(unit) if unit else unit
         self.scale = scale
         self.val = None
         self.last_val = None
+        self.deadband = deadband
+        self.published_val = None
+        self.published_time: Optional[float] = None
+        # the poller of the config, which encodes the values written to the reference
+        self.poller: Optional[Poller] = None
 
     def __eq__(self, other):
         if isinstance(other, Reference):
@@ -264,57 +764,415 @@ class Reference:
         self.last_val = self.val
         self.val = v
 
+    def has_changed(self, now: float, heartbeat: float = 0) -> bool:
+        """Check if the value moved out of the deadband since it was last published."""
+        if self.published_time is None:
+            return True
+        if heartbeat and now - self.published_time >= heartbeat:
+            return True
+        if self.val == self.published_val:
+            return False
+        if not self.deadband or not _is_number(self.val):
+            return True
+        if not _is_number(self.published_val):
+            return True
+        deadband, percentage = self.deadband
+        if percentage:
+            deadband = abs(self.published_val) * deadband / 100
+        return abs(self.val - self.published_val) > deadband
+
+    def mark_published(self, now: float):
+        self.published_val = self.val
+        self.published_time = now
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_refused(result) -> bool:
+    """Return True for an exception response sent by the device itself."""
+    return (
+        isinstance(result, ExceptionResponse)
+        and result.exception_code not in GATEWAY_EXCEPTION_CODES
+    )
+
+
+class RequestPacer:
+    """Adapt the gap between two requests on one endpoint to how it responds.
+
+    The gap shrinks towards `min_interval` (the RTU inter-frame gap, or zero
+    for TCP/UDP) while requests succeed and doubles, up to `max_interval`,
+    when requests time out or the connection fails.
+    """
+
+    LATENCY_WEIGHT = 0.2
+    MIN_BACKOFF = 0.01
+
+    def __init__(self, max_interval: float, min_interval: float = 0.0):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.interval = max_interval
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requestCount = 0
+        self.timeoutCount = 0
+        self._last_request_end = 0.0
+
+    def wait(self):
+        """Sleep until the gap since the end of the previous request has passed."""
+        remaining = self._last_request_end + self.interval - time.monotonic()
+        if remaining > 0:
+            delay_thread(timeout=remaining)
+
+    def record(self, latency: float, error: Optional[str] = None):
+        self._last_request_end = time.monotonic()
+        self.requestCount += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.LATENCY_WEIGHT * (latency - self.latency)
+        failed = error in ("timeout", "connection")
+        self.error_rate += self.LATENCY_WEIGHT * (float(failed) - self.error_rate)
+        if failed:
+            self.timeoutCount += 1
+            self.interval = min(
+                max(self.interval * 2, self.latency, self.MIN_BACKOFF),
+                self.max_interval,
+            )
+        else:
+            # an exception response still proves the endpoint keeps up
+            self.interval = max(self.interval / 2, self.min_interval)
+            if self.interval < self.min_interval + self.MIN_BACKOFF / 10:
+                self.interval = self.min_interval
+
+    def get_stats(self) -> dict:
+        return {
+            "request_interval": round(self.interval, 6),
+            "response_time": (
+                round(self.latency, 6) if self.latency is not None else None
+            ),
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+class WriteRequest:
+    """One write request, made of blocks of consecutive registers (or coils)."""
+
+    __slots__ = (
+        "handler",
+        "device",
+        "blocks",
+        "description",
+        "priority",
+        "request_id",
+        "received",
+    )
+
+    def __init__(
+        self,
+        handler: "ModbusHandler",
+        device: Device,
+        blocks: List[Tuple[str, int, list]],
+        description: dict,
+        priority: int = DEFAULT_WRITE_PRIORITY,
+        request_id=None,
+    ):
+        self.handler = handler
+        self.device = device
+        # (object type, first address, values)
+        self.blocks = blocks
+        # what was requested, sent back in the acknowledgement
+        self.description = description
+        self.priority = priority
+        self.request_id = request_id
+        self.received = time.monotonic()
+
+
+class WriteQueue:
+    """Write requests waiting for one Modbus client.
+
+    The queue is shared by all handlers on the same client. They send the
+    queued writes between two poll requests while holding `lock`, so a write
+    never has to wait for a whole polling cycle.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._requests: List[WriteRequest] = []
+        self._requests_lock = threading.Lock()
+
+    def put(self, request: WriteRequest):
+        with self._requests_lock:
+            self._requests.append(request)
+
+    def get_all(self) -> List[WriteRequest]:
+        """Remove and return all queued requests, in the order they arrived."""
+        with self._requests_lock:
+            requests, self._requests = self._requests, []
+        return requests
+
+    def first_received(self) -> Optional[float]:
+        with self._requests_lock:
+            return self._requests[0].received if self._requests else None
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
 
 class ModbusHandler:
     def __init__(
         self,
         modbus_client,
         config_file: str,
-        mqtt_handler: Optional[MqttHandler] = None,
+        mqtt_handler: Optional["MqttHandler"] = None,
         timeout: float = 3.0,
+        rate: float = 10.0,
         interval: float = 0.5,
         daemon: bool = False,
         mqtt_publish_topic_pattern: Optional[str] = None,
         mqtt_diagnostics_topic_pattern: Optional[str] = None,
         mqtt_single_publish: bool = False,
+        on_change: bool = False,
+        deadband: Optional[tuple] = None,
+        heartbeat: float = 0,
+        coalesce: bool = False,
+        coalesce_gap: int = 0,
+        persistent: bool = False,
+        keepalive: float = 0,
+        reconnect_delay: float = 1.0,
+        reconnect_delay_max: float = 60.0,
+        pacer: Optional[RequestPacer] = None,
+        decoder: str = "struct",
+        overrun_policy: str = "skip",
+        autoremove: bool = False,
+        quarantine_threshold: int = 3,
+        quarantine_delay: float = 10.0,
+        quarantine_delay_max: float = 600.0,
+        timeout_budget: int = 0,
+        liveness_timeout: float = 0,
+        mqtt_ack_topic_pattern: Optional[str] = None,
+        write_queue: Optional[WriteQueue] = None,
+        write_window: float = 0,
+        exporter: Optional["ExportSink"] = None,
+        config_loader: Optional[ConfigLoader] = None,
+        bus: Optional[str] = None,
     ):
         self.modbus_client = modbus_client
         self.config_file = config_file
+        # the key of the transport of the devices polled by this handler, None
+        # for the devices without one
+        self.bus = bus
         self.mqtt_handler = mqtt_handler
         self.timeout = timeout
+        self.rate = rate
         self.interval = interval
         self.daemon = daemon
         self.mqtt_publish_topic_pattern = mqtt_publish_topic_pattern
         self.mqtt_diagnostics_topic_pattern = mqtt_diagnostics_topic_pattern
         self.mqtt_single_publish = mqtt_single_publish
+        self.on_change = on_change
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.coalesce = coalesce
+        self.coalesce_gap = coalesce_gap
+        self.persistent = persistent
+        self.keepalive = keepalive
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_delay_max = reconnect_delay_max
+        self.pacer = pacer
+        self.decoder = decoder
+        self.numpy = _import_numpy() if decoder == "numpy" else None
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy: {overrun_policy}")
+        self.overrun_policy = overrun_policy
+        self.autoremove = autoremove
+        self.quarantine_threshold = quarantine_threshold
+        self.quarantine_delay = quarantine_delay
+        self.quarantine_delay_max = quarantine_delay_max
+        self.timeout_budget = timeout_budget
+        self.liveness_timeout = liveness_timeout
+        self.overrunCount = 0
+        # poll deadlines dropped by the skip overrun policy
+        self.overrunSkipCount = 0
+        self.cycleDuration = Histogram()
+        self.mqtt_ack_topic_pattern = mqtt_ack_topic_pattern
+        self.write_queue = write_queue if write_queue is not None else WriteQueue()
+        self.write_window = write_window
+        self.exporter = exporter
+        self.config_loader = (
+            config_loader
+            if config_loader is not None
+            else ConfigLoader(timeout=timeout)
+        )
+        self.config: Optional[Config] = None
+        self.writeCount = 0
+        self.writeLatency = Histogram()
         self.connected = False
+        self.connectCount = 0
+        self.reconnectCount = 0
+        self.connectFailCount = 0
+        self._connection_lost = False
+        self._reconnect_backoff = 0.0
+        self._next_connect_time = 0.0
+        self._schedule: List[tuple] = []
+        # ids of the references read successfully in the last poll cycle
+        self._polled: set = set()
         self.deviceList: List[Device] = []
         self.logger = logging.getLogger(__name__)
 
-    def load_config(self) -> bool:
-        self.logger.info(f"Loading config from: {self.config_file}")
-        try:
-            with requests.Session() as s:
-                response = s.get(self.config_file, timeout=self.timeout)
-                response.raise_for_status()
-                decoded_content = response.content.decode("utf-8")
-                csv_reader = csv.reader(decoded_content.splitlines(), delimiter=",")
-                self.deviceList = self._parse_config(csv_reader)
-        except requests.RequestException:
-            try:
-                with open(self.config_file, "r") as f:
-                    csv_reader = csv.reader(f)
-                    self.deviceList = self._parse_config(csv_reader)
-            except IOError as e:
-                self.logger.error(f"Error opening file: {e}")
+    @property
+    def deviceList(self) -> List[Device]:
+        return self._deviceList
+
+    @deviceList.setter
+    def deviceList(self, devices: List[Device]):
+        self._deviceList = devices
+        # index the devices by name for writes
+        self._devices = {dev.name: dev for dev in devices}
+
+    def load_config(
+        self, config: Optional[Config] = None, devices: Optional[List[Device]] = None
+    ) -> bool:
+        """Load the config, or use `config` with the `devices` already parsed from it.
+
+        A config with devices on several buses is parsed once, and its devices
+        are shared out to the handlers of the buses.
+        """
+        if config is None:
+            self.logger.info(f"Loading config from: {self.config_file}")
+            config = self.config_loader.load(self.config_file)
+            if config is None:
                 return False
+        self.config = config
+        self.deviceList = self._build_devices(config, devices)
+        self._build_schedule()
         if self.deviceList:
-            self.logger.info(f"Added {len(self.deviceList)} device(s)...")
+            if self.bus:
+                self.logger.info(
+                    f"Added {len(self.deviceList)} device(s) on {self.bus}..."
+                )
+            else:
+                self.logger.info(f"Added {len(self.deviceList)} device(s)...")
             return True
         else:
             self.logger.error("No device found in the config file. Skipping.")
             return False
 
+    def _build_devices(
+        self, config: Config, devices: Optional[List[Device]] = None
+    ) -> List[Device]:
+        if devices is None:
+            devices = self._parse_config(config.rows)
+        devices = [dev for dev in devices if _get_bus_key(dev.transport) == self.bus]
+        if self.coalesce:
+            for dev in devices:
+                self._coalesce_pollers(dev)
+        for dev in devices:
+            for p in dev.pollerList:
+                p.compile_decode_plan(self.numpy)
+        return devices
+
+    def check_config(
+        self, config: Optional[Config] = None, devices: Optional[List[Device]] = None
+    ) -> Optional[Tuple[Config, List[Device]]]:
+        """Load the config again, return it with its devices if it has changed.
+
+        The live devices are not touched, so this can run in a background
+        thread while polling goes on. Pass the result to `apply_config()`.
+        As with `load_config()`, the config and its parsed devices can be given.
+        """
+        if config is None:
+            config = self.config_loader.load(self.config_file)
+            if config is None:
+                return None
+        if not self.is_config_changed(config):
+            self.config = config
+            return None
+        return config, self._build_devices(config, devices)
+
+    def is_config_changed(self, config: Config) -> bool:
+        if config is self.config:
+            return False
+        return self.config is None or config.rows != self.config.rows
+
+    def apply_config(self, config: Config, devices: List[Device]) -> bool:
+        """Swap in a reloaded config between two poll cycles.
+
+        Devices are matched by name and pollers by their request and
+        references. Unchanged pollers are kept with their statistics and
+        deadlines, and references defined as before keep their last values.
+        Returns True if any device or poller has changed.
+        """
+        if not devices:
+            self.logger.error(
+                f"No device found in the reloaded config {self.config_file}, keeping the current one."
+            )
+            return False
+        old_devices = self._devices
+        deadlines = {id(p): due_time for due_time, _, p in self._schedule}
+        device_list = []
+        added = changed = 0
+        for dev in devices:
+            old = old_devices.get(dev.name)
+            if old is None or old.devid != dev.devid:
+                added += 1
+                device_list.append(dev)
+                continue
+            changed += self._merge_device(old, dev)
+            device_list.append(old)
+        removed = len(set(old_devices) - {dev.name for dev in devices})
+        self.config = config
+        self.deviceList = device_list
+        # kept pollers stay on their deadlines, new ones are due right away
+        now = time.monotonic()
+        self._schedule = [
+            (deadlines.get(id(p), now), seq, p)
+            for seq, p in enumerate(p for dev in device_list for p in dev.pollerList)
+        ]
+        heapq.heapify(self._schedule)
+        if not (added or removed or changed):
+            return False
+        self.logger.info(
+            f"Reloaded config {self.config_file}: {added} device(s) added, {removed} removed, {changed} poller(s) changed."
+        )
+        return True
+
+    def _merge_device(self, old: Device, new: Device) -> int:
+        """Update a live device to a reloaded one, return the number of changed pollers."""
+        old_pollers = {_get_poller_key(p): p for p in old.pollerList}
+        kept = {}
+        poller_list = []
+        for p in new.pollerList:
+            old_poller = old_pollers.pop(_get_poller_key(p), None)
+            if old_poller is not None:
+                kept[id(p)] = old_poller
+                poller_list.append(old_poller)
+            else:
+                p.device = old
+                poller_list.append(p)
+        references = {}
+        for name, ref in new.references.items():
+            old_ref = old.references.get(name)
+            if old_ref is not None and _get_reference_key(
+                old_ref
+            ) == _get_reference_key(ref):
+                if id(ref.poller) in kept:
+                    references[name] = old_ref
+                    continue
+                ref.val = old_ref.val
+                ref.last_val = old_ref.last_val
+                ref.published_val = old_ref.published_val
+                ref.published_time = old_ref.published_time
+            ref.device = old
+            ref.poller = kept.get(id(ref.poller), ref.poller)
+            references[name] = ref
+        changed = len(poller_list) - len(kept) + len(old_pollers)
+        old.pollerList = poller_list
+        old.references = references
+        old.rate = new.rate
+        return changed
+
     def _parse_config(self, csv_reader) -> List[Device]:
         device_list = []
         current_device = None
@@ -333,7 +1191,22 @@ class ModbusHandler:
                     except ValueError:
                         self.logger.error(f"Invalid device ID for {device_name}")
                         continue
-                    current_device = Device(device_name, device_id)
+                    device_rate = self._get_rate(row, 3)
+                    transport = None
+                    col = CONFIG_DEVICE_TRANSPORT_COL
+                    if len(row) > col and row[col].strip():
+                        try:
+                            transport = parse_transport(row[col].strip())
+                        except ValueError as e:
+                            self.logger.error(
+                                f"Invalid transport for {device_name}: {e}"
+                            )
+                            # keep its pollers from being added to the previous device
+                            current_device = None
+                            continue
+                    current_device = Device(
+                        device_name, device_id, device_rate, transport
+                    )
                     device_list.append(current_device)
                 elif "poll" in row[0].lower():
                     if not current_device:
@@ -350,6 +1223,7 @@ class ModbusHandler:
                         continue
                     ref = self._create_reference(row, current_device)
                     if ref and self._validate_reference(ref, current_poller):
+                        ref.poller = current_poller
                         if "r" in ref.rw.lower():
                             current_poller.add_readable_reference(ref)
                         current_device.add_reference_mapping(ref)
@@ -378,7 +1252,22 @@ class ModbusHandler:
             return None
         if not self._validate_poller_size(function_code, size):
             return None
-        return Poller(current_device, function_code, start_address, size, endian)
+        rate = self._get_rate(row, 5)
+        return Poller(current_device, function_code, start_address, size, endian, rate)
+
+    def _get_rate(self, row, col) -> Optional[float]:
+        if len(row) <= col or not row[col].strip():
+            return None
+        try:
+            rate = float(row[col])
+        except ValueError:
+            rate = 0
+        if rate <= 0:
+            self.logger.warning(
+                f"Invalid poll rate ({row[col]}), using the default rate instead."
+            )
+            return None
+        return rate
 
     def _get_function_code(self, fc):
         fc_map = {
@@ -393,18 +1282,74 @@ class ModbusHandler:
         return None
 
     def _validate_poller_size(self, function_code, size):
-        if function_code in (1, 2) and size > 2000:
+        if function_code in (1, 2) and size > MAX_READ_BITS:
             self.logger.error(
-                f"Too many coils/discrete inputs (max. 2000): {size}. Ignoring poller."
+                f"Too many coils/discrete inputs (max. {MAX_READ_BITS}): {size}. Ignoring poller."
             )
             return False
-        if function_code in (3, 4) and size > 123:
+        if function_code in (3, 4) and size > MAX_READ_REGISTERS:
             self.logger.error(
-                f"Too many registers (max. 123): {size}. Ignoring poller."
+                f"Too many registers (max. {MAX_READ_REGISTERS}): {size}. Ignoring poller."
             )
             return False
         return True
 
+    def _coalesce_pollers(self, device: Device):
+        """Merge pollers of the same device and function code into fewer requests.
+
+        Pollers are merged when the gap between them is at most `coalesce_gap`
+        registers (or coils) and the merged block stays within the Modbus
+        limits. References keep their offsets within the merged block.
+        """
+        groups: Dict[tuple, List[Poller]] = {}
+        for p in device.pollerList:
+            groups.setdefault((p.fc, p.endian, p.rate), []).append(p)
+        poller_list = []
+        for pollers in groups.values():
+            pollers.sort(key=lambda p: p.start_address)
+            block = [pollers[0]]
+            for p in pollers[1:]:
+                if self._can_coalesce(block, p):
+                    block.append(p)
+                else:
+                    poller_list.append(self._merge_pollers(block))
+                    block = [p]
+            poller_list.append(self._merge_pollers(block))
+        if len(poller_list) < len(device.pollerList):
+            self.logger.info(
+                f"Coalesced {len(device.pollerList)} pollers into {len(poller_list)} for device {device.name}"
+            )
+        device.pollerList = poller_list
+
+    def _can_coalesce(self, block: List[Poller], poller: Poller) -> bool:
+        start = block[0].start_address
+        end = max(p.start_address + p.size for p in block)
+        if poller.start_address - end > self.coalesce_gap:
+            return False
+        size = max(end, poller.start_address + poller.size) - start
+        if poller.fc in (1, 2):
+            # coil references are addressed in bytes, keep them byte aligned
+            return size <= MAX_READ_BITS and (poller.start_address - start) % 8 == 0
+        return size <= MAX_READ_REGISTERS
+
+    def _merge_pollers(self, block: List[Poller]) -> Poller:
+        if len(block) == 1:
+            return block[0]
+        first = block[0]
+        start = first.start_address
+        end = max(p.start_address + p.size for p in block)
+        merged = Poller(
+            first.device, first.fc, start, end - start, first.endian, first.rate
+        )
+        for p in block:
+            shift = p.start_address - start
+            if p.fc in (1, 2):
+                shift //= 8
+            for ref in p.readableReferences:
+                merged.add_readable_reference(ref, p.get_reference_offset(ref) + shift)
+        merged.readableReferences.sort(key=merged.get_reference_offset)
+        return merged
+
     def _create_reference(self, row, current_device):
         if len(row) < CONFIG_REF_COL_MIN:
             self.logger.error("Invalid reference configuration")
@@ -422,7 +1367,17 @@ class ModbusHandler:
             scale = float(row[6]) if len(row) > 6 else None
         except ValueError:
             scale = None
-        return Reference(current_device, ref_name, address, dtype, rw, unit, scale)
+        deadband = self.deadband
+        if len(row) > 7 and row[7].strip():
+            try:
+                deadband = parse_deadband(row[7])
+            except ValueError:
+                self.logger.warning(
+                    f"Invalid deadband ({row[7]}) for reference {ref_name}, using the default deadband."
+                )
+        return Reference(
+            current_device, ref_name, address, dtype, rw, unit, scale, deadband
+        )
 
     def _validate_reference(self, ref, current_poller):
         if ref in current_poller.readableReferences:
@@ -436,8 +1391,39 @@ class ModbusHandler:
         return True
 
     def connect(self) -> bool:
-        if not self.connected:
-            self.connected = self.modbus_client.connect()
+        if not self.persistent:
+            if not self.connected:
+                self.connected = self.modbus_client.connect()
+            return self.connected
+        if self.connected and not self._is_client_open():
+            # the client closes its socket when a request fails
+            self.logger.warning("Modbus connection lost, reconnecting...")
+            self.connected = False
+            self._connection_lost = True
+        if self.connected:
+            return True
+        now = time.monotonic()
+        if now < self._next_connect_time:
+            return False
+        self.connected = self.modbus_client.connect()
+        if self.connected:
+            self.connectCount += 1
+            if self._connection_lost:
+                self.reconnectCount += 1
+                self._connection_lost = False
+            self._reconnect_backoff = 0.0
+            self._enable_keepalive()
+        else:
+            self.connectFailCount += 1
+            self._connection_lost = True
+            self._reconnect_backoff = min(
+                max(self._reconnect_backoff * 2, self.reconnect_delay),
+                self.reconnect_delay_max,
+            )
+            self._next_connect_time = now + self._reconnect_backoff
+            self.logger.warning(
+                f"Failed to connect to Modbus client, retrying in {self._reconnect_backoff}s"
+            )
         return self.connected
 
     def disconnect(self):
@@ -445,61 +1431,538 @@ class ModbusHandler:
             self.modbus_client.close()
             self.connected = False
 
+    def _release(self):
+        # persistent connections stay open until close() is called
+        if not self.persistent:
+            self.disconnect()
+
+    def _is_client_open(self) -> bool:
+        return getattr(self.modbus_client, "socket", None) is not None
+
+    def _enable_keepalive(self):
+        sock = getattr(self.modbus_client, "socket", None)
+        if not self.keepalive or not isinstance(sock, socket.socket):
+            return
+        if sock.type != socket.SOCK_STREAM:
+            return
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            idle = max(1, int(self.keepalive))
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+            if hasattr(socket, "TCP_KEEPINTVL"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, idle)
+        except OSError as e:
+            self.logger.warning(f"Failed to enable TCP keepalive: {e}")
+
+    def get_connection_stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "connect_count": self.connectCount,
+            "reconnect_count": self.reconnectCount,
+            "connect_fail_count": self.connectFailCount,
+        }
+
+    def get_poll_rate(self, poller: Poller) -> float:
+        return poller.rate or poller.device.rate or self.rate
+
+    def _build_schedule(self):
+        # (next due time, config order, poller), all pollers are due right away
+        now = time.monotonic()
+        self._schedule = [
+            (now, seq, p)
+            for seq, p in enumerate(
+                p for dev in self.deviceList for p in dev.pollerList
+            )
+        ]
+        heapq.heapify(self._schedule)
+
+    def next_poll_time(self) -> Optional[float]:
+        """Return the monotonic time at which the next poller is due."""
+        return self._schedule[0][0] if self._schedule else None
+
+    def is_poll_due(self, now: Optional[float] = None) -> bool:
+        next_time = self.next_poll_time()
+        if next_time is None:
+            return False
+        return next_time <= (time.monotonic() if now is None else now)
+
+    def _pop_due_pollers(self, now: float) -> List[tuple]:
+        due = []
+        while self._schedule and self._schedule[0][0] <= now:
+            due.append(heapq.heappop(self._schedule))
+        return due
+
+    def _reschedule(self, entries: List[tuple]):
+        # deadlines are anchored to the first poll (start + n * rate), so the
+        # time spent polling never shifts the schedule unless a poller overruns
+        now = time.monotonic()
+        for due_time, seq, p in entries:
+            rate = self.get_poll_rate(p)
+            next_time = due_time + rate
+            if next_time <= now:
+                self.overrunCount += 1
+                if self.overrun_policy == "skip":
+                    # stay on the grid, dropping the deadlines already missed
+                    missed = math.floor((now - due_time) / rate)
+                    self.overrunSkipCount += missed
+                    next_time = due_time + (missed + 1) * rate
+                elif self.overrun_policy == "shift":
+                    next_time = now + rate
+                # "catchup" keeps the missed deadline and polls again right away
+                self.logger.debug(
+                    f"Poller of device {p.device.name} at {p.start_address} overran its rate of {rate}s"
+                )
+            if self.autoremove:
+                # no need to wake up for a quarantined poller
+                next_time = max(
+                    next_time, p.quarantine.until, p.device.quarantine.until
+                )
+            heapq.heappush(self._schedule, (next_time, seq, p))
+
+    def get_schedule_stats(self) -> dict:
+        return {
+            "overrun_count": self.overrunCount,
+            "overrun_skipped_polls": self.overrunSkipCount,
+            "cycle_duration": self.cycleDuration.get_stats(),
+        }
+
     def poll(self):
+        cycle_start = time.monotonic()
+        due = self._pop_due_pollers(cycle_start)
+        if not due:
+            return
+        self._polled = set()
         if not self.connect():
             self.logger.error("Failed to connect to Modbus client")
+            self._reschedule(due)
             return
+        # time-outs of each device in this cycle, and the devices failing their probe
+        timeouts: Dict[str, int] = {}
+        unresponsive: set = set()
+        checked = set()
         try:
-            for dev in self.deviceList:
-                self.logger.debug(f"Polling device {dev.name} ...")
-                for p in dev.pollerList:
-                    if not p.disabled:
-                        p.poll(self.modbus_client)
-                        if on_threading_event():
-                            return
+            for _, _, p in due:
+                # pending writes take the next free slot on the bus
+                self.process_writes(release=False)
+                if not p.disabled:
+                    if self.persistent and not self.connect():
+                        return
+                    if self._is_quarantined(p, checked):
+                        continue
+                    if self._is_unresponsive(p, timeouts, unresponsive, checked):
+                        p.device.budgetSkipCount += 1
+                        continue
+                    self.logger.debug(
+                        f"Polling device {p.device.name} at {p.start_address} ..."
+                    )
+                    if self.pacer:
+                        self.pacer.wait()
+                        with self.write_queue.lock:
+                            start = time.monotonic()
+                            p.poll(self.modbus_client)
+                        self.pacer.record(time.monotonic() - start, p.last_error)
+                    else:
+                        with self.write_queue.lock:
+                            p.poll(self.modbus_client)
+                    if p.last_error is None:
+                        self._polled.update(id(ref) for ref in p.readableReferences)
+                    if p.last_error in ("timeout", "connection"):
+                        timeouts[p.device.name] = timeouts.get(p.device.name, 0) + 1
+                    if self.autoremove:
+                        self._update_quarantine(p)
+                    if on_threading_event():
+                        return
+                    if not self.pacer:
                         delay_thread(timeout=self.interval)
+            self.process_writes(release=False)
         finally:
-            self.disconnect()
+            self.cycleDuration.observe(time.monotonic() - cycle_start)
+            self._reschedule(due)
+            self._release()
             if not self.daemon:
                 self.print_results()
 
+    def _is_unresponsive(
+        self, p: Poller, timeouts: Dict[str, int], unresponsive: set, checked: set
+    ) -> bool:
+        """Return True if the device of the poller is skipped for the rest of the cycle.
+
+        A device is skipped once it used up its timeout budget, or when it
+        failed its last poll and does not respond to a probe within the
+        liveness timeout.
+        """
+        dev = p.device
+        if dev.name in unresponsive:
+            return True
+        count = timeouts.get(dev.name, 0)
+        if self.timeout_budget and count >= self.timeout_budget:
+            return True
+        if count or dev.name in checked:
+            return False
+        if self.liveness_timeout and dev.pollCount and not dev.pollSuccess:
+            checked.add(dev.name)
+            if not self._probe(p):
+                self.logger.debug(
+                    f"Device {dev.name} does not respond within {self.liveness_timeout}s, skipping it."
+                )
+                unresponsive.add(dev.name)
+                return True
+        return False
+
+    def _probe(self, p: Poller) -> bool:
+        """Probe the device of the poller, waiting at most the liveness timeout."""
+        with self.write_queue.lock:
+            params = getattr(self.modbus_client, "comm_params", None)
+            if not self.liveness_timeout or params is None:
+                return p.probe(self.modbus_client)
+            # the sync clients read the response timeout from their parameters
+            timeout = params.timeout_connect
+            params.timeout_connect = self.liveness_timeout
+            # but UDP sockets and serial ports keep the one they were opened with
+            port = getattr(self.modbus_client, "socket", None)
+            restore = _set_read_timeout(port, self.liveness_timeout)
+            try:
+                return p.probe(self.modbus_client)
+            finally:
+                params.timeout_connect = timeout
+                restore()
+
+    def _is_quarantined(self, p: Poller, checked: set) -> bool:
+        """Return True if the poller is held back, probing it once its backoff is over."""
+        if not self.autoremove:
+            return False
+        dev = p.device
+        now = time.monotonic()
+        if dev.quarantine.is_waiting(now) or p.quarantine.is_waiting(now):
+            return True
+        if not dev.quarantine.active and not p.quarantine.active:
+            return False
+        alive = self._probe(p)
+        checked.add(dev.name)
+        if not alive:
+            quarantine = dev.quarantine if dev.quarantine.active else p.quarantine
+            self._record_failure(quarantine, p, dev.quarantine is quarantine)
+            return True
+        if dev.quarantine.active:
+            self.logger.info(f"Device {dev.name} responds again, resuming polling.")
+            dev.quarantine.record(True, now, 0, 0, 0)
+        # the full poll decides whether a quarantined poller is lifted
+        return False
+
+    def _update_quarantine(self, p: Poller):
+        dev = p.device
+        if (
+            p.last_error == "exception"
+            and p.exceptionFailures >= self.quarantine_threshold
+        ):
+            # the device keeps refusing the request, e.g. an illegal address
+            p.disabled = True
+            self.logger.warning(
+                f"Removing poller of device {dev.name} at {p.start_address} after {p.exceptionFailures} exception responses."
+            )
+            return
+        now = time.monotonic()
+        if p.last_error is None:
+            p.quarantine.record(True, now, 0, 0, 0)
+        else:
+            self._record_failure(p.quarantine, p, False)
+        if p.last_error in (None, "exception"):
+            dev.quarantine.record(True, now, 0, 0, 0)
+        else:
+            self._record_failure(dev.quarantine, p, True)
+
+    def _record_failure(self, quarantine: Quarantine, p: Poller, device: bool):
+        if quarantine.record(
+            False,
+            time.monotonic(),
+            self.quarantine_threshold,
+            self.quarantine_delay,
+            self.quarantine_delay_max,
+        ):
+            name = (
+                f"device {p.device.name}"
+                if device
+                else f"poller of device {p.device.name} at {p.start_address}"
+            )
+            self.logger.warning(
+                f"Quarantined {name} for {quarantine.backoff}s after {quarantine.failures} consecutive failures."
+            )
+
     def write_coil(self, device_name: str, address: int, value) -> bool:
-        for dev in self.deviceList:
-            if dev.name == device_name:
-                try:
-                    if not self.connect():
-                        return False
+        return self._write_now(device_name, "coil", address, value)
+
+    def write_register(self, device_name, address: int, value) -> bool:
+        return self._write_now(device_name, "holding_register", address, value)
+
+    def _write_now(
+        self, device_name: str, object_type: str, address: int, value
+    ) -> bool:
+        dev = self._find_device(device_name)
+        if dev is None:
+            return False
+        try:
+            if not self.connect():
+                return False
+            return self._write(dev, object_type, address, value)
+        finally:
+            self._release()
+
+    def _write(self, dev: Device, object_type: str, address: int, value) -> bool:
+        # a list of values is written with one FC15/FC16 request
+        try:
+            if object_type == "coil":
+                if isinstance(value, list) and len(value) > 1:
+                    result = self.modbus_client.write_coils(
+                        address, value, slave=dev.devid
+                    )
+                else:
+                    value = value[0] if isinstance(value, list) else value
                     result = self.modbus_client.write_coil(
                         address, value, slave=dev.devid
                     )
-                    return not result.isError()
-                except ModbusException as e:
-                    self.logger.error(f"Error writing coil: {e}")
-                    return False
-                finally:
-                    self.disconnect()
-        self.logger.error(f"Device {device_name} not found")
+            elif isinstance(value, list) and len(value) > 1:
+                result = self.modbus_client.write_registers(
+                    address, value, slave=dev.devid
+                )
+            else:
+                value = value[0] if isinstance(value, list) else value
+                result = self.modbus_client.write_register(
+                    address, value, slave=dev.devid
+                )
+            return not result.isError()
+        except (ModbusException, ValueError, TypeError, IndexError, struct.error) as e:
+            self.logger.error(f"Error writing {object_type}: {e}")
+            return False
+
+    def _find_device(self, device_name: str) -> Optional[Device]:
+        dev = self._devices.get(device_name)
+        if dev is None:
+            self.logger.error(f"Device {device_name} not found")
+        return dev
+
+    def submit_write(
+        self,
+        device_name: str,
+        object_type: str,
+        address: int,
+        value,
+        priority: int = DEFAULT_WRITE_PRIORITY,
+        request_id=None,
+    ) -> bool:
+        """Queue a write to be sent on the next free slot of the Modbus client.
+
+        A list of values is written to consecutive addresses. Lower priority
+        values are sent first. Returns False if the request cannot be queued.
+        """
+        if object_type not in WRITE_OBJECT_TYPES:
+            self.logger.error(f"Unsupported object type for writing: {object_type}")
+            return False
+        if not self._is_valid_priority(priority):
+            return False
+        dev = self._find_device(device_name)
+        if dev is None:
+            return False
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        if not _is_valid_write(object_type, address, values):
+            self.logger.error(
+                f"Invalid {object_type} write of {value} at address {address}"
+            )
+            return False
+        description = {"object_type": object_type, "address": address, "value": value}
+        self._queue_write(
+            WriteRequest(
+                self,
+                dev,
+                [(object_type, address, values)],
+                description,
+                priority,
+                request_id,
+            )
+        )
+        return True
+
+    def submit_reference_write(
+        self,
+        device_name: str,
+        values: dict,
+        priority: int = DEFAULT_WRITE_PRIORITY,
+        request_id=None,
+    ) -> bool:
+        """Queue a write of references by name, encoded as their pollers decode them.
+
+        Returns False if a reference is unknown, read-only or cannot hold its value.
+        """
+        if not isinstance(values, dict) or not values:
+            self.logger.error(f"Invalid values to write for device {device_name}")
+            return False
+        if not self._is_valid_priority(priority):
+            return False
+        dev = self._find_device(device_name)
+        if dev is None:
+            return False
+        blocks = []
+        for ref_name, value in values.items():
+            ref = dev.references.get(ref_name)
+            if ref is None or "w" not in ref.rw or ref.poller is None:
+                self.logger.error(
+                    f"Reference {ref_name} of device {device_name} is not writable"
+                )
+                return False
+            try:
+                address, data = ref.poller.encode(ref, value)
+            except (ValueError, TypeError, struct.error) as e:
+                self.logger.error(
+                    f"Failed to encode value {value} for reference {ref_name}: {e}"
+                )
+                return False
+            object_type = "coil" if ref.poller.fc == 1 else "holding_register"
+            blocks.append((object_type, address, data))
+        self._queue_write(
+            WriteRequest(self, dev, blocks, {"values": values}, priority, request_id)
+        )
+        return True
+
+    def _is_valid_priority(self, priority) -> bool:
+        if isinstance(priority, int) and not isinstance(priority, bool):
+            return True
+        self.logger.error(f"Invalid write priority: {priority}, must be an integer")
         return False
 
-    def write_register(self, device_name, address: int, value) -> bool:
-        for dev in self.deviceList:
-            if dev.name == device_name:
-                try:
-                    if not self.connect():
-                        return False
-                    result = self.modbus_client.write_register(
-                        address, value, slave=dev.devid
+    def _queue_write(self, request: WriteRequest):
+        self.write_queue.put(request)
+        # let an idle main loop send it right away
+        wake_thread()
+
+    def next_write_time(self) -> Optional[float]:
+        """Return the monotonic time at which the queued writes are due."""
+        first = self.write_queue.first_received()
+        return None if first is None else first + self.write_window
+
+    def process_writes(self, release: bool = True) -> int:
+        """Send the queued writes of the Modbus client, return how many requests were sent.
+
+        Returns right away if another thread is using the client, as it sends
+        the writes between its own requests.
+        """
+        if not len(self.write_queue):
+            return 0
+        if self.write_window and self.next_write_time() > time.monotonic():
+            # give later writes to the same registers a chance to be merged
+            return 0
+        if not self.write_queue.lock.acquire(blocking=False):
+            return 0
+        try:
+            requests = self.write_queue.get_all()
+            if requests:
+                self._send_writes(requests)
+            if release:
+                for modbus_handler in {
+                    id(r.handler): r.handler for r in requests
+                }.values():
+                    modbus_handler._release()
+            return len(requests)
+        finally:
+            self.write_queue.lock.release()
+
+    def _send_writes(self, requests: List[WriteRequest]):
+        """Merge the requests into as few Modbus requests as possible and send them.
+
+        Later values replace earlier ones for the same register (or coil), and
+        consecutive addresses are written at once with FC15/FC16. The merged
+        blocks are sent by priority and every request is acknowledged as soon
+        as all of its values are written.
+        """
+        # (handler, device, object type) -> {address: value}, in arrival order
+        targets: Dict[tuple, dict] = {}
+        cell_priority: Dict[tuple, int] = {}
+        pending = []
+        for request in requests:
+            cells = set()
+            for object_type, address, values in request.blocks:
+                key = (id(request.handler), id(request.device), object_type)
+                target = targets.setdefault(
+                    key,
+                    {"handler": request.handler, "device": request.device, "cells": {}},
+                )
+                for i, value in enumerate(values):
+                    target["cells"][address + i] = value
+                    cell = key + (address + i,)
+                    cells.add(cell)
+                    cell_priority[cell] = min(
+                        cell_priority.get(cell, request.priority), request.priority
                     )
-                    return not result.isError()
-                except ModbusException as e:
-                    self.logger.error(f"Error writing register: {e}")
-                    return False
-                finally:
-                    self.disconnect()
-        self.logger.error(f"Device {device_name} not found")
-        return False
+            pending.append((request, cells))
+
+        blocks = []
+        for key, target in targets.items():
+            object_type = key[2]
+            max_size = MAX_WRITE_BITS if object_type == "coil" else MAX_WRITE_REGISTERS
+            addresses = sorted(target["cells"])
+            run = [addresses[0]]
+            for address in addresses[1:]:
+                if address == run[-1] + 1 and len(run) < max_size:
+                    run.append(address)
+                else:
+                    blocks.append((key, target, run))
+                    run = [address]
+            blocks.append((key, target, run))
+        blocks.sort(key=lambda b: min(cell_priority[b[0] + (a,)] for a in b[2]))
+
+        done: Dict[tuple, bool] = {}
+        for key, target, run in blocks:
+            modbus_handler = target["handler"]
+            values = [target["cells"][a] for a in run]
+            try:
+                success = modbus_handler.connect() and modbus_handler._write(
+                    target["device"], key[2], run[0], values
+                )
+            except Exception as e:
+                # only fail the requests of this block, not the rest of the batch
+                self.logger.error(f"Error writing {key[2]} at {run[0]}: {e}")
+                success = False
+            for address in run:
+                done[key + (address,)] = success
+            remaining = []
+            for request, cells in pending:
+                if cells.issubset(done.keys()):
+                    request.handler._acknowledge_write(
+                        request, all(done[c] for c in cells)
+                    )
+                else:
+                    remaining.append((request, cells))
+            pending = remaining
+
+    def _acknowledge_write(self, request: WriteRequest, success: bool):
+        latency = time.monotonic() - request.received
+        self.writeCount += 1
+        self.writeLatency.observe(latency)
+        description = ", ".join(f"{k}={v}" for k, v in request.description.items())
+        if success:
+            self.logger.info(
+                f"Successfully wrote device={request.device.name}, {description}, latency={latency:.3f}s"
+            )
+        else:
+            self.logger.warning(
+                f"Failed to write device={request.device.name}, {description}"
+            )
+        if not self.mqtt_handler or not self.mqtt_ack_topic_pattern:
+            return
+        payload = dict(request.description)
+        payload["success"] = success
+        payload["latency"] = round(latency, 6)
+        if request.request_id is not None:
+            payload["id"] = request.request_id
+        topic = self.mqtt_ack_topic_pattern.replace(
+            "{{device_name}}", request.device.name
+        )
+        self.mqtt_handler.publish(topic, json.dumps(payload))
 
     def print_results(self):
+        # only needed without --daemon
+        from prettytable import PrettyTable
+
+        tables = []
         for dev in self.deviceList:
             table = PrettyTable()
             table.field_names = ["Reference", "Value", "Unit"]
@@ -513,13 +1976,25 @@ class ModbusHandler:
                     else ref.val
                 )
                 table.add_row([ref.name, value, ref.unit or ""])
-            print(f"\nDevice: {dev.name}")
-            print(table)
+            tables.append(f"\nDevice: {dev.name}\n{table}")
+        # handlers may be polled from worker threads, keep their tables together
+        with _print_lock:
+            for table in tables:
+                print(table)
+
+    def _get_references(self, dev: Device, only_polled: bool) -> list:
+        """Return the references of a device, only those read in the last cycle if `only_polled`."""
+        if not only_polled:
+            return list(dev.references.values())
+        return [ref for ref in dev.references.values() if id(ref) in self._polled]
 
-    def publish_data(self, timestamp=None, on_change=False):
+    def publish_data(self, timestamp=None, on_change=None, only_polled=False):
         if not self.mqtt_handler or not self.mqtt_publish_topic_pattern:
             return
 
+        if on_change is None:
+            on_change = self.on_change
+        now = time.monotonic()
         for dev in self.deviceList:
             if not dev.pollSuccess:
                 self.logger.debug(
@@ -528,8 +2003,9 @@ class ModbusHandler:
                 continue
 
             payload = {}
-            for ref in dev.references.values():
-                if not on_change or ref.val != ref.last_val:
+            for ref in self._get_references(dev, only_polled):
+                if not on_change or ref.has_changed(now, self.heartbeat):
+                    ref.mark_published(now)
                     ref_val = (
                         round(ref.val, FLOAT_TYPE_PRECISION)
                         if isinstance(ref.val, float)
@@ -564,57 +2040,447 @@ class ModbusHandler:
                 "poll_count": dev.pollCount,
                 "error_count": dev.errorCount,
                 "last_poll_success": dev.pollSuccess,
+                "budget_skipped_polls": dev.budgetSkipCount,
+                "reconnect_count": self.reconnectCount,
+                "overrun_count": self.overrunCount,
+                "overrun_skipped_polls": self.overrunSkipCount,
+                "write_count": self.writeCount,
             }
+            if self.autoremove:
+                payload.update(dev.quarantine.get_stats())
+                payload["quarantined_pollers"] = sum(
+                    p.quarantine.active for p in dev.pollerList
+                )
+                payload["removed_pollers"] = sum(p.disabled for p in dev.pollerList)
+            if self.pacer:
+                payload.update(self.pacer.get_stats())
             topic = self.mqtt_diagnostics_topic_pattern.replace(
                 "{{device_name}}", dev.name
             )
             self.mqtt_handler.publish(topic, json.dumps(payload))
 
-    def export(self, file, timestamp=None):
-        data = {}
+    def export(self, timestamp=None, only_polled=False):
+        if not self.exporter:
+            return
+        if timestamp is None:
+            timestamp = get_utc_time()
         for dev in self.deviceList:
-            dev_data = {}
-            for ref in dev.references.values():
-                dev_data[ref.name] = ref.val
-            if timestamp:
-                dev_data["timestamp"] = timestamp
-            data[dev.name] = dev_data
-        try:
-            with open(file, "w") as f:
-                json.dump(data, f, indent=2)
-        except IOError as e:
-            self.logger.error(f"Error exporting data: {e}")
+            references = self._get_references(dev, only_polled)
+            if not references:
+                continue
+            values = {ref.name: ref.val for ref in references}
+            self.exporter.write(dev.name, values, timestamp)
 
     def close(self):
         self.disconnect()
         self.modbus_client = None
+        self.config_loader.close()
 
     def get_device_list(self) -> List[Device]:
         return self.deviceList
 
+    def get_device(self, device_name: str) -> Optional[Device]:
+        return self._devices.get(device_name)
 
-def setup_modbus_handlers(args, mqtt_handler: Optional[MqttHandler] = None):
-    modbus_handlers = []
-    modbus_client = _create_modbus_client(args)
-    for config_file in args.config:
-        modbus_handler = ModbusHandler(
-            modbus_client,
-            config_file,
-            mqtt_handler,
-            timeout=args.timeout,
-            interval=args.interval,
-            daemon=args.daemon,
-            mqtt_publish_topic_pattern=args.mqtt_publish_topic_pattern,
-            mqtt_diagnostics_topic_pattern=args.mqtt_diagnostics_topic_pattern,
-            mqtt_single_publish=args.mqtt_single,
+
+def _is_valid_write(object_type: str, address, values: list) -> bool:
+    """Check a raw write fits in the address space, before it is queued."""
+    if not isinstance(address, int) or isinstance(address, bool) or not values:
+        return False
+    if address < 0 or address + len(values) > 65536:
+        return False
+    if object_type == "coil":
+        return all(isinstance(v, bool) or v in (0, 1) for v in values)
+    return all(
+        isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 0xFFFF
+        for v in values
+    )
+
+
+def _get_reference_key(ref: Reference) -> tuple:
+    return (
+        ref.name,
+        ref.address,
+        ref.dtype,
+        ref.rw,
+        ref.unit,
+        ref.scale,
+        ref.deadband,
+    )
+
+
+def _get_poller_key(p: Poller) -> tuple:
+    references = sorted(
+        (p.get_reference_offset(ref),) + _get_reference_key(ref)
+        for ref in p.readableReferences
+    )
+    return (p.fc, p.start_address, p.size, p.endian, p.rate, tuple(references))
+
+
+class DeviceRegistry:
+    """Route write requests to devices and references across all Modbus configs.
+
+    The devices are indexed by name once the configs are loaded, and the
+    MQTT subscribe topic pattern is compiled into a regex extracting the
+    device name from a topic.
+    """
+
+    def __init__(self, modbus_handlers: List[ModbusHandler], topic_pattern: str):
+        self.logger = logging.getLogger(__name__)
+        self.devices: Dict[str, Tuple[ModbusHandler, Device]] = {}
+        self.update(modbus_handlers)
+        self.topic_regex = _compile_topic_pattern(topic_pattern)
+
+    def update(self, modbus_handlers: List[ModbusHandler]):
+        """Index the devices again, e.g. after a config has been reloaded."""
+        devices = {}
+        for modbus_handler in modbus_handlers:
+            for dev in modbus_handler.get_device_list():
+                if dev.name in devices:
+                    self.logger.warning(
+                        f"Device {dev.name} is defined in more than one config, writing to the first one only."
+                    )
+                    continue
+                devices[dev.name] = (modbus_handler, dev)
+        # swapped at once, as write requests are routed in the MQTT thread
+        self.devices = devices
+
+    def match_topic(self, topic: str) -> Optional[str]:
+        """Return the device name of a topic, or None if it does not match."""
+        match = self.topic_regex.fullmatch(topic)
+        return match.group(1) if match and match.groups() else None
+
+    def get_device(self, device_name: str) -> Optional[Tuple[ModbusHandler, Device]]:
+        return self.devices.get(device_name)
+
+    def get_reference(self, device_name: str, ref_name: str) -> Optional[Reference]:
+        entry = self.devices.get(device_name)
+        return entry[1].references.get(ref_name) if entry else None
+
+
+class ConfigReloader:
+    """Reload the configs in a background thread, and swap them in between polls.
+
+    A reload is started with `request()`, e.g. on SIGHUP, or every
+    `interval` seconds. `check()` is called by the main loop; once the
+    configs are loaded it applies the ones that have changed.
+    """
+
+    def __init__(self, modbus_handlers: List[ModbusHandler], interval: float = 0):
+        self.modbus_handlers = modbus_handlers
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self._requested = False
+        self._thread: Optional[threading.Thread] = None
+        self._results: list = []
+        self._next_check = time.monotonic() + interval if interval > 0 else None
+
+    def request(self):
+        """Request a reload, safe to call from a signal handler."""
+        self._requested = True
+        wake_thread()
+
+    def next_check_time(self) -> Optional[float]:
+        """Return the monotonic time at which `check()` has to be called next."""
+        if self._requested:
+            return time.monotonic()
+        # a running reload wakes up the main loop once it is done
+        return None if self._thread is not None else self._next_check
+
+    def check(self) -> bool:
+        """Start a reload when due, return True once a reloaded config was applied."""
+        if self._thread is not None:
+            if self._thread.is_alive():
+                return False
+            self._thread = None
+            changed = False
+            for modbus_handler, (config, devices) in self._results:
+                changed |= modbus_handler.apply_config(config, devices)
+            self._results = []
+            return changed
+        now = time.monotonic()
+        if self._requested or (
+            self._next_check is not None and now >= self._next_check
+        ):
+            self._requested = False
+            if self.interval > 0:
+                self._next_check = now + self.interval
+            self._thread = threading.Thread(
+                target=self._load, name="ConfigReloader", daemon=True
+            )
+            self._thread.start()
+        return False
+
+    def _load(self):
+        # the handlers of the buses of a config share one load and parse of it
+        configs: Dict[str, List[ModbusHandler]] = {}
+        for modbus_handler in self.modbus_handlers:
+            configs.setdefault(modbus_handler.config_file, []).append(modbus_handler)
+        results = []
+        for config_file, modbus_handlers in configs.items():
+            try:
+                config = modbus_handlers[0].config_loader.load(config_file)
+                if config is None:
+                    continue
+                devices = None
+                for modbus_handler in modbus_handlers:
+                    if devices is None and modbus_handler.is_config_changed(config):
+                        devices = modbus_handler._parse_config(config.rows)
+                    result = modbus_handler.check_config(config, devices)
+                    if result is not None:
+                        results.append((modbus_handler, result))
+            except Exception as e:
+                self.logger.error(f"Error reloading config {config_file}: {e}")
+        self._results = results
+        wake_thread()
+
+
+def _compile_topic_pattern(topic_pattern: str) -> "re.Pattern":
+    # MQTT wildcards: "+" matches one topic level, "#" any number of levels
+    regex = re.escape(topic_pattern)
+    regex = regex.replace(re.escape("+"), "([^/]*)").replace(re.escape("#"), "(.*)")
+    return re.compile(regex)
+
+
+class Bus:
+    """A serial port or TCP/UDP endpoint, with the client its devices share."""
+
+    __slots__ = ("transport", "client", "pacer", "write_queue")
+
+    def __init__(self, transport: Transport, client, pacer, write_queue):
+        self.transport = transport
+        self.client = client
+        self.pacer = pacer
+        self.write_queue = write_queue
+
+
+class BusArbiter:
+    """Own one Modbus client per physical bus.
+
+    The devices of all configs naming the same serial port or endpoint share
+    its client, pacer and write queue, so the requests on a bus are sent one
+    at a time, paced with the inter-frame gap of its own baud rate. Each bus
+    is a client group of `poll_handlers()`, so the buses are polled in
+    parallel. Devices without a transport use the one given on the command
+    line, which is one bus as well.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.default = get_default_transport(args)
+        self.buses: Dict[str, Bus] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def get_bus(self, transport: Optional[Transport] = None) -> Bus:
+        """Return the bus of a transport, the default one for None.
+
+        Raises ValueError if there is no transport on the command line for
+        the default bus.
+        """
+        if transport is None:
+            if self.default is None:
+                raise ValueError("No communication method specified.")
+            transport = self.default
+        bus = self.buses.get(transport.key)
+        if bus is None:
+            bus = self._create_bus(self._get_bus_args(transport))
+            self.buses[transport.key] = bus
+        elif transport is not self.default and not self._is_compatible(
+            bus.transport, transport
+        ):
+            self.logger.warning(
+                f"{transport.key} is already used as {bus.transport}, ignoring {transport}"
+            )
+        return bus
+
+    def _create_bus(self, args) -> Bus:
+        # the transport with the serial settings filled in from the command line
+        transport = get_default_transport(args)
+        self.logger.debug(f"Creating Modbus client for {transport}")
+        return Bus(
+            transport, _create_modbus_client(args), _create_pacer(args), WriteQueue()
         )
-        if modbus_handler.load_config():
-            modbus_handlers.append(modbus_handler)
+
+    def _get_bus_args(self, transport: Transport):
+        """Return a copy of the command line args with the transport of a bus in place."""
+        if transport is self.default:
+            return self.args
+        args = copy.copy(self.args)
+        args.rtu = args.tcp = args.udp = None
+        if transport.kind == "rtu":
+            args.rtu = transport.address
+            args.rtu_baud = transport.baudrate or args.rtu_baud
+            args.rtu_parity = transport.parity or args.rtu_parity
+        elif transport.kind == "tcp":
+            args.tcp = transport.address
+            args.tcp_port = transport.port
         else:
-            modbus_handler.close()
+            args.udp = transport.address
+            args.udp_port = transport.port
+        return args
+
+    @staticmethod
+    def _is_compatible(current: Transport, transport: Transport) -> bool:
+        if transport.baudrate and transport.baudrate != current.baudrate:
+            return False
+        return not transport.parity or transport.parity == current.parity
+
+
+def setup_modbus_handlers(
+    args,
+    mqtt_handler: Optional["MqttHandler"] = None,
+    exporter: Optional["ExportSink"] = None,
+    buses: Optional[Dict[str, List[Optional[str]]]] = None,
+):
+    """Create a handler per config and bus of its devices.
+
+    If `buses` is given, only the buses listed for each config file are
+    polled, by their transport key or None for the one on the command line.
+    """
+    logger = logging.getLogger(__name__)
+    modbus_handlers = []
+    arbiter = BusArbiter(args)
+    config_loader = ConfigLoader(args.config_cache or None, args.timeout)
+    for config_file in args.config:
+        logger.info(f"Loading config from: {config_file}")
+        config = config_loader.load(config_file)
+        if config is None:
+            logger.error(f"Failed to load config {config_file}. Skipping.")
+            continue
+        # one handler per bus, the handlers of a bus are polled in order
+        config_buses: Dict[Optional[str], Bus] = {}
+        for transport in get_config_transports(config.rows):
+            if buses is not None and _get_bus_key(transport) not in buses.get(
+                config_file, ()
+            ):
+                continue
+            try:
+                bus = arbiter.get_bus(transport)
+            except ValueError as e:
+                logger.error(
+                    f"{e} Skipping the devices without a transport in {config_file}."
+                )
+                continue
+            config_buses.setdefault(_get_bus_key(transport), bus)
+        config_handlers = []
+        for bus_key, bus in config_buses.items():
+            modbus_handler = ModbusHandler(
+                bus.client,
+                config_file,
+                mqtt_handler,
+                timeout=args.timeout,
+                rate=args.rate,
+                interval=args.interval,
+                daemon=args.daemon,
+                mqtt_publish_topic_pattern=args.mqtt_publish_topic_pattern,
+                mqtt_diagnostics_topic_pattern=args.mqtt_diagnostics_topic_pattern,
+                mqtt_single_publish=args.mqtt_single,
+                on_change=args.on_change,
+                deadband=args.deadband,
+                heartbeat=args.heartbeat,
+                coalesce=args.coalesce,
+                coalesce_gap=args.coalesce_gap,
+                persistent=args.persistent,
+                keepalive=args.keepalive,
+                reconnect_delay=args.reconnect_delay,
+                reconnect_delay_max=args.reconnect_delay_max,
+                pacer=bus.pacer,
+                decoder=args.decoder,
+                overrun_policy=args.overrun_policy,
+                autoremove=args.autoremove,
+                quarantine_threshold=args.quarantine_threshold,
+                quarantine_delay=args.quarantine_delay,
+                quarantine_delay_max=args.quarantine_delay_max,
+                timeout_budget=args.timeout_budget,
+                liveness_timeout=args.liveness_timeout,
+                mqtt_ack_topic_pattern=args.mqtt_ack_topic_pattern,
+                write_queue=bus.write_queue,
+                write_window=args.write_window,
+                exporter=exporter,
+                config_loader=config_loader,
+                bus=bus_key,
+            )
+            config_handlers.append(modbus_handler)
+        if not config_handlers:
+            continue
+        # parsed once, each handler keeps the devices on its own bus
+        devices = config_handlers[0]._parse_config(config.rows)
+        for modbus_handler in config_handlers:
+            if modbus_handler.load_config(config, devices):
+                modbus_handlers.append(modbus_handler)
+            else:
+                modbus_handler.close()
     return modbus_handlers
 
 
+def group_by_client(modbus_handlers) -> List[List[ModbusHandler]]:
+    """Group handlers sharing the same Modbus client, keeping their order."""
+    groups: Dict[int, List[ModbusHandler]] = {}
+    for modbus_handler in modbus_handlers:
+        groups.setdefault(id(modbus_handler.modbus_client), []).append(modbus_handler)
+    return list(groups.values())
+
+
+def _poll_group(modbus_handlers):
+    for modbus_handler in modbus_handlers:
+        if on_threading_event():
+            break
+        modbus_handler.poll()
+
+
+def poll_handlers(modbus_handlers, executor=None):
+    """Poll all handlers and yield each one as soon as its poll has finished.
+
+    Without an executor the handlers are polled one after another. With an
+    executor, handlers are grouped by Modbus client (one group per endpoint
+    or serial bus) and the groups are polled in parallel, while the handlers
+    within a group are still polled strictly in order.
+    """
+    if executor is None:
+        for modbus_handler in modbus_handlers:
+            modbus_handler.poll()
+            yield modbus_handler
+        return
+    futures = {
+        executor.submit(_poll_group, group): group
+        for group in group_by_client(modbus_handlers)
+    }
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error polling Modbus devices: {e}")
+            continue
+        yield from futures[future]
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        logging.getLogger(__name__).warning(
+            "NumPy is not installed, falling back to the struct decoder. Install it with `pip install numpy`."
+        )
+        return None
+    return numpy
+
+
+def _create_pacer(args) -> Optional[RequestPacer]:
+    if not args.adaptive_interval:
+        return None
+    return RequestPacer(args.interval, _get_frame_gap(args))
+
+
+def _get_frame_gap(args) -> float:
+    """Return the minimum silent interval between two frames on the bus."""
+    if not args.rtu:
+        return 0.0
+    # 3.5 character times of 11 bits, fixed to 1.75ms above 19200 baud
+    if args.rtu_baud > 19200:
+        return 0.00175
+    return 3.5 * 11 / args.rtu_baud
+
+
 def _create_modbus_client(args):
     if args.rtu:
         return _create_rtu_client(args)
@@ -638,6 +2504,8 @@ def _create_rtu_client(args):
     }
     if args.framer != "default":
         client_args["framer"] = args.framer
+    from pymodbus.client.serial import ModbusSerialClient
+
     return ModbusSerialClient(**client_args)
 
 
@@ -649,6 +2517,8 @@ def _create_tcp_client(args):
     }
     if args.framer != "default":
         client_args["framer"] = args.framer
+    from pymodbus.client.tcp import ModbusTcpClient
+
     return ModbusTcpClient(**client_args)
 
 
@@ -660,6 +2530,8 @@ def _create_udp_client(args):
     }
     if args.framer != "default":
         client_args["framer"] = args.framer
+    from pymodbus.client.udp import ModbusUdpClient
+
     return ModbusUdpClient(**client_args)
 
 
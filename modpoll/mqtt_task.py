@@ -1,9 +1,13 @@
 import logging
 import queue
 import socket
+import sqlite3
 import ssl
-from multiprocessing import Queue
-from typing import Optional, Tuple, List
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from typing import Callable, Optional, Tuple, List
 
 from paho.mqtt.client import (
     Client as MQTTClient,
@@ -11,9 +15,15 @@ from paho.mqtt.client import (
     ReasonCode,
     MQTTProtocolVersion,
     MQTTMessageInfo,
+    MQTT_ERR_SUCCESS,
 )
 from paho.mqtt import MQTTException
 
+from .utils import wake_thread
+
+INFLIGHT_PRUNE_SIZE = 100
+QUEUE_POLICIES = ("drop_oldest", "coalesce", "block")
+
 
 class MqttHandler:
     def __init__(
@@ -50,7 +60,10 @@ class MqttHandler:
 
         self.mqtt_client: Optional[MQTTClient] = None
         self.clean_start_or_session = qos == 0
-        self.rx_queue: Queue = Queue(maxsize=1000)
+        self.rx_queue: queue.Queue = queue.Queue(maxsize=1000)
+        self.message_handler: Optional[Callable[[str, bytes], None]] = None
+        self.inflight: List[MQTTMessageInfo] = []
+        self._inflight_lock = threading.Lock()
         self.logger = logging.getLogger(__name__)
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
@@ -97,11 +110,21 @@ class MqttHandler:
             self.logger.info(
                 f"Receive retained message ({message.topic}): {message.payload}"
             )
+        if self.message_handler:
+            # route the message straight away instead of queueing it
+            try:
+                self.message_handler(message.topic, message.payload)
+            except Exception as e:
+                self.logger.error(f"Failed to handle message ({message.topic}): {e}")
+            return
         msg = (message.topic, message.payload)
         try:
             self.rx_queue.put(msg, block=False)
         except queue.Full:
             self.logger.warning("MQTT receiving queue is full, ignoring new message.")
+            return
+        # wake up the main loop to handle the request right away
+        wake_thread()
 
     def _on_disconnect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
@@ -217,10 +240,15 @@ class MqttHandler:
 
         try:
             pubinfo = self.mqtt_client.publish(topic, msg, qos, retain)
-            self.logger.debug(
-                f"Publishing MQTT topic: {topic}, msg: {msg}, qos: {qos}, RC: {pubinfo.rc}"
-            )
-            self.logger.info(f"Publish message to topic: {topic}")
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    f"Publishing MQTT topic: {topic}, msg: {msg}, qos: {qos}, RC: {pubinfo.rc}"
+                )
+            if qos > 0:
+                if len(self.inflight) >= INFLIGHT_PRUNE_SIZE:
+                    self.get_inflight_count()
+                with self._inflight_lock:
+                    self.inflight.append(pubinfo)
             return pubinfo
         except MQTTException as ex:
             self.logger.error(
@@ -228,6 +256,10 @@ class MqttHandler:
             )
             return None
 
+    def set_message_handler(self, message_handler: Callable[[str, bytes], None]):
+        """Handle received messages in the MQTT network thread instead of `receive()`."""
+        self.message_handler = message_handler
+
     def receive(self) -> Tuple[Optional[str], Optional[bytes]]:
         try:
             topic, payload = self.rx_queue.get(block=False)
@@ -235,6 +267,12 @@ class MqttHandler:
         except queue.Empty:
             return None, None
 
+    def get_inflight_count(self) -> int:
+        """Return the number of QoS>0 messages not acknowledged by the broker yet."""
+        with self._inflight_lock:
+            self.inflight = [info for info in self.inflight if not info.is_published()]
+            return len(self.inflight)
+
     def is_connected(self) -> bool:
         return self.mqtt_client is not None and self.mqtt_client.is_connected()
 
@@ -247,3 +285,249 @@ class MqttHandler:
                 self.logger.error(f"Error during MQTT client closure: {ex}")
         else:
             self.logger.warning("MQTT client not initialized, nothing to close.")
+
+
+class OfflineBuffer:
+    """Bounded on-disk store for messages that could not be published.
+
+    Messages are kept in a SQLite database in WAL mode, so they survive a
+    restart of modpoll. When more than `maxsize` messages are stored, the
+    oldest ones are dropped.
+    """
+
+    def __init__(self, path: str, maxsize: int = 100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.storeCount = 0
+        self.replayCount = 0
+        self.dropCount = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "timestamp REAL, topic TEXT, payload BLOB, qos INTEGER, retain INTEGER)"
+        )
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        self.logger = logging.getLogger(__name__)
+        if self._count:
+            self.logger.info(f"Found {self._count} buffered MQTT message(s) in {path}")
+
+    def store(self, messages: List[tuple]):
+        """Store (topic, msg, qos, retain) messages, dropping the oldest ones if full."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO messages (timestamp, topic, payload, qos, retain) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (now, topic, msg, qos, int(retain))
+                    for topic, msg, qos, retain in messages
+                ],
+            )
+            self._count += len(messages)
+            self.storeCount += len(messages)
+            overflow = self._count - self.maxsize
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)",
+                    (overflow,),
+                )
+                self._count -= overflow
+                self.dropCount += overflow
+            self._db.commit()
+
+    def peek(self, limit: int) -> List[tuple]:
+        """Return up to `limit` of the oldest messages as (id, topic, msg, qos, retain)."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, topic, payload, qos, retain FROM messages ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def remove(self, last_id: int, count: int):
+        """Remove the messages up to `last_id` once they have been published."""
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE id <= ?", (last_id,))
+            self._db.commit()
+            self._count = max(0, self._count - count)
+            self.replayCount += count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get_stats(self) -> dict:
+        return {
+            "buffered": self._count,
+            "buffer_fill": round(self._count / self.maxsize, 3) if self.maxsize else 0,
+            "buffer_dropped": self.dropCount,
+            "replayed": self.replayCount,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class PublishQueue:
+    """Bounded outbound queue between polling and the MQTT handler.
+
+    `publish()` only enqueues the message, a background thread publishes the
+    queued messages in batches. When the queue is full, the policy decides
+    whether the oldest message is dropped (`drop_oldest`), the latest queued
+    message with the same topic is replaced (`coalesce`, falling back to
+    dropping the oldest message) or the caller waits for free space (`block`).
+
+    With an `OfflineBuffer`, messages are stored while the broker cannot be
+    reached and replayed at up to `replay_rate` messages per second once it
+    is back, after the messages polled in the meantime.
+    """
+
+    def __init__(
+        self,
+        mqtt_handler: MqttHandler,
+        maxsize: int = 1000,
+        policy: str = "drop_oldest",
+        batch_size: int = 100,
+        buffer: Optional[OfflineBuffer] = None,
+        replay_rate: float = 10.0,
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown publish queue policy: {policy}")
+        self.mqtt_handler = mqtt_handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self.buffer = buffer
+        self.replay_rate = replay_rate
+        self.publishCount = 0
+        self.dropCount = 0
+        self._queue: OrderedDict = OrderedDict()
+        self._seq = count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._busy = False
+        self._next_replay = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="PublishQueue", daemon=True
+        )
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(
+        self, topic: str, msg, qos: Optional[int] = None, retain: bool = False
+    ) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self.maxsize and self.policy == "coalesce":
+                # replace the latest queued message of the topic, keeping the order
+                for key in reversed(self._queue):
+                    if self._queue[key][0] == topic:
+                        self._queue[key] = (topic, msg, qos, retain)
+                        return
+            while len(self._queue) >= self.maxsize:
+                if self.policy == "block" and not self._closed:
+                    self._cond.wait(timeout=1.0)
+                    continue
+                self._queue.popitem(last=False)
+                self.dropCount += 1
+            self._queue[next(self._seq)] = (topic, msg, qos, retain)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    timeout = self._get_replay_timeout()
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout=timeout)
+                if self._closed and not self._queue:
+                    return
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popitem(last=False)[1])
+                self._busy = True
+                self._cond.notify_all()
+            published = self._publish_batch(batch) if batch else self._replay()
+            with self._cond:
+                self.publishCount += published
+                self._busy = False
+                self._cond.notify_all()
+            if batch:
+                self.logger.debug(f"Published {published} queued message(s).")
+
+    def _get_replay_timeout(self) -> Optional[float]:
+        """Return how long to wait before replaying buffered messages, None if never."""
+        if self.buffer is None or not len(self.buffer):
+            return None
+        if not self.mqtt_handler.is_connected():
+            # check again for the connection later
+            return 1.0
+        return max(0.0, self._next_replay - time.monotonic())
+
+    def _publish_batch(self, batch: List[tuple]) -> int:
+        for i, (topic, msg, qos, retain) in enumerate(batch):
+            if self.buffer is not None and not self.mqtt_handler.is_connected():
+                self.buffer.store(batch[i:])
+                return i
+            info = self.mqtt_handler.publish(topic, msg, qos, retain)
+            if self.buffer is not None and not _is_published(info):
+                self.buffer.store([(topic, msg, qos, retain)])
+        return len(batch)
+
+    def _replay(self) -> int:
+        limit = min(self.batch_size, max(1, int(self.replay_rate)))
+        published = 0
+        last_id = None
+        for msg_id, topic, msg, qos, retain in self.buffer.peek(limit):
+            info = self.mqtt_handler.publish(topic, msg, qos, bool(retain))
+            if not _is_published(info):
+                break
+            published += 1
+            last_id = msg_id
+        if last_id is not None:
+            self.buffer.remove(last_id, published)
+            self.logger.debug(f"Replayed {published} buffered message(s).")
+        self._next_replay = time.monotonic() + max(published, 1) / self.replay_rate
+        return published
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all queued messages are handed to the MQTT client."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._busy, timeout=timeout
+            )
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            depth = len(self._queue)
+        stats = {
+            "queue_depth": depth,
+            "published": self.publishCount,
+            "dropped": self.dropCount,
+            "inflight": self.mqtt_handler.get_inflight_count(),
+        }
+        if self.buffer is not None:
+            stats.update(self.buffer.get_stats())
+        return stats
+
+    def close(self, timeout: float = 5.0):
+        if self._thread.is_alive() and not self.flush(timeout):
+            self.logger.warning("Timed out flushing the MQTT publish queue.")
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        if self.buffer is not None:
+            self.buffer.close()
+
+
+def _is_published(info: Optional[MQTTMessageInfo]) -> bool:
+    return info is not None and info.rc == MQTT_ERR_SUCCESS
@@ -0,0 +1,389 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config_loader import ConfigLoader
+from .modbus_task import DeviceRegistry, get_default_transport, get_device_transports
+from .utils import on_threading_event, set_threading_event
+
+RESULT_QUEUE_SIZE = 100000
+DISPATCH_BATCH_SIZE = 1000
+STOP_TIMEOUT = 5.0
+
+
+def shard_configs(args, workers: int) -> List[Dict[str, List[Optional[str]]]]:
+    """Split the devices of the configs into at most `workers` shards, one per worker process.
+
+    Devices are split by endpoint: all devices on one serial port or TCP/UDP
+    endpoint, whichever config they are in, stay in one shard as an endpoint
+    is driven by one client. The endpoints are dealt out to the shards with
+    the fewest devices first. A shard maps each of its config files to the
+    buses polled from it, by transport key or None for the one of the
+    command line, as taken by `setup_modbus_handlers()`.
+    """
+    if workers <= 1:
+        return [{config_file: [None] for config_file in args.config}]
+    endpoints, device_counts = _group_by_endpoint(args)
+    count = min(workers, len(endpoints))
+    shards: List[Dict[str, List[Optional[str]]]] = [{} for _ in range(count)]
+    loads = [0] * count
+    for key in sorted(endpoints, key=lambda k: -device_counts[k]):
+        index = loads.index(min(loads))
+        loads[index] += device_counts[key]
+        for config_file, bus_keys in endpoints[key].items():
+            shards[index].setdefault(config_file, []).extend(bus_keys)
+    # keep the order of the configs on the command line
+    order = {config_file: i for i, config_file in enumerate(args.config)}
+    return [dict(sorted(shard.items(), key=lambda c: order[c[0]])) for shard in shards]
+
+
+def _group_by_endpoint(
+    args,
+) -> Tuple[Dict[Optional[str], dict], Dict[Optional[str], int]]:
+    """Return the buses of each config per endpoint, and the number of devices on each endpoint."""
+    default = get_default_transport(args)
+    config_loader = ConfigLoader(args.config_cache or None, args.timeout)
+    endpoints: Dict[Optional[str], Dict[str, List[Optional[str]]]] = {}
+    device_counts: Dict[Optional[str], int] = {}
+    for config_file in args.config:
+        config = config_loader.load(config_file)
+        # a config which fails to load now may use the default endpoint later
+        transports = get_device_transports(config.rows) if config else []
+        for transport in transports or [None]:
+            endpoint = transport or default
+            key = endpoint.key if endpoint is not None else None
+            bus_keys = endpoints.setdefault(key, {}).setdefault(config_file, [])
+            bus_key = transport.key if transport is not None else None
+            if bus_key not in bus_keys:
+                bus_keys.append(bus_key)
+            device_counts[key] = device_counts.get(key, 0) + 1
+    config_loader.close()
+    return endpoints, device_counts
+
+
+class WorkerChannel:
+    """Send the results of a worker to the supervisor.
+
+    Takes the place of the MQTT handler and the exporter of the Modbus
+    handlers of a worker, so they publish and export through the
+    supervisor. Messages are dropped when the supervisor falls behind, the
+    number of dropped messages is sent along once there is room again.
+    """
+
+    def __init__(self, results, worker_id: int):
+        self.results = results
+        self.worker_id = worker_id
+        self.droppedCount = 0
+        self._reportedCount = 0
+
+    def publish(self, topic: str, msg, qos: Optional[int] = None, retain: bool = False):
+        self._put(("publish", topic, msg, qos, retain))
+
+    def write(self, device_name: str, values: dict, timestamp: float):
+        self._put(("export", device_name, values, timestamp))
+
+    def send_devices(self, device_names: List[str]):
+        self.results.put(("devices", self.worker_id, device_names))
+
+    def _put(self, message: tuple):
+        try:
+            if self.droppedCount > self._reportedCount:
+                dropped = self.droppedCount - self._reportedCount
+                self.results.put_nowait(("dropped", self.worker_id, dropped))
+                self._reportedCount = self.droppedCount
+            self.results.put_nowait(message)
+        except queue.Full:
+            self.droppedCount += 1
+
+
+def run_worker(
+    args, worker_id: int, shard: Dict[str, List[Optional[str]]], results, requests
+):
+    """Poll a shard of the devices, the entry point of a worker process."""
+    # the supervisor stops the workers, ignore the Ctrl+C sent to the process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .main import LOG_SIMPLE, poll_loop, setup_logging
+    from .modbus_task import group_by_client, setup_modbus_handlers
+
+    setup_logging(args.loglevel, LOG_SIMPLE)
+    logger = logging.getLogger(__name__)
+    args.config = list(shard)
+    channel = WorkerChannel(results, worker_id)
+    exporter = channel if args.export else None
+    modbus_handlers = setup_modbus_handlers(args, channel, exporter, shard)
+    if not modbus_handlers:
+        logger.error(f"Worker {worker_id} has no Modbus config loaded, exiting...")
+        sys.exit(1)
+
+    def send_devices():
+        channel.send_devices(
+            [dev.name for h in modbus_handlers for dev in h.get_device_list()]
+        )
+
+    send_devices()
+    registry = DeviceRegistry(modbus_handlers, args.mqtt_subscribe_topic_pattern)
+    threading.Thread(
+        target=_receive_requests,
+        args=(requests, registry),
+        name="WorkerRequests",
+        daemon=True,
+    ).start()
+    executor = None
+    if args.concurrent or len(group_by_client(modbus_handlers)) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, args.max_workers), thread_name_prefix="modpoll"
+        )
+    try:
+        # the supervisor routes the write requests by the devices of the workers
+        poll_loop(
+            args,
+            modbus_handlers,
+            exporter,
+            executor=executor,
+            registry=registry,
+            on_reload=send_devices,
+        )
+    finally:
+        if executor:
+            executor.shutdown(wait=True)
+        for modbus_handler in modbus_handlers:
+            modbus_handler.close()
+
+
+def _receive_requests(requests, registry):
+    from .main import _handle_write_request
+
+    parent = multiprocessing.parent_process()
+    while not on_threading_event():
+        try:
+            request = requests.get(timeout=1.0)
+        except queue.Empty:
+            # stop polling if the supervisor is gone
+            if parent is not None and not parent.is_alive():
+                set_threading_event()
+            continue
+        if request is None:
+            set_threading_event()
+            break
+        topic, payload = request
+        try:
+            _handle_write_request(topic, payload, registry)
+        except Exception as e:
+            # a bad request must not stop the writes of the whole shard
+            logging.getLogger(__name__).error(
+                f"Error handling write request on {topic}: {e}"
+            )
+
+
+class Worker:
+    __slots__ = (
+        "worker_id",
+        "shard",
+        "process",
+        "requests",
+        "started",
+        "finished",
+        "restartCount",
+        "backoff",
+        "next_start",
+        "droppedCount",
+    )
+
+    def __init__(self, worker_id: int, shard: Dict[str, List[Optional[str]]]):
+        self.worker_id = worker_id
+        self.shard = shard
+        self.process = None
+        self.requests = None
+        self.started = 0.0
+        self.finished = False
+        self.restartCount = 0
+        self.backoff = 0.0
+        self.next_start = 0.0
+        # results the worker dropped as the result queue was full
+        self.droppedCount = 0
+
+
+class Supervisor:
+    """Poll the configs in worker processes, and publish their results here.
+
+    Each worker polls and decodes a shard of the configs and sends the MQTT
+    messages and exported rows over a shared result queue, which the
+    supervisor passes on to the one MQTT publisher and exporter. Write
+    requests are routed to the worker polling the device. Workers that
+    crash are restarted with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        args,
+        shards: List[Dict[str, List[Optional[str]]]],
+        publisher=None,
+        exporter=None,
+        restart_delay: float = 1.0,
+        restart_delay_max: float = 60.0,
+        target: Callable = run_worker,
+    ):
+        self.args = args
+        self.publisher = publisher
+        self.exporter = exporter
+        self.restart_delay = restart_delay
+        self.restart_delay_max = restart_delay_max
+        self.target = target
+        self.logger = logging.getLogger(__name__)
+        # spawned, as forking a process running the MQTT threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self.results = self._context.Queue(maxsize=RESULT_QUEUE_SIZE)
+        self.workers = [Worker(i, shard) for i, shard in enumerate(shards)]
+        self._devices: Dict[str, Worker] = {}
+        # only used to match the device names of the write request topics
+        self._registry = DeviceRegistry([], args.mqtt_subscribe_topic_pattern)
+
+    def start(self):
+        for worker in self.workers:
+            self._start_worker(worker)
+
+    def _start_worker(self, worker: Worker):
+        worker.requests = self._context.Queue()
+        worker.process = self._context.Process(
+            target=self.target,
+            args=(
+                self.args,
+                worker.worker_id,
+                worker.shard,
+                self.results,
+                worker.requests,
+            ),
+            name=f"modpoll-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started = time.monotonic()
+        self.logger.info(
+            f"Started worker {worker.worker_id} (pid {worker.process.pid}) for {', '.join(worker.shard)}"
+        )
+
+    def route_write(self, topic: str, payload):
+        """Pass a write request on to the worker of its device, called in the MQTT thread."""
+        worker = self._devices.get(self._registry.match_topic(topic))
+        if worker is None:
+            self.logger.error(f"No worker found for device of topic: {topic}")
+            return
+        worker.requests.put((topic, payload))
+
+    def reload(self):
+        """Let the workers reload their configs, as on SIGHUP."""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGHUP)
+
+    def run(self):
+        """Dispatch the results until stopped or all workers have finished."""
+        diagnostics_rate = getattr(self.args, "diagnostics_rate", 0)
+        next_diag = time.monotonic() if diagnostics_rate > 0 else None
+        while not on_threading_event():
+            self.dispatch(timeout=0.5)
+            self._check_workers()
+            if all(worker.finished for worker in self.workers):
+                break
+            if next_diag is not None and time.monotonic() >= next_diag:
+                next_diag = time.monotonic() + diagnostics_rate
+                stats = self.get_stats()
+                self.logger.info(
+                    f"Workers: alive={stats['alive']}/{stats['workers']}, restarts={stats['restarts']}, dropped results={stats['dropped']}"
+                )
+
+    def dispatch(self, timeout: float = 0) -> int:
+        """Pass on the results received from the workers, return their number."""
+        count = 0
+        try:
+            if timeout:
+                self._handle_result(self.results.get(timeout=timeout))
+                count += 1
+            while count < DISPATCH_BATCH_SIZE:
+                self._handle_result(self.results.get_nowait())
+                count += 1
+        except queue.Empty:
+            pass
+        return count
+
+    def _handle_result(self, message: tuple):
+        kind = message[0]
+        if kind == "publish":
+            if self.publisher is not None:
+                self.publisher.publish(*message[1:])
+        elif kind == "export":
+            if self.exporter is not None:
+                self.exporter.write(*message[1:])
+        elif kind == "devices":
+            worker = self.workers[message[1]]
+            # sent again after a reload, replacing the devices of the worker
+            devices = {n: w for n, w in self._devices.items() if w is not worker}
+            for device_name in message[2]:
+                devices[device_name] = worker
+            self._devices = devices
+        elif kind == "dropped":
+            worker = self.workers[message[1]]
+            worker.droppedCount += message[2]
+            self.logger.warning(
+                f"Worker {worker.worker_id} dropped {message[2]} result(s), the supervisor falls behind."
+            )
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.finished or worker.process.is_alive():
+                continue
+            if worker.process.exitcode == 0:
+                worker.finished = True
+                self.logger.info(f"Worker {worker.worker_id} has finished.")
+                continue
+            if worker.next_start == 0:
+                # a worker that ran for a while restarts without delay again
+                if now - worker.started >= self.restart_delay_max:
+                    worker.backoff = 0.0
+                worker.backoff = min(
+                    max(worker.backoff * 2, self.restart_delay), self.restart_delay_max
+                )
+                worker.next_start = now + worker.backoff
+                self.logger.error(
+                    f"Worker {worker.worker_id} exited with code {worker.process.exitcode}, restarting it in {worker.backoff}s"
+                )
+            elif now >= worker.next_start:
+                worker.next_start = 0.0
+                worker.restartCount += 1
+                self._start_worker(worker)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "alive": sum(w.process.is_alive() for w in self.workers if w.process),
+            "restarts": sum(w.restartCount for w in self.workers),
+            "dropped": sum(w.droppedCount for w in self.workers),
+        }
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.requests.put(None)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            # keep draining, a worker blocked on a full result queue cannot exit
+            while worker.process.is_alive() and time.monotonic() < deadline:
+                self.dispatch(timeout=0.1)
+                worker.process.join(timeout=0.1)
+            if worker.process.is_alive():
+                self.logger.warning(f"Terminating worker {worker.worker_id}")
+                worker.process.terminate()
+                worker.process.join()
+        while self.dispatch():
+            pass
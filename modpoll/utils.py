@@ -1,12 +1,16 @@
+import bisect
 import threading
 import datetime
+from typing import Optional, Sequence
 from datetime import timezone
 
 _thread_event = threading.Event()
+_wake_event = threading.Event()
 
 
 def set_threading_event():
     _thread_event.set()
+    _wake_event.set()
 
 
 def on_threading_event() -> bool:
@@ -17,7 +21,65 @@ def delay_thread(timeout: int):
     _thread_event.wait(timeout=timeout)
 
 
+def wake_thread():
+    """Wake up a thread sleeping in `wait_thread()`, e.g. when a message has arrived."""
+    _wake_event.set()
+
+
+def wait_thread(timeout: Optional[float] = None) -> bool:
+    """Sleep until `timeout` expires or `wake_thread()` is called.
+
+    Returns True if the thread was woken up before the timeout.
+    """
+    woken = _wake_event.wait(timeout=timeout)
+    _wake_event.clear()
+    return woken
+
+
 def get_utc_time():
     dt = datetime.datetime.now(timezone.utc)
     utc_time = dt.replace(tzinfo=timezone.utc)
     return utc_time.timestamp()
+
+
+def parse_deadband(text: str):
+    """Parse a deadband such as `0.5` (absolute) or `2%` (of the last published value).
+
+    Returns a tuple of (deadband, is_percentage).
+    """
+    text = text.strip()
+    percentage = text.endswith("%")
+    value = float(text[:-1] if percentage else text)
+    if value < 0:
+        raise ValueError(f"Deadband must not be negative: {text}")
+    return value, percentage
+
+
+class Histogram:
+    """Cumulative histogram of durations in seconds, with Prometheus style buckets."""
+
+    DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def get_stats(self) -> dict:
+        """Return the count, sum and cumulative count per upper bound ("+Inf" for all)."""
+        with self._lock:
+            buckets = {}
+            total = 0
+            for bound, n in zip(self.buckets, self.counts):
+                total += n
+                buckets[f"{bound:g}"] = total
+            buckets["+Inf"] = self.count
+            return {"count": self.count, "sum": round(self.sum, 6), "buckets": buckets}
@@ -0,0 +1,46 @@
+import pytest
+from pymodbus.pdu import ExceptionResponse
+
+
+class FakeResponse:
+    def __init__(self, registers=None, bits=None):
+        self.registers = registers
+        self.bits = bits
+
+    def isError(self):
+        return False
+
+
+class FakeMaster:
+    """Serve a register and coil map, counting the requests.
+
+    Every request is refused with an exception response while `fail` is set.
+    """
+
+    def __init__(self, registers=None, bits=None):
+        self.registers = registers if registers is not None else {}
+        self.bits = bits if bits is not None else {}
+        self.requests = 0
+        self.fail = False
+
+    def _read_bits(self, address, count, slave=None):
+        self.requests += 1
+        if self.fail:
+            return ExceptionResponse(1, 2)
+        bits = [self.bits.get(address + i, False) for i in range(count)]
+        return FakeResponse(bits=bits + [False] * (-len(bits) % 8))
+
+    def _read_registers(self, address, count, slave=None):
+        self.requests += 1
+        if self.fail:
+            return ExceptionResponse(3, 2)
+        return FakeResponse([self.registers.get(address + i, 0) for i in range(count)])
+
+    read_coils = read_discrete_inputs = _read_bits
+    read_holding_registers = read_input_registers = _read_registers
+
+
+@pytest.fixture
+def fake_master():
+    """Return a fake Modbus client serving a register and coil map, see `FakeMaster`."""
+    return FakeMaster
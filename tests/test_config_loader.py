@@ -0,0 +1,96 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from modpoll.config_loader import ConfigLoader
+
+
+class BrokenSession:
+    def get(self, *args, **kwargs):
+        raise requests.ConnectionError("Connection refused")
+
+    def close(self):
+        pass
+
+
+CONFIG = "device,dev01,1\npoll,holding_register,0,2,BE_BE\nref,power,0,uint16,r\n"
+
+
+@pytest.fixture
+def config_server():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            received.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = CONFIG.encode("utf-8")
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/config.csv", received
+    server.shutdown()
+    server.server_close()
+
+
+def test_config_loader_local_file(tmp_path):
+    file = tmp_path / "config.csv"
+    file.write_text(CONFIG)
+    loader = ConfigLoader()
+    config = loader.load(str(file))
+    assert config.source == "file"
+    assert config.rows[0] == ["device", "dev01", "1"]
+    # unchanged files are not parsed again
+    assert loader.load(str(file)) is config
+    assert loader.load(file.as_uri()).rows == config.rows
+
+    file.write_text(CONFIG + "ref,energy,1,uint16,r\n")
+    changed = loader.load(str(file))
+    assert changed is not config
+    assert changed.rows[-1] == ["ref", "energy", "1", "uint16", "r"]
+    assert loader.load(str(tmp_path / "missing.csv")) is None
+    assert loader.load("ftp://example.com/config.csv") is None
+
+
+def test_config_loader_remote_revalidates(config_server, tmp_path):
+    url, received = config_server
+    loader = ConfigLoader(str(tmp_path / "cache"))
+    config = loader.load(url)
+    assert config.source == "remote"
+    assert config.version == ('"v1"', None)
+    assert loader.load(url) is config
+    assert received[1]["If-None-Match"] == '"v1"'
+    assert len(os.listdir(tmp_path / "cache")) == 2
+    loader.close()
+
+
+def test_config_loader_remote_offline(config_server, tmp_path):
+    url, _ = config_server
+    cache_dir = str(tmp_path / "cache")
+    rows = ConfigLoader(cache_dir).load(url).rows
+
+    # a cold start with the config host unreachable loads the cached copy
+    loader = ConfigLoader(cache_dir)
+    loader._session = BrokenSession()
+    config = loader.load(url)
+    assert config.source == "cache"
+    assert config.rows == rows
+
+    loader = ConfigLoader(None)
+    loader._session = BrokenSession()
+    assert loader.load(url) is None
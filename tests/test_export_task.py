@@ -0,0 +1,156 @@
+import csv
+import json
+import time
+
+import pytest
+
+from modpoll.export_task import ExportSink, get_export_format
+from modpoll.modbus_task import ModbusHandler
+
+
+def test_export_format_from_extension():
+    assert get_export_format("data.csv") == "csv"
+    assert get_export_format("data.parquet") == "parquet"
+    assert get_export_format("data.json") == "json"
+    assert get_export_format("data.log") == "jsonl"
+    assert get_export_format("data.json", "csv") == "csv"
+
+
+def test_export_jsonl_appends_rows(tmp_path):
+    file = tmp_path / "data.jsonl"
+    file.write_text('{"timestamp": 0.0, "device": "old"}\n')
+    sink = ExportSink(str(file), flush_interval=60)
+    sink.write("dev01", {"power": 1.5, "flags": [True, False]}, 100.0)
+    sink.write("dev02", {"name": "pump"}, 100.0)
+    sink.close()
+    rows = [json.loads(line) for line in file.read_text().splitlines()]
+    assert rows == [
+        {"timestamp": 0.0, "device": "old"},
+        {"timestamp": 100.0, "device": "dev01", "power": 1.5, "flags": [True, False]},
+        {"timestamp": 100.0, "device": "dev02", "name": "pump"},
+    ]
+    assert sink.get_stats() == {"rows": 2, "rotations": 0}
+
+
+def test_export_csv_flush_interval(tmp_path):
+    file = tmp_path / "data.csv"
+    sink = ExportSink(str(file), flush_interval=0.05)
+    sink.write("dev01", {"power": 1.5, "name": "pump"}, 100.0)
+    # rows stay buffered until the flush interval has passed
+    assert file.read_text() == ""
+    # and are then flushed without waiting for the next write
+    time.sleep(0.15)
+    assert len(file.read_text().splitlines()) == 3
+    sink.write("dev01", {"power": 2, "name": "pump"}, 101.0)
+    time.sleep(0.15)
+    with open(file, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["timestamp", "device", "reference", "value"],
+        ["100.0", "dev01", "power", "1.5"],
+        ["100.0", "dev01", "name", '"pump"'],
+        ["101.0", "dev01", "power", "2"],
+        ["101.0", "dev01", "name", '"pump"'],
+    ]
+    # one row per reference
+    assert sink.get_stats()["rows"] == 4
+    sink.close()
+
+
+def test_export_json_snapshot(tmp_path):
+    file = tmp_path / "data.json"
+    sink = ExportSink(str(file), flush_interval=60)
+    sink.write("dev01", {"power": 1, "energy": 5}, 100.0)
+    sink.write("dev02", {"power": 2}, 100.0)
+    # only the fast poller of dev01 was read
+    sink.write("dev01", {"power": 3}, 110.0)
+    sink.close()
+    assert json.loads(file.read_text()) == {
+        "dev01": {"power": 3, "energy": 5, "timestamp": 110.0},
+        "dev02": {"power": 2, "timestamp": 100.0},
+    }
+
+
+def test_export_rotate_by_size(tmp_path):
+    file = tmp_path / "data.jsonl"
+    sink = ExportSink(str(file), rotate_size=100)
+    for i in range(5):
+        sink.write("dev01", {"power": i, "energy": 1000 + i}, 100.0 + i)
+    sink.close()
+    rotated = sorted(tmp_path.glob("data.*.jsonl"))
+    assert len(rotated) == sink.rotateCount == 2
+    lines = [line for f in rotated for line in f.read_text().splitlines()]
+    lines += file.read_text().splitlines()
+    assert [json.loads(line)["power"] for line in lines] == [0, 1, 2, 3, 4]
+
+
+def test_export_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    file = tmp_path / "data.parquet"
+    sink = ExportSink(str(file), flush_interval=0)
+    sink.write("dev01", {"power": 1.5, "flags": [True]}, 100.0)
+    sink.close()
+    table = pq.read_table(str(file))
+    assert table.column("value").to_pylist() == [1.5, None]
+    assert table.column("text").to_pylist() == [None, "[true]"]
+
+
+def test_modbus_handler_export(tmp_path):
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "2", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["device", "dev02", "2"],
+        ["poll", "holding_register", "0", "2", "BE_BE"],
+        ["ref", "energy", "1", "uint16", "r"],
+    ]
+    file = tmp_path / "data.jsonl"
+    sink = ExportSink(str(file))
+    modbus_handler = ModbusHandler(None, "test.csv", exporter=sink)
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler.export(timestamp=100.0)
+    modbus_handler.export(timestamp=110.0)
+    sink.close()
+    rows = [json.loads(line) for line in file.read_text().splitlines()]
+    assert [(row["timestamp"], row["device"]) for row in rows] == [
+        (100.0, "dev01"),
+        (100.0, "dev02"),
+        (110.0, "dev01"),
+        (110.0, "dev02"),
+    ]
+
+
+def test_modbus_handler_export_only_polled(tmp_path, fake_master):
+    config = [
+        ["device", "dev01", "1", "0.1"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "10", "1", "BE_BE", "60"],
+        ["ref", "energy", "10", "uint16", "r"],
+        ["device", "dev02", "2", "60"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+    ]
+    file = tmp_path / "data.jsonl"
+    sink = ExportSink(str(file))
+    master = fake_master()
+    modbus_handler = ModbusHandler(
+        master, "test.csv", interval=0, daemon=True, exporter=sink
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    modbus_handler.poll()
+    modbus_handler.export(timestamp=100.0, only_polled=True)
+    time.sleep(0.12)
+    modbus_handler.poll()
+    # the slow poller and the slow device were not read again
+    modbus_handler.export(timestamp=110.0, only_polled=True)
+    sink.close()
+    rows = [json.loads(line) for line in file.read_text().splitlines()]
+    assert [(row["timestamp"], row["device"]) for row in rows] == [
+        (100.0, "dev01"),
+        (100.0, "dev02"),
+        (110.0, "dev01"),
+    ]
+    assert "energy" not in rows[2]
@@ -0,0 +1,76 @@
+import subprocess
+import sys
+
+import modpoll.main
+from modpoll.arg_parser import get_parser
+from modpoll.main import _handle_write_request, poll_loop
+from modpoll.modbus_task import DeviceRegistry, ModbusHandler
+
+
+def test_main_lazy_imports():
+    # optional dependencies are only imported once the features using them are enabled
+    code = (
+        "import sys, modpoll.main; "
+        "print(' '.join(m for m in ('requests', 'paho.mqtt.client', 'prettytable', "
+        "'http.server', 'sqlite3') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.split() == []
+
+
+def test_main_handle_invalid_write_requests():
+    modbus_handler = ModbusHandler(None, "test.csv")
+    modbus_handler.deviceList = modbus_handler._parse_config(
+        [
+            ["device", "dev01", "1"],
+            ["poll", "holding_register", "0", "1", "BE_BE"],
+            ["ref", "mode", "0", "uint16", "rw"],
+        ]
+    )
+    registry = DeviceRegistry([modbus_handler], "modpoll/+/set")
+    for payload in (
+        b"[1, 2]",
+        b'{"values": [1]}',
+        b"\xff\xfe",
+        b'{"reference": "mode", "value": 1, "priority": "high"}',
+        b'{"object_type": "holding_register", "address": 0, "value": []}',
+    ):
+        _handle_write_request("modpoll/dev01/set", payload, registry)
+    assert len(modbus_handler.write_queue) == 0
+    _handle_write_request(
+        "modpoll/dev01/set", b'{"reference": "mode", "value": 1}', registry
+    )
+    assert len(modbus_handler.write_queue) == 1
+
+
+def test_main_poll_loop_writes_after_polling(monkeypatch):
+    events = []
+
+    class StubHandler:
+        def __init__(self, name):
+            self.name = name
+            self.modbus_client = object()
+
+        def is_poll_due(self):
+            return True
+
+        def process_writes(self):
+            events.append(f"write {self.name}")
+
+    handlers = [StubHandler("a"), StubHandler("b")]
+
+    def poll_handlers(due_handlers, executor):
+        # b finishes first while a is still being polled in another thread
+        yield handlers[1]
+        events.append("polled a")
+        yield handlers[0]
+
+    monkeypatch.setattr(modpoll.main, "poll_handlers", poll_handlers)
+    monkeypatch.setattr(modpoll.main, "on_threading_event", lambda: False)
+    monkeypatch.setattr(modpoll.main, "set_threading_event", lambda: None)
+    args = get_parser().parse_args(["--once", "--config", "test.csv", "--tcp", "h"])
+    poll_loop(args, handlers)
+    assert events[:2] == ["write b", "polled a"]
+    assert "write a" in events
@@ -0,0 +1,75 @@
+import urllib.request
+
+from modpoll.metrics import MetricsServer
+from modpoll.modbus_task import ModbusHandler, RequestPacer
+
+
+class FakePublisher:
+    def get_stats(self):
+        return {
+            "queue_depth": 3,
+            "published": 10,
+            "dropped": 1,
+            "inflight": 0,
+            "buffered": 25,
+            "buffer_fill": 0.25,
+        }
+
+
+def _setup_handler():
+    config = [
+        ["device", 'meter"1', "1"],
+        ["poll", "holding_register", "0", "4", "BE_BE"],
+        ["ref", "power", "0", "float32", "r"],
+        ["ref", "name", "2", "string8", "r"],
+    ]
+    modbus_handler = ModbusHandler(None, "site.csv")
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    return modbus_handler
+
+
+def test_metrics_render(fake_master):
+    modbus_handler = _setup_handler()
+    poller = modbus_handler.deviceList[0].pollerList[0]
+    master = fake_master()
+    assert poller.poll(master)
+    master.fail = True
+    assert not poller.poll(master)
+
+    text = MetricsServer([modbus_handler], FakePublisher()).render()
+    labels = 'device="meter\\"1",object_type="holding_register",address="0"'
+    assert f"modpoll_request_duration_seconds_count{{{labels}}} 2" in text
+    assert f'modpoll_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f'modpoll_request_errors_total{{{labels},error="exception"}} 1' in text
+    assert f'modpoll_request_errors_total{{{labels},error="timeout"}} 0' in text
+    assert f"modpoll_received_bytes_total{{{labels}}} 8" in text
+    assert 'modpoll_device_polls_total{device="meter\\"1"} 2' in text
+    assert 'modpoll_cycle_duration_seconds_count{config="site.csv"} 0' in text
+    assert "# TYPE modpoll_mqtt_queue_depth gauge" in text
+    assert "modpoll_mqtt_dropped_total 1" in text
+    assert "modpoll_mqtt_buffer_fill_ratio 0.25" in text
+    assert "modpoll_request_interval_seconds" not in text
+
+    modbus_handler.pacer = RequestPacer(0.5, 0.01)
+    modbus_handler.pacer.record(0.02)
+    text = MetricsServer([modbus_handler]).render()
+    assert 'modpoll_request_interval_seconds{config="site.csv"} 0.25' in text
+    assert 'modpoll_pacer_error_rate{config="site.csv"} 0' in text
+
+    # large counters are exported exactly
+    poller.bytesCount = 123456789
+    text = MetricsServer([modbus_handler]).render()
+    assert f"modpoll_received_bytes_total{{{labels}}} 123456789" in text
+
+
+def test_metrics_server():
+    metrics_server = MetricsServer([_setup_handler()], port=0, host="127.0.0.1")
+    assert metrics_server.start()
+    try:
+        url = f"http://127.0.0.1:{metrics_server.port}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            body = response.read().decode("utf-8")
+        assert "# TYPE modpoll_request_duration_seconds histogram" in body
+    finally:
+        metrics_server.close()
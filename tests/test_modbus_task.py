@@ -1,6 +1,39 @@
+import csv
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from pymodbus.constants import Endian
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.payload import BinaryPayloadDecoder
+from pymodbus.pdu import ExceptionResponse
+
 from modpoll.arg_parser import get_parser
-from modpoll.modbus_task import setup_modbus_handlers
+from modpoll.export_task import ExportSink
+from modpoll.modbus_task import (
+    ConfigReloader,
+    Device,
+    DeviceRegistry,
+    ModbusHandler,
+    Poller,
+    Reference,
+    RequestPacer,
+    STRUCT_FORMATS,
+    get_config_transports,
+    group_by_client,
+    parse_transport,
+    poll_handlers,
+    setup_modbus_handlers,
+)
+from modpoll.utils import Histogram
+
+from conftest import FakeMaster, FakeResponse
 
 
 def test_modbus_task_modbus_setup():
@@ -47,3 +80,1131 @@ def test_modbus_task_poll_modsim():
 
     modbus_handler.disconnect()
     modbus_handler.close()
+
+
+def test_modbus_task_concurrent_setup():
+    parser = get_parser()
+    args = parser.parse_args(
+        [
+            "--config",
+            "examples/modsim.csv",
+            "examples/modsim2.csv",
+            "--tcp",
+            "modsim.topmaker.net",
+            "--concurrent",
+        ]
+    )
+    modbus_handlers = setup_modbus_handlers(args)
+    assert len(modbus_handlers) == 2
+    # both configs are polled through the one connection to the endpoint
+    assert modbus_handlers[0].modbus_client is modbus_handlers[1].modbus_client
+    assert len(group_by_client(modbus_handlers)) == 1
+
+
+def test_modbus_task_poll_handlers_in_parallel():
+    # the first handler of each bus only finishes once all buses are polled
+    barrier = threading.Barrier(3)
+
+    class SlowHandler:
+        def __init__(self, modbus_client, wait=True):
+            self.modbus_client = modbus_client
+            self.wait = wait
+            self.start = self.end = None
+
+        def poll(self):
+            self.start = time.monotonic()
+            if self.wait:
+                barrier.wait(timeout=5)
+            time.sleep(0.05)
+            self.end = time.monotonic()
+
+    bus = object()
+    handlers = [SlowHandler(object()), SlowHandler(object()), SlowHandler(bus)]
+    handlers.append(SlowHandler(bus, wait=False))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        polled = list(poll_handlers(handlers, executor))
+    assert sorted(map(id, polled)) == sorted(map(id, handlers))
+    # handlers sharing a bus are polled in order, the rest in parallel
+    assert handlers[3].start >= handlers[2].end
+    assert max(h.start for h in handlers[:3]) < min(h.end for h in handlers[:3])
+
+
+class FakeClient:
+    def __init__(self, connect_results):
+        self.connect_results = list(connect_results)
+        self.socket = None
+        self.requests = 0
+
+    def connect(self):
+        if self.socket is None and self.connect_results.pop(0):
+            self.socket = object()
+        return self.socket is not None
+
+    def close(self):
+        self.socket = None
+
+    def read_holding_registers(self, address, count, slave=None):
+        self.requests += 1
+        return FakeResponse(registers=[7] * count)
+
+
+def test_modbus_task_persistent_reconnect_with_backoff():
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+    ]
+    client = FakeClient([True, False, True])
+    modbus_handler = ModbusHandler(
+        client,
+        "test.csv",
+        persistent=True,
+        reconnect_delay=0.1,
+        interval=0,
+        daemon=True,
+    )
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    assert modbus_handler.connect()
+    # the connection is kept open after polling
+    modbus_handler.poll()
+    assert client.requests == 1
+    assert modbus_handler.deviceList[0].pollSuccess
+    assert client.socket is not None
+
+    # a failed request drops the socket, the failed reconnect starts a backoff
+    client.close()
+    assert not modbus_handler.connect()
+    assert not modbus_handler.connect()
+    time.sleep(0.15)
+    assert modbus_handler.connect()
+    stats = modbus_handler.get_connection_stats()
+    assert stats["connect_count"] == 2
+    assert stats["reconnect_count"] == 1
+    assert stats["connect_fail_count"] == 1
+
+
+COALESCE_CONFIG = [
+    ["device", "dev01", "1"],
+    ["poll", "coil", "0", "16", "BE_BE"],
+    ["ref", "coil01-08", "0", "bool8", "r"],
+    ["ref", "coil09-16", "1", "bool8", "r"],
+    ["poll", "coil", "16", "8", "BE_BE"],
+    ["ref", "coil17-24", "16", "bool8", "r"],
+    ["poll", "holding_register", "100", "4", "BE_BE"],
+    ["ref", "reg100", "100", "uint16", "r"],
+    ["ref", "reg101", "101", "float32", "r", "", "10"],
+    ["poll", "holding_register", "101", "2", "BE_BE"],
+    ["ref", "reg101_raw", "101", "uint32", "r"],
+    ["poll", "holding_register", "106", "2", "BE_BE"],
+    ["ref", "reg106", "106", "int32", "r"],
+    ["poll", "holding_register", "300", "2", "BE_BE"],
+    ["ref", "reg300", "300", "uint16", "r"],
+]
+
+
+def _poll_config(config, master, **kwargs):
+    modbus_handler = ModbusHandler(None, "test.csv", **kwargs)
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    if modbus_handler.coalesce:
+        for dev in modbus_handler.deviceList:
+            modbus_handler._coalesce_pollers(dev)
+    for dev in modbus_handler.deviceList:
+        for p in dev.pollerList:
+            assert p.poll(master)
+    return modbus_handler
+
+
+def test_modbus_task_coalesce_pollers():
+    registers = {100: 7, 101: 0x4148, 102: 0xF5C3, 106: 0xFFFF, 107: 0xFFFE, 300: 3}
+    bits = {0: True, 9: True, 17: True, 23: True}
+    plain_master = FakeMaster(registers, bits)
+    plain = _poll_config(COALESCE_CONFIG, plain_master)
+    merged_master = FakeMaster(registers, bits)
+    merged = _poll_config(COALESCE_CONFIG, merged_master, coalesce=True, coalesce_gap=2)
+    assert plain_master.requests == 6
+    assert merged_master.requests == 3
+    plain_values = {r.name: r.val for r in plain.deviceList[0].references.values()}
+    merged_values = {r.name: r.val for r in merged.deviceList[0].references.values()}
+    assert merged_values == plain_values
+    assert merged_values["reg106"] == -2
+    assert merged_values["reg101_raw"] == 0x4148F5C3
+
+
+def test_modbus_task_coalesced_pollers_publish_and_export(tmp_path):
+    registers = {100: 7, 101: 0x4148, 102: 0xF5C3, 106: 0xFFFF, 107: 0xFFFE, 300: 3}
+    bits = {0: True, 9: True, 17: True, 23: True}
+    mqtt_handler = FakeMqttHandler()
+    file = tmp_path / "data.jsonl"
+    sink = ExportSink(str(file))
+    modbus_handler = ModbusHandler(
+        FakeMaster(registers, bits),
+        "test.csv",
+        mqtt_handler,
+        interval=0,
+        daemon=True,
+        mqtt_publish_topic_pattern="modpoll/{{device_name}}/data",
+        exporter=sink,
+        coalesce=True,
+        coalesce_gap=2,
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(COALESCE_CONFIG)
+    modbus_handler._coalesce_pollers(modbus_handler.deviceList[0])
+    modbus_handler._build_schedule()
+    modbus_handler.poll()
+    # the references of the merged pollers count as read
+    names = set(modbus_handler.deviceList[0].references)
+    modbus_handler.publish_data(only_polled=True)
+    assert set(json.loads(mqtt_handler.messages[-1][1])) == names
+    modbus_handler.export(timestamp=100.0, only_polled=True)
+    sink.close()
+    row = json.loads(file.read_text())
+    assert set(row) == names | {"timestamp", "device"}
+
+
+def test_modbus_task_per_poller_rate():
+    config = [
+        ["device", "dev01", "1", "0.1"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "10", "1", "BE_BE", "60"],
+        ["ref", "energy", "10", "uint16", "r"],
+    ]
+    master = FakeMaster({0: 1, 10: 2}, {})
+    mqtt_handler = FakeMqttHandler()
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        mqtt_handler,
+        interval=0,
+        daemon=True,
+        mqtt_publish_topic_pattern="modpoll/{{device_name}}/data",
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    pollers = modbus_handler.deviceList[0].pollerList
+    assert [modbus_handler.get_poll_rate(p) for p in pollers] == [0.1, 60]
+
+    modbus_handler.poll()
+    assert master.requests == 2
+    modbus_handler.poll()
+    assert master.requests == 2
+    time.sleep(0.12)
+    assert modbus_handler.is_poll_due()
+    modbus_handler.poll()
+    # only the fast poller was due
+    assert master.requests == 3
+    # only the values read in this cycle are published
+    modbus_handler.publish_data(only_polled=True)
+    assert json.loads(mqtt_handler.messages[-1][1]) == {"power": 1}
+    modbus_handler.publish_data()
+    assert json.loads(mqtt_handler.messages[-1][1]) == {"power": 1, "energy": 2}
+    assert modbus_handler.next_poll_time() <= time.monotonic() + 0.1
+
+
+def test_modbus_task_overrun_policy():
+    config = [
+        ["device", "dev01", "1", "0.1"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+    ]
+    next_times = {}
+    for policy in ("skip", "catchup", "shift"):
+        modbus_handler = ModbusHandler(None, "test.csv", overrun_policy=policy)
+        modbus_handler.deviceList = modbus_handler._parse_config(config)
+        poller = modbus_handler.deviceList[0].pollerList[0]
+        due_time = time.monotonic() - 0.35
+        modbus_handler._reschedule([(due_time, 0, poller)])
+        next_times[policy] = modbus_handler.next_poll_time() - due_time
+        assert modbus_handler.overrunCount == 1
+        if policy == "skip":
+            assert modbus_handler.overrunSkipCount == 3
+    assert next_times["skip"] == pytest.approx(0.4)
+    assert next_times["catchup"] == pytest.approx(0.1)
+    assert 0.45 <= next_times["shift"] < 0.55
+    with pytest.raises(ValueError):
+        ModbusHandler(None, "test.csv", overrun_policy="unknown")
+
+    # on time polls stay anchored to the first deadline without overruns
+    modbus_handler = ModbusHandler(None, "test.csv")
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    poller = modbus_handler.deviceList[0].pollerList[0]
+    due_time = time.monotonic()
+    modbus_handler._reschedule([(due_time, 0, poller)])
+    assert modbus_handler.next_poll_time() == due_time + 0.1
+    assert modbus_handler.overrunCount == 0
+
+
+class FlakyMaster(FakeMaster):
+    """Time out the requests to offline slaves, refuse those to bad addresses."""
+
+    def __init__(self, registers, offline=(), refused=(), behind_gateway=()):
+        super().__init__(registers, {})
+        self.offline = set(offline)
+        self.refused = set(refused)
+        self.behind_gateway = set(behind_gateway)
+        self.slave_requests = {}
+
+    def read_holding_registers(self, address, count, slave=None):
+        self.slave_requests[slave] = self.slave_requests.get(slave, 0) + 1
+        if slave in self.offline:
+            if slave in self.behind_gateway:
+                # gateway target device failed to respond
+                return ExceptionResponse(3, 0x0B)
+            return ModbusIOException("No response received")
+        if address in self.refused:
+            return ExceptionResponse(3, 2)
+        return self._read_registers(address, count, slave)
+
+
+def test_modbus_task_autoremove_quarantine():
+    config = [
+        ["device", "dev01", "1", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "500", "1", "BE_BE"],
+        ["ref", "missing", "500", "uint16", "r"],
+        ["device", "dev02", "2", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "10", "1", "BE_BE"],
+        ["ref", "energy", "10", "uint16", "r"],
+    ]
+    master = FlakyMaster({0: 1, 10: 2}, offline=[2], refused=[500])
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        interval=0,
+        daemon=True,
+        autoremove=True,
+        quarantine_threshold=3,
+        quarantine_delay=0.05,
+        timeout_budget=0,
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    dev01, dev02 = modbus_handler.deviceList
+
+    modbus_handler.poll()
+    assert master.slave_requests[2] == 2
+    time.sleep(0.015)
+    modbus_handler.poll()
+    # the third timeout in a row quarantines the device, skipping its next poller
+    assert master.slave_requests[2] == 3
+    assert dev02.quarantine.active
+
+    time.sleep(0.015)
+    modbus_handler.poll()
+    assert master.slave_requests[2] == 3
+    # the poller refused three times by the device is removed for good
+    assert dev01.pollerList[1].disabled
+    assert not dev01.quarantine.active
+    assert modbus_handler.next_poll_time() <= time.monotonic() + 0.01
+
+    # a failed probe doubles the backoff
+    time.sleep(0.05)
+    modbus_handler.poll()
+    assert master.slave_requests[2] == 4
+    assert dev02.quarantine.backoff == pytest.approx(0.1)
+
+    master.offline.clear()
+    time.sleep(0.1)
+    modbus_handler.poll()
+    # probe plus the polls of both pollers
+    assert master.slave_requests[2] == 7
+    assert not dev02.quarantine.active
+    assert dev02.references["energy"].val == 2
+
+
+def test_modbus_task_gateway_exceptions_are_timeouts():
+    config = [
+        ["device", "dev01", "1", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+    ]
+    master = FlakyMaster({0: 1}, offline=[1], behind_gateway=[1])
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        interval=0,
+        daemon=True,
+        autoremove=True,
+        quarantine_threshold=3,
+        quarantine_delay=0.02,
+        timeout_budget=0,
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    dev01 = modbus_handler.deviceList[0]
+    poller = dev01.pollerList[0]
+    for _ in range(3):
+        modbus_handler.poll()
+        time.sleep(0.015)
+    # the meter behind the gateway is quarantined, not removed
+    assert poller.timeoutCount == 3 and poller.exceptionCount == 0
+    assert dev01.quarantine.active
+    assert not poller.disabled
+    assert not poller.probe(master)
+
+    master.offline.clear()
+    time.sleep(0.05)
+    modbus_handler.poll()
+    assert not dev01.quarantine.active
+    assert dev01.references["power"].val == 1
+
+    # timeouts and exception responses are counted apart
+    master.offline.add(1)
+    for _ in range(2):
+        time.sleep(0.015)
+        modbus_handler.poll()
+    master.offline.clear()
+    master.refused.add(0)
+    time.sleep(0.015)
+    modbus_handler.poll()
+    assert poller.failcounter == 3
+    assert poller.exceptionFailures == 1
+    assert not poller.disabled
+
+
+class FakeCommParams:
+    timeout_connect = 3.0
+
+
+class FakeSerialPort:
+    timeout = 3.0
+
+
+@pytest.mark.parametrize("port", ["serial", "udp"])
+def test_modbus_task_skip_unresponsive_device(port):
+    config = [
+        ["device", "dev01", "1", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "10", "1", "BE_BE"],
+        ["ref", "energy", "10", "uint16", "r"],
+        ["poll", "holding_register", "20", "1", "BE_BE"],
+        ["ref", "voltage", "20", "uint16", "r"],
+        ["device", "dev02", "2", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+    ]
+    master = FlakyMaster({0: 1}, offline=[1])
+    master.comm_params = FakeCommParams()
+    if port == "udp":
+        master.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        master.socket.settimeout(3.0)
+        get_port_timeout = master.socket.gettimeout
+    else:
+        master.socket = FakeSerialPort()
+        get_port_timeout = lambda: master.socket.timeout  # noqa: E731
+    timeouts = []
+    read_registers = master.read_holding_registers
+
+    def read_holding_registers(address, count, slave=None):
+        timeouts.append((master.comm_params.timeout_connect, get_port_timeout()))
+        return read_registers(address, count, slave)
+
+    master.read_holding_registers = read_holding_registers
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        interval=0,
+        daemon=True,
+        timeout_budget=1,
+        liveness_timeout=0.5,
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    dev01, dev02 = modbus_handler.deviceList
+
+    modbus_handler.poll()
+    # the first time-out uses up the budget of dev01, dev02 is still polled
+    assert master.slave_requests == {1: 1, 2: 1}
+    assert dev01.budgetSkipCount == 2
+    assert dev02.pollSuccess
+
+    time.sleep(0.015)
+    modbus_handler.poll()
+    # dev01 failed its last poll, so it is probed with the liveness timeout first
+    assert master.slave_requests == {1: 2, 2: 2}
+    assert timeouts == [(3.0, 3.0)] * 2 + [(0.5, 0.5), (3.0, 3.0)]
+    assert dev01.budgetSkipCount == 5
+    assert master.comm_params.timeout_connect == 3.0
+    assert get_port_timeout() == 3.0
+
+    master.offline.clear()
+    time.sleep(0.015)
+    modbus_handler.poll()
+    assert master.slave_requests == {1: 6, 2: 3}
+    assert dev01.pollSuccess
+    assert dev01.budgetSkipCount == 5
+    if port == "udp":
+        master.socket.close()
+
+
+def test_modbus_task_skip_device_failing_probe_without_budget():
+    config = [
+        ["device", "dev01", "1", "0.01"],
+        ["poll", "holding_register", "0", "1", "BE_BE"],
+        ["ref", "power", "0", "uint16", "r"],
+        ["poll", "holding_register", "10", "1", "BE_BE"],
+        ["ref", "energy", "10", "uint16", "r"],
+    ]
+    master = FlakyMaster({0: 1}, offline=[1])
+    master.comm_params = FakeCommParams()
+    modbus_handler = ModbusHandler(
+        master, "test.csv", interval=0, daemon=True, liveness_timeout=0.5
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+    dev01 = modbus_handler.deviceList[0]
+
+    modbus_handler.poll()
+    # without a timeout budget every poller is read
+    assert master.slave_requests == {1: 2}
+    assert dev01.budgetSkipCount == 0
+
+    time.sleep(0.015)
+    modbus_handler.poll()
+    # the failed probe skips all pollers of the device
+    assert master.slave_requests == {1: 3}
+    assert dev01.budgetSkipCount == 2
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    stats = histogram.get_stats()
+    assert stats["count"] == 4
+    assert stats["sum"] == pytest.approx(2.65)
+    assert stats["buckets"] == {"0.1": 2, "1": 3, "+Inf": 4}
+
+
+def test_modbus_task_adaptive_pacing():
+    pacer = RequestPacer(max_interval=0.5, min_interval=0.004)
+    assert pacer.interval == 0.5
+    for _ in range(10):
+        pacer.record(0.02)
+    assert pacer.interval == 0.004
+    pacer.record(0.02, "exception")
+    assert pacer.interval == 0.004
+    for _ in range(3):
+        pacer.record(3.0, "timeout")
+    assert pacer.interval == 0.5
+    stats = pacer.get_stats()
+    assert stats["request_interval"] == 0.5
+    assert pacer.timeoutCount == 3
+
+
+@pytest.mark.parametrize("endian", ["BE_BE", "LE_BE", "LE_LE", "BE_LE"])
+def test_modbus_task_decode_plan_matches_payload_decoder(endian):
+    byteorder = Endian.LITTLE if endian.startswith("LE") else Endian.BIG
+    wordorder = Endian.BIG if endian in ("BE_BE", "LE_BE") else Endian.LITTLE
+    registers = [0x4142, 0x4344, 0x8001, 0xFFFE, 0x3F9D, 0x70A4, 0x1234, 0x5678]
+    registers += [0x9ABC, 0xDEF0, 0xC0DE, 0x0102, 0x0304, 0x0506, 0x0708, 0xA55A]
+    dtypes = [
+        ("uint16", 1, lambda d: d.decode_16bit_uint()),
+        ("int16", 1, lambda d: d.decode_16bit_int()),
+        ("float16", 1, lambda d: d.decode_16bit_float()),
+        ("uint32", 2, lambda d: d.decode_32bit_uint()),
+        ("int32", 2, lambda d: d.decode_32bit_int()),
+        ("float32", 2, lambda d: d.decode_32bit_float()),
+        ("uint64", 4, lambda d: d.decode_64bit_uint()),
+        ("int64", 4, lambda d: d.decode_64bit_int()),
+        ("float64", 4, lambda d: d.decode_64bit_float()),
+        ("bool16", 1, lambda d: d.decode_bits() + d.decode_bits()),
+        ("string4", 2, lambda d: d.decode_string(4).decode("utf-8")),
+    ]
+    device = Device("dev01", 1)
+    for address in range(len(registers) - 3):
+        for dtype, width, decode in dtypes:
+            poller = Poller(device, 3, 0, len(registers), endian)
+            ref = Reference(device, "ref", address, dtype, "r", None, None)
+            poller.add_readable_reference(ref)
+            poller.decode(registers)
+
+            decoder = BinaryPayloadDecoder.fromRegisters(
+                registers, byteorder=byteorder, wordorder=wordorder
+            )
+            decoder.skip_bytes(address * 2)
+            try:
+                expected = decode(decoder)
+            except UnicodeDecodeError:
+                expected = None
+            if isinstance(expected, float) and math.isnan(expected):
+                assert math.isnan(ref.val)
+            else:
+                assert ref.val == expected, (dtype, address)
+
+
+def test_modbus_task_decode_plan_coils_and_scale():
+    device = Device("dev01", 1)
+    poller = Poller(device, 1, 0, 16, "BE_BE")
+    bits = [True, False, True, True, False, False, False, True] + [False] * 7 + [True]
+    coils = Reference(device, "coils", 1, "bool8", "r", None, None)
+    poller.add_readable_reference(coils)
+    poller.decode(bits)
+    decoder = BinaryPayloadDecoder.fromCoils(bits, byteorder=Endian.BIG)
+    decoder.skip_bytes(1)
+    assert coils.val == decoder.decode_bits()
+
+    poller = Poller(device, 4, 10, 2, "BE_BE")
+    scaled = Reference(device, "scaled", 10, "int32", "r", "kWh", 0.5)
+    poller.add_readable_reference(scaled)
+    poller.decode([0xFFFF, 0xFFFC])
+    assert scaled.val == -2.0
+    poller.decode([0, 10])
+    assert (scaled.last_val, scaled.val) == (-2.0, 5.0)
+
+
+@pytest.mark.parametrize("endian", ["LE_BE", "LE_LE"])
+def test_modbus_task_decode_plan_little_endian_coils(endian):
+    numpy = pytest.importorskip("numpy")
+    bits = [(i * 7919 + 13) % 3 == 0 for i in range(64)]
+    dtypes = [
+        ("uint16", lambda d: d.decode_16bit_uint()),
+        ("int32", lambda d: d.decode_32bit_int()),
+        ("float32", lambda d: d.decode_32bit_float()),
+        ("uint64", lambda d: d.decode_64bit_uint()),
+    ]
+    device = Device("dev01", 1)
+    for offset in range(5):
+        for dtype, decode in dtypes:
+            decoder = BinaryPayloadDecoder.fromCoils(bits, byteorder=Endian.LITTLE)
+            decoder.skip_bytes(offset)
+            try:
+                expected = decode(decoder)
+            except struct.error:
+                continue
+            for np_module in (None, numpy):
+                poller = Poller(device, 1, 0, len(bits), endian)
+                ref = Reference(device, "ref", offset, dtype, "r", None, None)
+                poller.add_readable_reference(ref)
+                poller.compile_decode_plan(np_module)
+                poller.decode(bits)
+                assert repr(ref.val) == repr(expected), (dtype, offset, np_module)
+
+    # a short read fails instead of decoding padding
+    poller = Poller(device, 1, 0, len(bits), endian)
+    ref = Reference(device, "ref", 1, "uint32", "r", None, None)
+    poller.add_readable_reference(ref)
+    poller.decode(bits[:24])
+    assert ref.val is None
+    assert poller.decodeErrorCount == 1
+
+
+@pytest.mark.parametrize("endian", ["BE_BE", "LE_BE", "LE_LE", "BE_LE"])
+def test_modbus_task_numpy_decoder_matches_struct(endian):
+    numpy = pytest.importorskip("numpy")
+    registers = [(i * 7919 + 13) & 0xFFFF for i in range(123)]
+    refs = {}
+    pollers = []
+    for np_module in (None, numpy):
+        device = Device("dev01", 1)
+        poller = Poller(device, 3, 100, len(registers), endian)
+        address = 100
+        for i, dtype in enumerate(list(STRUCT_FORMATS) * 4 + ["bool16", "string6"]):
+            scale = [None, 0.1, 1000][i % 3]
+            ref = Reference(device, f"ref{i}", address, dtype, "r", None, scale)
+            if not ref.check_sanity(poller.start_address, poller.size):
+                break
+            poller.add_readable_reference(ref)
+            address += ref.ref_width
+        poller.compile_decode_plan(np_module)
+        poller.decode(registers)
+        refs[np_module] = [(r.name, r.val) for r in poller.readableReferences]
+        pollers.append(poller)
+    assert pollers[0].vectorPlan is None
+    assert pollers[1].vectorPlan
+    assert repr(refs[numpy]) == repr(refs[None])
+    # a short response is decoded reference by reference
+    for poller in pollers:
+        poller.decode(registers[:10])
+    assert pollers[0].decodeErrorCount == pollers[1].decodeErrorCount > 0
+    assert repr([r.val for r in pollers[1].readableReferences[:5]]) == repr(
+        [value for _, value in refs[None][:5]]
+    )
+
+
+class FakeMqttHandler:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, msg, qos=None, retain=False):
+        self.messages.append((topic, msg))
+
+
+class RecordingMaster(FakeMaster):
+    """Record the read and write requests in the order they were sent."""
+
+    def __init__(self, registers, bits):
+        super().__init__(registers, bits)
+        self.log = []
+        self.on_read = None
+
+    def read_holding_registers(self, address, count, slave=None):
+        self.log.append(("read", address))
+        if self.on_read:
+            self.on_read()
+        return self._read_registers(address, count, slave)
+
+    def write_register(self, address, value, slave=None):
+        self.log.append(("write", address, value))
+        return FakeResponse()
+
+    def write_coil(self, address, value, slave=None):
+        self.log.append(("write", address, value))
+        return FakeResponse()
+
+    def write_registers(self, address, values, slave=None):
+        self.log.append(("write", address, values))
+        for i, value in enumerate(values):
+            self.registers[address + i] = value
+        return FakeResponse()
+
+    def write_coils(self, address, values, slave=None):
+        self.log.append(("write", address, values))
+        for i, value in enumerate(values):
+            self.bits[address + i] = value
+        return FakeResponse()
+
+
+def test_modbus_task_writes_preempt_poll_cycle():
+    config = [["device", "dev01", "1"]]
+    for address in (0, 10, 20):
+        config.append(["poll", "holding_register", str(address), "1", "BE_BE"])
+        config.append(["ref", f"reg{address}", str(address), "uint16", "rw"])
+    master = RecordingMaster({}, {})
+    mqtt_handler = FakeMqttHandler()
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        mqtt_handler,
+        interval=0,
+        daemon=True,
+        mqtt_ack_topic_pattern="modpoll/{{device_name}}/ack",
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    modbus_handler._build_schedule()
+
+    def submit_writes():
+        master.on_read = None
+        assert modbus_handler.submit_write("dev01", "holding_register", 5, 1)
+        assert modbus_handler.submit_write(
+            "dev01", "coil", 3, True, priority=-1, request_id="sp1"
+        )
+
+    master.on_read = submit_writes
+    modbus_handler.poll()
+    # the writes are sent after the current request, the urgent one first
+    assert master.log == [
+        ("read", 0),
+        ("write", 3, True),
+        ("write", 5, 1),
+        ("read", 10),
+        ("read", 20),
+    ]
+    acks = [json.loads(msg) for topic, msg in mqtt_handler.messages]
+    assert [topic for topic, msg in mqtt_handler.messages] == ["modpoll/dev01/ack"] * 2
+    assert acks[0]["id"] == "sp1"
+    assert acks[0]["success"] and acks[1]["success"]
+    assert 0 <= acks[0]["latency"] < 1.0
+    assert modbus_handler.writeCount == 2
+
+    assert not modbus_handler.submit_write("dev02", "coil", 3, True)
+    assert not modbus_handler.submit_write("dev01", "input_register", 3, 1)
+    assert modbus_handler.process_writes() == 0
+
+
+def test_modbus_task_invalid_writes_are_rejected():
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "2", "BE_BE"],
+        ["ref", "mode", "0", "uint16", "rw"],
+    ]
+    master = RecordingMaster({}, {})
+    mqtt_handler = FakeMqttHandler()
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        mqtt_handler,
+        mqtt_ack_topic_pattern="modpoll/{{device_name}}/ack",
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    assert not modbus_handler.submit_write(
+        "dev01", "holding_register", 0, 1, priority="high"
+    )
+    assert not modbus_handler.submit_write("dev01", "holding_register", 0, "abc")
+    assert not modbus_handler.submit_write("dev01", "holding_register", 0, [])
+    assert not modbus_handler.submit_write("dev01", "holding_register", 0, 70000)
+    assert not modbus_handler.submit_write("dev01", "coil", "0", True)
+    assert not modbus_handler.submit_reference_write("dev01", [1])
+    assert not modbus_handler.submit_reference_write(
+        "dev01", {"mode": 1}, priority=None
+    )
+    assert modbus_handler.process_writes() == 0
+
+    # a block failing unexpectedly only fails its own request
+    def write_register(address, value, slave=None):
+        if address == 5:
+            raise RuntimeError("unexpected")
+        master.log.append(("write", address, value))
+        return FakeResponse()
+
+    master.write_register = write_register
+    assert modbus_handler.submit_write("dev01", "holding_register", 5, 1, -1, "bad")
+    assert modbus_handler.submit_write("dev01", "holding_register", 9, 2, 0, "good")
+    assert modbus_handler.process_writes() == 2
+    assert master.log == [("write", 9, 2)]
+    acks = {json.loads(msg)["id"]: json.loads(msg) for _, msg in mqtt_handler.messages}
+    assert not acks["bad"]["success"]
+    assert acks["good"]["success"]
+
+
+@pytest.mark.parametrize("endian", ["BE_BE", "LE_BE", "LE_LE", "BE_LE"])
+def test_modbus_task_encode_matches_decode(endian):
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "20", endian],
+        ["ref", "u16", "0", "uint16", "rw"],
+        ["ref", "i32", "1", "int32", "rw"],
+        ["ref", "f32", "3", "float32", "rw", "", "0.1"],
+        ["ref", "f64", "5", "float64", "rw"],
+        ["ref", "i64", "9", "int64", "rw"],
+        ["ref", "name", "13", "string6", "rw"],
+        ["poll", "coil", "8", "16", endian],
+        ["ref", "flags", "8", "bool16", "rw"],
+    ]
+    values = {
+        "u16": 65000,
+        "i32": -123456,
+        "f32": 21.5,
+        "f64": 3.14159,
+        "i64": -(2**40),
+        "name": "pump",
+        "flags": [True, False, True, True] + [False] * 11 + [True],
+    }
+    modbus_handler = ModbusHandler(None, "test.csv")
+    dev = modbus_handler._parse_config(config)[0]
+    master = FakeMaster({}, {})
+    for ref_name, value in values.items():
+        ref = dev.references[ref_name]
+        address, data = ref.poller.encode(ref, value)
+        target = master.bits if ref.poller.fc == 1 else master.registers
+        for i, item in enumerate(data):
+            target[address + i] = item
+    for p in dev.pollerList:
+        assert p.poll(master)
+    decoded = {name: ref.val for name, ref in dev.references.items()}
+    assert decoded["f32"] == pytest.approx(21.5)
+    decoded["f32"] = 21.5
+    assert decoded == values
+
+
+def test_modbus_task_merge_reference_writes():
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "10", "BE_BE"],
+        ["ref", "setpoint", "0", "float32", "rw"],
+        ["ref", "mode", "2", "uint16", "rw"],
+        ["ref", "limit", "3", "uint16", "rw"],
+        ["ref", "status", "8", "uint16", "r"],
+        ["poll", "coil", "16", "8", "BE_BE"],
+        ["ref", "enable", "16", "bool", "w"],
+    ]
+    master = RecordingMaster({}, {})
+    mqtt_handler = FakeMqttHandler()
+    modbus_handler = ModbusHandler(
+        master,
+        "test.csv",
+        mqtt_handler,
+        mqtt_ack_topic_pattern="modpoll/{{device_name}}/ack",
+        write_window=60,
+    )
+    modbus_handler.connect = lambda: True
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+
+    assert modbus_handler.submit_reference_write(
+        "dev01", {"setpoint": 1.5, "mode": 1}, request_id="a"
+    )
+    assert modbus_handler.submit_reference_write(
+        "dev01", {"mode": 2, "limit": 7, "enable": True}, request_id="b"
+    )
+    assert not modbus_handler.submit_reference_write("dev01", {"status": 1})
+    assert not modbus_handler.submit_reference_write("dev01", {"mode": "high"})
+    # the writes are held back within the window
+    assert modbus_handler.process_writes() == 0
+    assert master.log == []
+
+    modbus_handler.write_window = 0
+    assert modbus_handler.process_writes() == 2
+    # one FC16 request for the adjacent registers, with the latest mode
+    assert master.log == [
+        ("write", 0, [0x3FC0, 0x0000, 2, 7]),
+        ("write", 16, True),
+    ]
+    acks = {json.loads(msg)["id"]: json.loads(msg) for _, msg in mqtt_handler.messages}
+    assert acks["a"]["success"] and acks["a"]["values"] == {"setpoint": 1.5, "mode": 1}
+    assert acks["b"]["success"]
+
+
+def test_device_registry():
+    handlers = []
+    for names in (["dev01", "dev02"], ["dev03", "dev01"]):
+        modbus_handler = ModbusHandler(None, "test.csv")
+        config = []
+        for name in names:
+            config.append(["device", name, "1"])
+            config.append(["poll", "holding_register", "0", "2", "BE_BE"])
+            config.append(["ref", f"{name}_power", "0", "uint16", "rw"])
+        modbus_handler.deviceList = modbus_handler._parse_config(config)
+        handlers.append(modbus_handler)
+    assert handlers[1].get_device("dev03") is handlers[1].deviceList[0]
+
+    registry = DeviceRegistry(handlers, "site/+/set")
+    assert registry.match_topic("site/dev03/set") == "dev03"
+    assert registry.match_topic("site/dev03/set/extra") is None
+    assert registry.match_topic("other/dev03/set") is None
+    modbus_handler, dev = registry.get_device("dev03")
+    assert modbus_handler is handlers[1] and dev.name == "dev03"
+    # the first config defining a device wins
+    assert registry.get_device("dev01")[0] is handlers[0]
+    assert registry.get_device("dev04") is None
+    assert registry.get_reference("dev02", "dev02_power").address == 0
+    assert registry.get_reference("dev02", "dev01_power") is None
+
+    assert (
+        DeviceRegistry(handlers, "modpoll/#/set").match_topic("modpoll/dev01/set")
+        == "dev01"
+    )
+
+
+RELOAD_CONFIG = """device,dev01,1
+poll,holding_register,0,2,BE_BE
+ref,power,0,uint16,r
+ref,energy,1,uint16,r
+poll,holding_register,10,2,BE_BE
+ref,voltage,10,uint16,r
+ref,setpoint,11,uint16,w
+device,dev02,2
+poll,holding_register,0,1,BE_BE
+ref,power,0,uint16,r
+"""
+
+
+def _write_config(path, text):
+    path.write_text(text)
+    # make sure the modification is seen on filesystems with coarse timestamps
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_modbus_task_reload_config(tmp_path):
+    file = tmp_path / "config.csv"
+    _write_config(file, RELOAD_CONFIG)
+    master = FakeMaster({0: 1, 1: 2, 10: 3}, {})
+    modbus_handler = ModbusHandler(master, str(file), interval=0, daemon=True)
+    modbus_handler.connect = lambda: True
+    assert modbus_handler.load_config()
+    modbus_handler.poll()
+    dev01, dev02 = modbus_handler.deviceList
+    first, second = dev01.pollerList
+    assert modbus_handler.check_config() is None
+
+    # change the reference of the second poller, remove dev02 and add dev03
+    text = RELOAD_CONFIG.replace("ref,voltage,10,uint16,r", "ref,voltage,10,int16,r")
+    text = text.replace("device,dev02,2", "device,dev03,3")
+    _write_config(file, text)
+    config, devices = modbus_handler.check_config()
+    assert modbus_handler.deviceList[0] is dev01
+    assert modbus_handler.apply_config(config, devices)
+
+    assert [dev.name for dev in modbus_handler.deviceList] == ["dev01", "dev03"]
+    assert modbus_handler.deviceList[0] is dev01
+    assert dev01.pollCount == 2
+    # the unchanged poller is kept with its statistics, values and deadline
+    assert dev01.pollerList[0] is first
+    assert first.latency.get_stats()["count"] == 1
+    assert dev01.references["power"].val == 1
+    assert dev01.pollerList[1] is not second
+    assert dev01.pollerList[1].device is dev01
+    assert dev01.references["voltage"].dtype == "int16"
+    assert dev01.references["setpoint"].poller is dev01.pollerList[1]
+    assert modbus_handler.get_device("dev02") is None
+    assert modbus_handler.get_device("dev03").pollerList[0].device.name == "dev03"
+    due = [p for _, _, p in modbus_handler._pop_due_pollers(time.monotonic())]
+    assert first not in due
+    assert dev01.pollerList[1] in due
+    assert modbus_handler.check_config() is None
+
+
+def test_config_reloader(tmp_path):
+    file = tmp_path / "config.csv"
+    _write_config(file, RELOAD_CONFIG)
+    modbus_handler = ModbusHandler(None, str(file))
+    assert modbus_handler.load_config()
+    reloader = ConfigReloader([modbus_handler])
+    assert reloader.next_check_time() is None
+    assert not reloader.check()
+
+    _write_config(file, RELOAD_CONFIG.replace("device,dev02,2", "device,dev03,3"))
+    reloader.request()
+    assert reloader.next_check_time() <= time.monotonic()
+    assert not reloader.check()
+    reloader._thread.join()
+    assert reloader.check()
+    assert modbus_handler.get_device("dev03") is not None
+    assert reloader.next_check_time() is None
+
+
+def test_parse_transport():
+    transport = parse_transport("rtu:///dev/ttyUSB1?baudrate=19200&parity=even")
+    assert (transport.kind, transport.address) == ("rtu", "/dev/ttyUSB1")
+    assert (transport.baudrate, transport.parity) == (19200, "even")
+    assert transport.key == "rtu:///dev/ttyUSB1"
+    assert str(transport) == "rtu:///dev/ttyUSB1?baudrate=19200&parity=even"
+    assert parse_transport("rtu://COM3").key == "rtu://COM3"
+    assert parse_transport("tcp://10.0.0.5").key == "tcp://10.0.0.5:502"
+    assert parse_transport("udp://10.0.0.5:1502").port == 1502
+    for spec in (
+        "ftp://host",
+        "tcp://",
+        "tcp://host:port",
+        "rtu://",
+        "rtu://COM3?baud=9600",
+    ):
+        with pytest.raises(ValueError):
+            parse_transport(spec)
+
+
+BUS_CONFIG = """device,dev01,1,,rtu:///dev/ttyUSB1?baudrate=19200
+poll,holding_register,0,1,BE_BE
+ref,power,0,uint16,r
+device,dev02,2
+poll,holding_register,0,1,BE_BE
+ref,power,0,uint16,r
+device,dev03,3,,tcp://127.0.0.1:1502
+poll,holding_register,0,1,BE_BE
+ref,power,0,uint16,r
+device,dev04,4,,serial://COM1
+poll,holding_register,0,1,BE_BE
+ref,power,0,uint16,r
+"""
+
+
+def test_modbus_task_setup_per_bus(tmp_path, caplog):
+    first = tmp_path / "first.csv"
+    first.write_text(BUS_CONFIG)
+    second = tmp_path / "second.csv"
+    second.write_text(
+        "device,dev05,5,,rtu:///dev/ttyUSB1\n"
+        "poll,holding_register,0,1,BE_BE\n"
+        "device,dev06,6,,rtu:///dev/ttyUSB2?baudrate=9600&parity=even\n"
+        "poll,holding_register,0,1,BE_BE\n"
+    )
+    transports = get_config_transports(list(csv.reader(BUS_CONFIG.splitlines())))
+    assert [str(t) if t else None for t in transports] == [
+        "rtu:///dev/ttyUSB1?baudrate=19200",
+        None,
+        "tcp://127.0.0.1:1502",
+    ]
+    args = get_parser().parse_args(
+        [
+            "--config",
+            str(first),
+            str(second),
+            "--tcp",
+            "127.0.0.1",
+            "--adaptive-interval",
+        ]
+    )
+    modbus_handlers = setup_modbus_handlers(args)
+    devices = {dev.name: h for h in modbus_handlers for dev in h.get_device_list()}
+    # the device with an invalid transport is skipped
+    assert sorted(devices) == ["dev01", "dev02", "dev03", "dev05", "dev06"]
+    assert len(modbus_handlers) == 5
+    # one client per physical bus, shared by the configs on it
+    assert len(group_by_client(modbus_handlers)) == 4
+    usb1 = devices["dev01"]
+    assert devices["dev05"].modbus_client is usb1.modbus_client
+    assert devices["dev05"].pacer is usb1.pacer
+    assert devices["dev05"].write_queue is usb1.write_queue
+    assert devices["dev02"].modbus_client.comm_params.port == 502
+    assert devices["dev03"].modbus_client.comm_params.port == 1502
+    # the inter-frame gap follows the baud rate of each bus
+    assert usb1.pacer.min_interval == pytest.approx(3.5 * 11 / 19200)
+    usb2 = devices["dev06"]
+    assert usb2.pacer.min_interval == pytest.approx(3.5 * 11 / 9600)
+    assert usb2.modbus_client.comm_params.parity == "E"
+    assert usb2.bus == "rtu:///dev/ttyUSB2"
+    # each config is parsed once, whatever the number of its buses
+    assert caplog.text.count("Invalid transport for dev04") == 1
+
+    # a worker only sets up the buses of its shard
+    shard = {str(first): [None, "tcp://127.0.0.1:1502"]}
+    shard_handlers = setup_modbus_handlers(args, buses=shard)
+    assert sorted(dev.name for h in shard_handlers for dev in h.get_device_list()) == [
+        "dev02",
+        "dev03",
+    ]
+
+    first_handlers = [h for h in modbus_handlers if h.config_file == str(first)]
+    config_loader = first_handlers[0].config_loader
+    loads = []
+    load = config_loader.load
+    config_loader.load = lambda location: loads.append(location) or load(location)
+    caplog.clear()
+    _write_config(first, BUS_CONFIG.replace("device,dev02,2", "device,dev07,7"))
+    reloader = ConfigReloader(modbus_handlers)
+    reloader.request()
+    assert not reloader.check()
+    reloader._thread.join()
+    assert reloader.check()
+    assert sorted(loads) == sorted([str(first), str(second)])
+    assert caplog.text.count("Invalid transport for dev04") == 1
+    assert devices["dev02"].get_device("dev07") is not None
+    assert usb1.get_device("dev01") is not None
+
+
+def test_modbus_task_publish_on_change_with_deadband():
+    config = [
+        ["device", "dev01", "1"],
+        ["poll", "holding_register", "0", "3", "BE_BE"],
+        ["ref", "voltage", "0", "uint16", "r", "V", "0.1", "1"],
+        ["ref", "power", "1", "uint16", "r", "W", "", "5%"],
+        ["ref", "state", "2", "uint16", "r"],
+    ]
+    mqtt_handler = FakeMqttHandler()
+    modbus_handler = ModbusHandler(
+        None,
+        "test.csv",
+        mqtt_handler,
+        mqtt_publish_topic_pattern="modpoll/{{device_name}}/data",
+        on_change=True,
+        heartbeat=0.2,
+    )
+    modbus_handler.deviceList = modbus_handler._parse_config(config)
+    dev = modbus_handler.deviceList[0]
+    poller = dev.pollerList[0]
+
+    def publish(registers):
+        dev.pollSuccess = True
+        poller.decode(registers)
+        mqtt_handler.messages.clear()
+        modbus_handler.publish_data()
+        return json.loads(mqtt_handler.messages[0][1]) if mqtt_handler.messages else {}
+
+    assert publish([2300, 1000, 1]) == {"voltage|V": 230.0, "power|W": 1000, "state": 1}
+    assert publish([2305, 1040, 1]) == {}
+    assert publish([2311, 1051, 2]) == {"voltage|V": 231.1, "power|W": 1051, "state": 2}
+    time.sleep(0.2)
+    assert len(publish([2311, 1051, 2])) == 3
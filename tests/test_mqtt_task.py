@@ -1,6 +1,8 @@
 import pytest
 import time
-from modpoll.mqtt_task import MqttHandler
+from types import SimpleNamespace
+
+from modpoll.mqtt_task import MqttHandler, OfflineBuffer, PublishQueue
 
 
 def test_mqtt_task_setup():
@@ -49,3 +51,145 @@ def test_mqtt_task_connect():
 
     # Clean up
     mqtt_handler.close()
+
+
+class FakeMqttHandler:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, msg, qos=None, retain=False):
+        self.messages.append((topic, msg))
+
+    def get_inflight_count(self):
+        return 0
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        ("drop_oldest", [("a", 2), ("b", 3), ("a", 4)]),
+        ("coalesce", [("a", 0), ("b", 3), ("a", 4)]),
+    ],
+)
+def test_mqtt_task_publish_queue_policy(policy, expected):
+    mqtt_handler = FakeMqttHandler()
+    publisher = PublishQueue(mqtt_handler, maxsize=3, policy=policy, batch_size=2)
+    for i, topic in enumerate(["a", "b", "a", "b", "a"]):
+        publisher.publish(topic, i)
+    publisher.start()
+    assert publisher.flush(timeout=1)
+    assert mqtt_handler.messages == expected
+    stats = publisher.get_stats()
+    assert stats["queue_depth"] == 0
+    assert stats["published"] == len(expected)
+    publisher.close()
+
+
+def test_mqtt_task_publish_queue_coalesce_only_when_full():
+    mqtt_handler = FakeMqttHandler()
+    publisher = PublishQueue(mqtt_handler, maxsize=10, policy="coalesce")
+    for i, topic in enumerate(["a", "b", "a"]):
+        publisher.publish(topic, i)
+    publisher.start()
+    assert publisher.flush(timeout=1)
+    assert mqtt_handler.messages == [("a", 0), ("b", 1), ("a", 2)]
+    publisher.close()
+
+
+def test_mqtt_task_publish_queue_does_not_block_producer():
+    class SlowMqttHandler(FakeMqttHandler):
+        def publish(self, topic, msg, qos=None, retain=False):
+            time.sleep(0.05)
+            super().publish(topic, msg, qos, retain)
+
+    mqtt_handler = SlowMqttHandler()
+    publisher = PublishQueue(mqtt_handler, maxsize=10)
+    publisher.start()
+    start = time.monotonic()
+    for i in range(100):
+        publisher.publish("topic", i)
+    assert time.monotonic() - start < 0.05
+    publisher.close(timeout=2)
+    assert publisher.dropCount >= 80
+    assert mqtt_handler.messages[-1] == ("topic", 99)
+
+
+def test_mqtt_message_wakes_main_loop():
+    import threading
+    from modpoll.utils import wait_thread
+
+    mqtt_handler = MqttHandler(
+        name="test_mqtt",
+        host="localhost",
+        port=1883,
+        user=None,
+        password=None,
+        clientid="test_client",
+        qos=0,
+    )
+    message = SimpleNamespace(topic="modpoll/dev/set", payload=b"{}", retain=0)
+    # clear a wake-up left over from other tests
+    wait_thread(0)
+    threading.Timer(0.05, mqtt_handler._on_message, (None, None, message)).start()
+
+    start = time.monotonic()
+    assert wait_thread(5.0)
+    assert time.monotonic() - start < 1.0
+    assert mqtt_handler.receive() == ("modpoll/dev/set", b"{}")
+    assert mqtt_handler.receive() == (None, None)
+
+
+class OfflineMqttHandler(FakeMqttHandler):
+    def __init__(self):
+        super().__init__()
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def publish(self, topic, msg, qos=None, retain=False):
+        if not self.connected:
+            return None
+        super().publish(topic, msg, qos, retain)
+        return SimpleNamespace(rc=0)
+
+
+def test_mqtt_task_store_and_forward(tmp_path):
+    path = str(tmp_path / "buffer.db")
+    mqtt_handler = OfflineMqttHandler()
+    publisher = PublishQueue(
+        mqtt_handler, buffer=OfflineBuffer(path, maxsize=4), replay_rate=100
+    )
+    publisher.start()
+    for i in range(6):
+        publisher.publish("a", i)
+    assert publisher.flush(timeout=2.0)
+    stats = publisher.get_stats()
+    # the oldest messages are dropped once the buffer is full
+    assert stats["buffered"] == 4
+    assert stats["buffer_fill"] == 1.0
+    assert stats["buffer_dropped"] == 2
+    assert mqtt_handler.messages == []
+
+    mqtt_handler.connected = True
+    deadline = time.monotonic() + 5.0
+    while publisher.get_stats()["buffered"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mqtt_handler.messages == [("a", 2), ("a", 3), ("a", 4), ("a", 5)]
+    assert publisher.get_stats()["replayed"] == 4
+    publisher.close()
+
+
+def test_mqtt_task_offline_buffer_persists(tmp_path):
+    path = str(tmp_path / "buffer.db")
+    buffer = OfflineBuffer(path)
+    buffer.store([("a", "1", 0, False), ("b", "2", 1, True)])
+    buffer.close()
+
+    buffer = OfflineBuffer(path)
+    assert len(buffer) == 2
+    rows = buffer.peek(10)
+    assert [row[1:] for row in rows] == [("a", "1", 0, 0), ("b", "2", 1, 1)]
+    buffer.remove(rows[0][0], 1)
+    assert len(buffer) == 1
+    buffer.close()
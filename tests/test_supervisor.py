@@ -0,0 +1,185 @@
+import os
+import queue
+from argparse import Namespace
+
+from modpoll.modbus_task import DeviceRegistry, ModbusHandler
+from modpoll.supervisor import (
+    Supervisor,
+    WorkerChannel,
+    _receive_requests,
+    shard_configs,
+)
+
+
+class FakePublisher:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, msg, qos=None, retain=False):
+        self.messages.append((topic, msg))
+
+
+def crash_once_worker(args, worker_id, shard, results, requests):
+    """Crash on the first start, publish and finish on the second one."""
+    marker = next(iter(shard))
+    restarted = os.path.exists(marker)
+    if not restarted:
+        open(marker, "w").close()
+    channel = WorkerChannel(results, worker_id)
+    channel.send_devices([f"dev{worker_id}"])
+    channel.publish(
+        f"modpoll/dev{worker_id}/data", "restarted" if restarted else "first"
+    )
+    results.close()
+    results.join_thread()
+    os._exit(0 if restarted else 3)
+
+
+def _shard_args(config, rtu=None):
+    return Namespace(
+        config=config,
+        config_cache="",
+        timeout=3.0,
+        rtu=rtu,
+        rtu_baud=9600,
+        rtu_parity="none",
+        tcp="127.0.0.1",
+        tcp_port=502,
+        udp=None,
+    )
+
+
+def test_shard_configs():
+    args = _shard_args(["a.csv", "b.csv", "c.csv"])
+    everything = {"a.csv": [None], "b.csv": [None], "c.csv": [None]}
+    assert shard_configs(args, 1) == [everything]
+    # the devices without a transport all use the one --tcp endpoint
+    assert shard_configs(args, 2) == [everything]
+    args.rtu = "/dev/ttyUSB0"
+    assert shard_configs(args, 2) == [everything]
+
+
+def test_shard_configs_by_serial_port(tmp_path):
+    configs = []
+    for name, transport in [
+        ("a", "rtu:///dev/ttyUSB0"),
+        ("b", "tcp://10.0.0.5"),
+        ("c", "rtu:///dev/ttyUSB1"),
+        ("d", "rtu:///dev/ttyUSB0?baudrate=19200"),
+    ]:
+        file = tmp_path / f"{name}.csv"
+        file.write_text(
+            f"device,{name},1,,{transport}\npoll,holding_register,0,1,BE_BE\n"
+        )
+        configs.append(str(file))
+    a, b, c, d = configs
+    usb0, usb1, tcp = "rtu:///dev/ttyUSB0", "rtu:///dev/ttyUSB1", "tcp://10.0.0.5:502"
+    # devices on the same serial port stay together, whatever its settings
+    assert shard_configs(_shard_args(configs), 2) == [
+        {a: [usb0], d: [usb0]},
+        {b: [tcp], c: [usb1]},
+    ]
+    assert shard_configs(_shard_args(configs), 8) == [
+        {a: [usb0], d: [usb0]},
+        {b: [tcp]},
+        {c: [usb1]},
+    ]
+
+
+def test_shard_devices_of_one_config(tmp_path):
+    file = tmp_path / "site.csv"
+    file.write_text(
+        "device,meter01,1,,rtu:///dev/ttyUSB0\n"
+        "device,meter02,2,,rtu:///dev/ttyUSB0\n"
+        "device,plc01,1,,tcp://10.0.0.5\n"
+        "device,plc02,1\n"
+    )
+    config = str(file)
+    # one config is split by the endpoints of its devices
+    assert shard_configs(_shard_args([config]), 2) == [
+        {config: ["rtu:///dev/ttyUSB0"]},
+        {config: ["tcp://10.0.0.5:502", None]},
+    ]
+
+
+def test_worker_channel_drops_when_full():
+    results = queue.Queue(maxsize=1)
+    channel = WorkerChannel(results, 0)
+    channel.publish("modpoll/dev01/data", "{}")
+    channel.write("dev01", {"power": 1}, 100.0)
+    assert results.get_nowait() == ("publish", "modpoll/dev01/data", "{}", None, False)
+    assert channel.droppedCount == 1
+    # the drops are reported to the supervisor once there is room again
+    channel.write("dev01", {"power": 2}, 110.0)
+    assert results.get_nowait() == ("dropped", 0, 1)
+    assert channel.droppedCount == 2
+    channel.write("dev01", {"power": 3}, 120.0)
+    assert results.get_nowait() == ("dropped", 0, 1)
+    assert results.empty()
+
+
+def test_supervisor_routes_writes():
+    args = Namespace(mqtt_subscribe_topic_pattern="modpoll/+/set")
+    supervisor = Supervisor(args, [{"a.csv": [None]}, {"b.csv": [None]}])
+    for worker in supervisor.workers:
+        worker.requests = queue.Queue()
+    supervisor._handle_result(("devices", 1, ["dev01"]))
+    supervisor.route_write("modpoll/dev01/set", b"{}")
+    supervisor.route_write("modpoll/dev02/set", b"{}")
+    assert supervisor.workers[1].requests.get_nowait() == ("modpoll/dev01/set", b"{}")
+    assert supervisor.workers[0].requests.empty()
+
+    # a worker sends its devices again after reloading its config
+    supervisor._handle_result(("devices", 1, ["dev02"]))
+    supervisor.route_write("modpoll/dev01/set", b"{}")
+    supervisor.route_write("modpoll/dev02/set", b"{}")
+    assert supervisor.workers[1].requests.get_nowait() == ("modpoll/dev02/set", b"{}")
+    assert supervisor.workers[1].requests.empty()
+
+
+def test_worker_survives_bad_write_requests(monkeypatch):
+    modbus_handler = ModbusHandler(None, "test.csv")
+    modbus_handler.deviceList = modbus_handler._parse_config(
+        [["device", "dev01", "1"], ["poll", "holding_register", "0", "1", "BE_BE"]]
+    )
+    registry = DeviceRegistry([modbus_handler], "modpoll/+/set")
+    registry.match_topic = lambda topic: 1 / 0 if topic == "crash" else "dev01"
+    requests = queue.Queue()
+    for request in (("crash", b"{}"), ("modpoll/dev01/set", b"[1]")):
+        requests.put(request)
+    requests.put(
+        ("modpoll/dev01/set", b'{"object_type": "coil", "address": 0, "value": 1}')
+    )
+    requests.put(None)
+    # stop on the None request without stopping the other tests
+    stopped = []
+    monkeypatch.setattr(
+        "modpoll.supervisor.set_threading_event", lambda: stopped.append(1)
+    )
+    monkeypatch.setattr("modpoll.supervisor.on_threading_event", lambda: bool(stopped))
+    _receive_requests(requests, registry)
+    assert len(modbus_handler.write_queue) == 1
+
+
+def test_supervisor_restarts_crashed_worker(tmp_path):
+    args = Namespace(mqtt_subscribe_topic_pattern="modpoll/+/set")
+    publisher = FakePublisher()
+    shards = [{str(tmp_path / "worker0"): [None]}, {str(tmp_path / "worker1"): [None]}]
+    supervisor = Supervisor(
+        args, shards, publisher, restart_delay=0.05, target=crash_once_worker
+    )
+    supervisor.start()
+    supervisor.run()
+    supervisor.close()
+    assert sorted(publisher.messages) == [
+        ("modpoll/dev0/data", "first"),
+        ("modpoll/dev0/data", "restarted"),
+        ("modpoll/dev1/data", "first"),
+        ("modpoll/dev1/data", "restarted"),
+    ]
+    assert supervisor.get_stats() == {
+        "workers": 2,
+        "alive": 0,
+        "restarts": 2,
+        "dropped": 0,
+    }